@@ -0,0 +1,83 @@
+"""
+Compares the speed of the query compilers on a large synthetic database.
+
+Usage:
+    python3 bench/bench-compilers.py [ARTICLE-COUNT]
+"""
+
+import os.path
+import random
+import sys
+import tempfile
+import time
+
+import myweb.backend.db as db
+import myweb.backend.query as query
+
+ARTICLE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+TAG_COUNT = 500
+LINKS_PER_ARTICLE = 5
+TAGS_PER_ARTICLE = 3
+REPEAT = 5
+
+QUERIES = [
+    'tag-1',
+    'tag-1 AND tag-2',
+    'tag-1 OR tag-2 OR tag-3',
+    'NOT tag-1',
+    'domain:d7.com AND NOT tag-4',
+    'links:http://d1.com/1 OR linked:http://d1.com/1',
+    '(tag-1 OR tag-2) AND NOT (tag-3 OR domain:d3.com)',
+]
+
+def populate(rand):
+    """
+    Fills the database with articles that have random tags and links.
+    """
+    def generate_articles():
+        for i in range(ARTICLE_COUNT):
+            url = 'http://d{}.com/{}'.format(i % 100, i)
+            tags = set('tag-{}'.format(rand.randrange(TAG_COUNT))
+                for _ in range(TAGS_PER_ARTICLE))
+            links = set('http://d{0}.com/{1}'.format(j % 100, j)
+                for j in (rand.randrange(ARTICLE_COUNT)
+                    for _ in range(LINKS_PER_ARTICLE)))
+            yield (url, '', links, tags)
+
+    db.bulk_create_articles(generate_articles())
+    db.DB.execute('ANALYZE')
+
+def time_query(parsed, compiler):
+    """
+    Returns the best time out of several runs of the query, and its results.
+    """
+    best = None
+    for _ in range(REPEAT):
+        # Cached results would only measure the cache
+        db.invalidate_results()
+        start = time.perf_counter()
+        results = db.execute_query(parsed, compiler)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, results
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    db.load_database(os.path.join(temp_dir, 'bench.sqlite'))
+    populate(random.Random(0))
+
+    print('{} articles'.format(ARTICLE_COUNT))
+    print('{:<52} {:>10} {:>10}'.format('Query', *db.COMPILERS))
+    for query_text in QUERIES:
+        parsed = query.parse_query(query_text)
+        timings = []
+        answers = []
+        for compiler in db.COMPILERS:
+            elapsed, results = time_query(parsed, compiler)
+            timings.append('{:.2f}ms'.format(elapsed * 1000))
+            answers.append(results)
+
+        assert all(answer == answers[0] for answer in answers)
+        print('{:<52} {:>10} {:>10}'.format(query_text, *timings))
+
+    db.DB.close()
@@ -0,0 +1,90 @@
+"""
+Measures how long it takes to split articles into text and links, on
+documents of increasing size.
+
+Usage:
+    python3 bench/bench-links.py [MAX-LINKS]
+"""
+
+import re
+import sys
+import time
+
+from myweb.backend import db, utils
+
+MAX_LINKS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+LINK_COUNTS = [count for count in (10, 100, 1000, 10000, 100000)
+               if count <= MAX_LINKS]
+REPEAT = 5
+
+# The links are spread out through prose, like they would be in an article
+WORDS_BETWEEN_LINKS = 40
+
+OLD_URL_REGEX = re.compile(r'\[\[[^\]]+\]\]')
+
+def old_get_link_chunks(text):
+    """
+    The chunker as it was before it used finditer, which searched and
+    re-sliced whatever text was left after each link.
+    """
+    items = []
+    while text:
+        match = OLD_URL_REGEX.search(text)
+        if match is None:
+            items.append(utils.Text(text))
+            text = ''
+        else:
+            link_start, link_end = match.span()
+            items.append(utils.Text(text[:link_start]))
+            items.append(utils.Link(utils.normalize_url(
+                text[link_start + 2:link_end - 2])))
+            text = text[link_end:]
+
+    return items
+
+def make_document(link_count):
+    """
+    Makes up a document with the given number of links.
+    """
+    prose = ' '.join(['lorem'] * WORDS_BETWEEN_LINKS)
+    return ''.join('{} [[http://example.com/{}/]] '.format(prose, i)
+        for i in range(link_count))
+
+def best_time(function, *args):
+    """
+    Returns the best time out of several runs of a function, in milliseconds.
+    """
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+print('{:>8} {:>10} {:>14} {:>14} {:>18} {:>18} {:>14}'.format('Links',
+    'Size', 'Old chunks', 'Chunks', 'Links, then spans', 'Links from spans',
+    'Stored spans'))
+
+for link_count in LINK_COUNTS:
+    document = make_document(link_count)
+    assert old_get_link_chunks(document) == utils.get_link_chunks(document)
+
+    # Chunks rebuilt from the spans stored alongside an article, including
+    # unpacking them
+    stored_spans = db.encode_spans(utils.get_link_spans(document))
+
+    print('{:>8} {:>9.1f}K {:>12.2f}ms {:>12.2f}ms {:>16.2f}ms {:>16.2f}ms '
+          '{:>12.2f}ms'.format(
+        link_count, len(document) / 1024,
+        best_time(old_get_link_chunks, document),
+        best_time(utils.get_link_chunks, document),
+        # Saving an article needs both its links and their spans, which
+        # used to take a search of the content for each
+        best_time(lambda: (utils.get_links(document),
+                           utils.get_link_spans(document))),
+        best_time(lambda: utils.get_links(document,
+            utils.get_link_spans(document))),
+        best_time(lambda: utils.get_link_chunks(document,
+            db.decode_spans(stored_spans)))))
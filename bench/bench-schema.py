@@ -0,0 +1,104 @@
+"""
+Measures the size of the database and the speed of lookups on a large
+synthetic corpus, for comparing changes to the schema.
+
+Usage:
+    python3 bench/bench-schema.py [ARTICLE-COUNT]
+"""
+
+import os.path
+import random
+import sys
+import tempfile
+import time
+
+import myweb.backend.db as db
+
+ARTICLE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+TAG_COUNT = 500
+LINKS_PER_ARTICLE = 10
+TAGS_PER_ARTICLE = 3
+REPEAT = 5
+
+def article_url(i):
+    """
+    Makes up the URL of an article, about as long as a typical one.
+    """
+    return 'https://notes.example.com/projects/area-{}/note-{}'.format(
+        i % 100, i)
+
+QUERIES = [
+    'tag-1',
+    'tag-1 AND tag-2',
+    'NOT tag-1',
+    'links:' + article_url(1),
+    'linked:' + article_url(1),
+    '(tag-1 OR tag-2) AND links:' + article_url(1),
+    'reach:' + article_url(1) + ' depth:2',
+    'reach:' + article_url(1) + ' depth:4',
+]
+
+def generate_articles(rand):
+    """
+    Makes up articles with random tags and links.
+    """
+    for i in range(ARTICLE_COUNT):
+        tags = set('tag-{}'.format(rand.randrange(TAG_COUNT))
+            for _ in range(TAGS_PER_ARTICLE))
+        links = set(article_url(rand.randrange(ARTICLE_COUNT))
+            for _ in range(LINKS_PER_ARTICLE))
+        yield (article_url(i), 'note {}'.format(i), links, tags)
+
+def best_time(function, *args):
+    """
+    Returns the best time out of several runs of a function, in milliseconds.
+    """
+    best = None
+    for _ in range(REPEAT):
+        # Cached results would only measure the cache
+        db.invalidate_results()
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    path = os.path.join(temp_dir, 'bench.sqlite')
+    db.load_database(path)
+    rand = random.Random(0)
+    db.bulk_create_articles(generate_articles(rand))
+    db.DB.execute('VACUUM')
+    db.DB.execute('ANALYZE')
+
+    print('{} articles, {:.1f}MB'.format(ARTICLE_COUNT,
+        os.path.getsize(path) / (1024 * 1024)))
+    print('{:<80} {:>10}'.format('Lookup', 'Time'))
+    for query_text in QUERIES:
+        print('{:<80} {:>8.2f}ms'.format(query_text,
+            best_time(db.search, query_text)))
+
+    urls = [article_url(rand.randrange(ARTICLE_COUNT)) for _ in range(200)]
+    print('{:<80} {:>8.2f}ms'.format('get_articles (200 articles)',
+        best_time(db.get_articles, urls)))
+    print('{:<80} {:>8.2f}ms'.format('iter_articles',
+        best_time(lambda: sum(1 for _ in db.iter_articles()))))
+    for report in (db.get_dangling_links, db.get_orphans, db.get_tag_counts):
+        print('{:<80} {:>8.2f}ms'.format(report.__name__, best_time(report)))
+
+    start = time.perf_counter()
+    db.load_link_graph()
+    print('{:<80} {:>8.2f}ms'.format('load_link_graph',
+        (time.perf_counter() - start) * 1000))
+    print('{:<80} {:>8.2f}ms'.format('get_articles (200 articles, link graph)',
+        best_time(db.get_articles, urls)))
+    for depth in (2, 4):
+        reach_query = 'reach:{} depth:{}'.format(article_url(1), depth)
+        print('{:<80} {:>8.2f}ms'.format(reach_query + ' (link graph)',
+            best_time(db.search, reach_query)))
+    for report in (db.get_dangling_links, db.get_orphans):
+        print('{:<80} {:>8.2f}ms'.format(
+            '{} (link graph)'.format(report.__name__), best_time(report)))
+
+    db.POOL.close()
@@ -0,0 +1,91 @@
+"""
+Compares the throughput of storage profiles under a mix of reads and writes.
+
+Usage:
+    python3 bench/bench-storage.py [SECONDS]
+"""
+
+import os.path
+import sys
+import tempfile
+import threading
+import time
+
+from myweb.backend import config, db
+from myweb.backend.query import Tag
+
+DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+READERS = 4
+ARTICLE_COUNT = 2000
+
+PROFILES = {
+    'rollback': dict(config.STORAGE_DEFAULTS,
+        journal_mode='delete', synchronous='full'),
+    'default': config.STORAGE_DEFAULTS,
+}
+
+def populate():
+    """
+    Creates the articles which the readers look at.
+    """
+    for i in range(ARTICLE_COUNT):
+        db.create_article('http://bench.com/{}'.format(i), 'x' * 500,
+            {'http://bench.com/{}'.format(i + 1)}, {'tag-{}'.format(i % 10)})
+
+def run_profile(pragmas):
+    """
+    Runs readers and a writer against a fresh database, returning how many
+    reads and writes were done per second.
+    """
+    counts = {'reads': 0, 'writes': 0}
+    lock = threading.Lock()
+
+    # Set once the database is populated, so that populating it doesn't eat
+    # into the time measured
+    deadline = None
+
+    def reader(offset):
+        reads = 0
+        i = offset
+        while time.perf_counter() < deadline:
+            db.get_article('http://bench.com/{}'.format(i % ARTICLE_COUNT))
+            db.execute_query(Tag('tag-{}'.format(i % 10)))
+            reads += 2
+            i += 1
+        with lock:
+            counts['reads'] += reads
+
+    def writer():
+        writes = 0
+        while time.perf_counter() < deadline:
+            url = 'http://bench.com/{}'.format(writes % ARTICLE_COUNT)
+            db.update_article(url, str(writes), set(), {'tag-changed'})
+            writes += 1
+        with lock:
+            counts['writes'] += writes
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db.load_database(os.path.join(temp_dir, 'bench.sqlite'), pragmas)
+        populate()
+
+        threads = [threading.Thread(target=reader, args=(i * 100,))
+            for i in range(READERS)]
+        threads.append(threading.Thread(target=writer))
+
+        start = time.perf_counter()
+        deadline = start + DURATION
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        db.POOL.close()
+
+    return counts['reads'] / elapsed, counts['writes'] / elapsed
+
+print('{} readers, 1 writer, {}s per profile'.format(READERS, DURATION))
+print('{:<10} {:>12} {:>12}'.format('Profile', 'Reads/s', 'Writes/s'))
+for name, pragmas in PROFILES.items():
+    reads, writes = run_profile(pragmas)
+    print('{:<10} {:>12.0f} {:>12.0f}'.format(name, reads, writes))
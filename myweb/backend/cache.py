@@ -0,0 +1,90 @@
+"""
+A small bounded cache, which is used to avoid repeating work for queries and
+articles that are requested over and over.
+"""
+
+from collections import OrderedDict
+import threading
+
+class LRUCache:
+    """
+    A mapping which holds at most a fixed number of entries, throwing out the
+    least recently used entry when it gets too large.
+
+    If a sizing function is given, then the limit applies to the total size
+    of the values (as measured by that function) rather than to the number of
+    entries. This is useful for bounding the memory used by large values.
+
+    It keeps count of how many lookups it could and could not answer, so that
+    its size can be tuned. It is safe to share between threads.
+    """
+    def __init__(self, max_size, size_of=None):
+        self.max_size = max_size
+        self.size_of = size_of if size_of is not None else (lambda _: 1)
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """
+        Gets the value for a key, marking it as recently used, or returns the
+        default if the key is not in the cache.
+        """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entries if the cache
+        is full.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.size_of(self.entries[key])
+
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.size += self.size_of(value)
+
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.size_of(evicted)
+
+    def discard(self, key):
+        """
+        Removes the entry for a key, if there is one.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.size_of(self.entries.pop(key))
+
+    def clear(self):
+        """
+        Removes all of the entries, but keeps the hit and miss counts.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def hit_rate(self):
+        """
+        Gets the fraction of lookups which were answered by the cache.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
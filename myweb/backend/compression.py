@@ -0,0 +1,233 @@
+"""
+The codecs which can be used to compress the content of articles.
+
+Each article records the id of the codec that compressed it (and the id of
+the dictionary, for codecs which use one), so articles compressed by
+different codecs can live in the same database. The zstd and lz4 codecs are
+only available if the `zstandard' and `lz4' packages are installed.
+"""
+
+from collections import Counter
+import functools
+import re
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# How much zlib compresses the article data by
+ZLIB_LEVEL = 6
+
+# How much zstd compresses the article data by
+ZSTD_LEVEL = 9
+
+# How large trained dictionaries are - zlib can't make use of anything past
+# the last 32K of a dictionary
+DICTIONARY_SIZE = 32 * 1024
+
+# How many samples, and how many bytes of them, are needed to train a zstd
+# dictionary - zstd refuses to work from only a few samples, and a dictionary
+# larger than the text it was trained on isn't worth having
+ZSTD_MIN_SAMPLES = 8
+ZSTD_MIN_SAMPLE_BYTES = DICTIONARY_SIZE
+
+# The pieces of text which a zlib dictionary is built out of - runs of word
+# characters, along with the spaces and punctuation around them
+DICTIONARY_TOKEN = re.compile(rb'\W*\w+\W*')
+
+class Codec:
+    """
+    A way of compressing content. Subclasses provide:
+
+     - id, the number stored alongside each article
+     - name, which is used to refer to the codec in the configuration
+     - uses_dictionary, whether the codec needs a trained dictionary
+     - compress() and decompress(), which take bytes along with the
+       dictionary (or None, if the codec doesn't use one, or if no
+       dictionary has been trained yet)
+    """
+    uses_dictionary = False
+
+    def is_available(self):
+        """
+        Checks whether the modules which the codec needs are installed.
+        """
+        return True
+
+    def train(self, samples):
+        """
+        Builds a dictionary out of a list of sample articles, as bytes, or
+        returns None if there aren't enough samples to build one from.
+        @raise ValueError If the codec doesn't use a dictionary.
+        """
+        raise ValueError('The {} codec does not use a dictionary'.format(
+            self.name))
+
+class ZlibCodec(Codec):
+    """
+    The codec that articles were always compressed with before there were
+    other codecs.
+    """
+    id = 0
+    name = 'zlib'
+
+    def compress(self, data, dictionary):
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    def decompress(self, data, dictionary):
+        return zlib.decompress(data)
+
+class NoCodec(Codec):
+    """
+    Stores the content as it is, which is fastest to read.
+    """
+    id = 1
+    name = 'none'
+
+    def compress(self, data, dictionary):
+        return data
+
+    def decompress(self, data, dictionary):
+        return bytes(data)
+
+class ZlibDictionaryCodec(Codec):
+    """
+    zlib, primed with a dictionary of text that is common across articles.
+    Small articles don't have enough text of their own for zlib to find much
+    repetition in, but they can refer back to the dictionary.
+    """
+    id = 2
+    name = 'zlib-dict'
+    uses_dictionary = True
+
+    def compress(self, data, dictionary):
+        if dictionary:
+            compressor = zlib.compressobj(ZLIB_LEVEL, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(ZLIB_LEVEL)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data, dictionary):
+        if dictionary:
+            decompressor = zlib.decompressobj(zdict=dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def train(self, samples):
+        # Pick the pieces of text which would save the most if they could be
+        # referred to in the dictionary - zlib finds matches closest to the
+        # end of the dictionary most cheaply, so the best pieces go last
+        savings = Counter()
+        for sample in samples:
+            for token in DICTIONARY_TOKEN.findall(sample):
+                savings[token] += len(token)
+
+        dictionary = []
+        size = 0
+        for token, saving in savings.most_common():
+            # Pieces which only appear once aren't worth anything
+            if saving <= len(token):
+                break
+            if size + len(token) > DICTIONARY_SIZE:
+                continue
+
+            dictionary.append(token)
+            size += len(token)
+
+        return b''.join(reversed(dictionary))
+
+class ZstdCodec(Codec):
+    """
+    Zstandard, which decompresses much faster than zlib, and which can be
+    primed with a trained dictionary.
+    """
+    id = 3
+    name = 'zstd'
+    uses_dictionary = True
+
+    def is_available(self):
+        return zstandard is not None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def load_dictionary(dictionary):
+        """
+        Parses a dictionary, which is slow enough that it's worth only doing
+        once for each dictionary rather than once for each article.
+        """
+        return zstandard.ZstdCompressionDict(dictionary)
+
+    def compress(self, data, dictionary):
+        if dictionary:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL,
+                dict_data=self.load_dictionary(dictionary))
+        else:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return compressor.compress(data)
+
+    def decompress(self, data, dictionary):
+        if dictionary:
+            decompressor = zstandard.ZstdDecompressor(
+                dict_data=self.load_dictionary(dictionary))
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+        return decompressor.decompress(data)
+
+    def train(self, samples):
+        if (len(samples) < ZSTD_MIN_SAMPLES or
+                sum(map(len, samples)) < ZSTD_MIN_SAMPLE_BYTES):
+            return None
+
+        try:
+            return zstandard.train_dictionary(DICTIONARY_SIZE,
+                samples).as_bytes()
+        except zstandard.ZstdError:
+            # The samples can still be unsuitable, if they have too little in
+            # common for zstd to find anything worth keeping
+            return None
+
+class Lz4Codec(Codec):
+    """
+    LZ4, which compresses less than the others but is the fastest to
+    decompress.
+    """
+    id = 4
+    name = 'lz4'
+
+    def is_available(self):
+        return lz4 is not None
+
+    def compress(self, data, dictionary):
+        return lz4.frame.compress(data)
+
+    def decompress(self, data, dictionary):
+        return lz4.frame.decompress(data)
+
+CODECS = {codec.id: codec for codec in
+    (ZlibCodec(), NoCodec(), ZlibDictionaryCodec(), ZstdCodec(), Lz4Codec())}
+
+CODECS_BY_NAME = {codec.name: codec for codec in CODECS.values()}
+
+def get_codec(name):
+    """
+    Gets a codec by its name.
+    @raise KeyError If there is no codec by that name.
+    @raise ImportError If the codec needs a module which isn't installed.
+    """
+    try:
+        codec = CODECS_BY_NAME[name]
+    except KeyError:
+        raise KeyError('No such codec: ' + name)
+
+    if not codec.is_available():
+        raise ImportError('The {} codec needs a module which is not '
+            'installed'.format(name))
+    return codec
@@ -30,7 +30,22 @@ elif 'APPDATA' in os.environ:
     CONFIG_PATH = os.path.join(APPDATA, 'myweb', 'myweb.cfg')
     DB_PATH = os.path.join(APPDATA, 'myweb', 'myweb.sqlite')
 
-DEFAULTS = {'myweb': {'db': DB_PATH}}
+# The options in the [myweb] section which control how SQLite stores the
+# database - each of these is set as a PRAGMA when a connection is opened. WAL
+# journaling allows readers to keep going while an article is being written.
+STORAGE_DEFAULTS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': '-16000',
+    'mmap_size': '268435456',
+    'temp_store': 'memory',
+}
+
+# The codec which article content is compressed with - see
+# myweb.backend.compression for the others
+CODEC = 'zlib'
+
+DEFAULTS = {'myweb': dict(STORAGE_DEFAULTS, db=DB_PATH, codec=CODEC)}
 def load_config(defaults):
     """
     Loads the configuration file, filling any defaults as necessary.
@@ -64,3 +79,10 @@ def load_config(defaults):
         options[section] = section_options
 
     return options
+
+def storage_profile(options):
+    """
+    Gets the storage options out of a dict returned by `load_config', in the
+    form expected by `db.load_database'.
+    """
+    return {pragma: options['myweb'][pragma] for pragma in STORAGE_DEFAULTS}
@@ -3,18 +3,33 @@ An interface on top of a database, which stores articles along with associated
 metadata.
 """
 
+from array import array
+import base64
+import binascii
 from collections import namedtuple
+import hashlib
+import itertools
+import json
 import os
 import os.path
 import sqlite3
 import sys
-import zlib
+import threading
+import time
 
+import myweb.backend.cache as cache
+import myweb.backend.compression as compression
+import myweb.backend.graph as graph
+import myweb.backend.optimize as optimize
+import myweb.backend.pool as pool
 import myweb.backend.query as query
 import myweb.backend.utils as utils
 
 # The connected database - there's meant to be only one, which is why this is a
-# module and not a class
+# module and not a class. `POOL' hands out connections to it; `DB' and `CURSOR'
+# are the writing connection and a cursor on it, for code which used them
+# before there was a pool.
+POOL = None
 DB = None
 CURSOR = None
 
@@ -27,12 +42,115 @@ else:
     print('Cannot find suitable location for database - set either $HOME or %APPDATA%')
     sys.exit(1)
 
-# How much to compress the article data by
-COMPRESS = 6
+# The codec which new articles are compressed with - see `set_codec'
+CODEC = compression.CODECS_BY_NAME['zlib']
 
-# How to package results returned by 'get_article'
-Article = namedtuple('Article',
-        ['url', 'content', 'links', 'backlinks', 'tags'])
+# The trained dictionaries which have been read from the database, by their
+# ids, and the id of the most recently trained dictionary for each codec
+DICTIONARIES = {}
+LATEST_DICTIONARIES = {}
+
+# The in-memory index of links between articles, which is only kept by
+# processes that call `load_link_graph' - see myweb.backend.graph
+GRAPH = None
+
+# The data version of the writing connection when the link graph was loaded
+GRAPH_VERSION = None
+
+# How many articles are sampled to train a dictionary
+DICTIONARY_SAMPLES = 1000
+
+# How many articles `recompress_articles' rewrites in each transaction
+RECOMPRESS_BATCH_SIZE = 500
+
+# The version of the schema that this module writes, which is stored in the
+# database as `PRAGMA user_version'. Older databases are upgraded by
+# `migrate_database' when they are loaded.
+SCHEMA_VERSION = 9
+
+# The most rows that are counted when estimating the size of a query term -
+# beyond this, terms are considered equally unselective
+ESTIMATE_LIMIT = 10000
+
+# How many articles `bulk_create_articles' inserts with each statement
+BULK_BATCH_SIZE = 1000
+
+# How many articles `get_articles' looks up with each statement - each URL is
+# a parameter four times over, and older versions of SQLite allow at most 999
+# parameters in a statement
+GET_BATCH_SIZE = 200
+
+# How many compiled queries are kept by `search' and `execute_query'
+QUERY_CACHE_SIZE = 256
+QUERY_CACHE = cache.LRUCache(QUERY_CACHE_SIZE)
+
+# How many bytes worth of URLs are kept by `execute_query', and how much each
+# URL and each result costs on top of the URL text itself
+RESULT_CACHE_SIZE = 16 * 1024 * 1024
+RESULT_OVERHEAD = 64
+result_size = (lambda urls:
+    RESULT_OVERHEAD * (len(urls) + 1) + sum(len(url) for url in urls))
+RESULT_CACHE = cache.LRUCache(RESULT_CACHE_SIZE, result_size)
+
+# How many URLs `search_page' returns if it isn't given a limit
+SEARCH_PAGE_SIZE = 100
+
+# How many URLs `iter_search' reads at a time
+SEARCH_BATCH_SIZE = 1000
+
+# Incremented whenever the articles change, so that a query which started
+# before a change doesn't cache its (possibly stale) results after it
+GENERATION = 0
+RESULT_LOCK = threading.Lock()
+
+# How to package results returned by 'search_page' - `token' is None once
+# there are no more URLs
+SearchPage = namedtuple('SearchPage', ['urls', 'token'])
+
+# How to package results returned by 'get_article_version'
+ArticleVersion = namedtuple('ArticleVersion', ['id', 'version', 'modified'])
+
+# The typecode of the offsets in an article's stored link spans - see
+# `encode_spans'
+SPAN_TYPE = 'I'
+
+class Article(namedtuple('Article',
+        ['url', 'content', 'links', 'backlinks', 'tags'])):
+    """
+    How to package results returned by 'get_article'.
+
+    Articles read from the database also have the spans of their links (see
+    `utils.get_link_spans'), if they were stored, so that they can be split
+    into chunks without searching the content. The spans are derived from the
+    content, so they are kept out of the tuple, and don't count when
+    comparing articles.
+
+    Articles from `iter_articles' also have the time they were last modified,
+    if it was recorded, which is kept out of the tuple for the same reason.
+    """
+    spans = None
+    modified = None
+
+    def chunks(self):
+        """
+        Goes through the article's text and links, as
+        `utils.iter_link_chunks' does.
+        """
+        return utils.iter_link_chunks(self.content, self.spans)
+
+# The ids of the URLs which can be reached by following at most some number
+# of links from a URL, given the URL and the number of links. The depth of
+# each URL is kept so that the recursion stops, even when the links form a
+# cycle - since UNION drops rows which have already been seen, each URL is
+# only visited once for each depth that it can be reached at.
+REACHED_IDS = '''
+WITH RECURSIVE REACHED(Id, Depth) AS (
+    SELECT Id, 0 FROM URLS WHERE Url = ?
+    UNION
+    SELECT LINKS.LinkedId, REACHED.Depth + 1 FROM REACHED
+    JOIN LINKS ON LINKS.UrlId = REACHED.Id
+    WHERE REACHED.Depth < ?)
+SELECT DISTINCT Id FROM REACHED WHERE Depth > 0'''
 
 class Queries:
     "Longer queries are stored here, rather than inline, for readability"
@@ -46,38 +164,616 @@ CREATE TABLE IF NOT EXISTS LINKS(Url STRING, Linked STRING,
     create_tags_table = '''
 CREATE TABLE IF NOT EXISTS TAGS(Url STRING, Tag STRING, 
         PRIMARY KEY (Url, Tag))'''
+    create_linked_index = '''
+CREATE INDEX IF NOT EXISTS LINKS_LINKED ON LINKS(Linked)'''
+    create_tag_index = '''
+CREATE INDEX IF NOT EXISTS TAGS_TAG ON TAGS(Tag)'''
+    create_domain_index = '''
+CREATE INDEX IF NOT EXISTS ARTICLES_DOMAIN ON ARTICLES(Domain)'''
+    create_article_table_with_id = '''
+CREATE TABLE ARTICLES_WITH_ID(Id INTEGER PRIMARY KEY,
+        Url STRING UNIQUE,
+        Article BLOB,
+        Domain STRING)'''
+    create_article_table_with_text_url = '''
+CREATE TABLE ARTICLES_WITH_TEXT_URL(Id INTEGER PRIMARY KEY,
+        Url TEXT UNIQUE,
+        Article BLOB,
+        Domain TEXT,
+        Codec INTEGER NOT NULL DEFAULT 0,
+        Dictionary INTEGER,
+        Hash BLOB,
+        Spans BLOB,
+        Version INTEGER NOT NULL DEFAULT 0,
+        Modified REAL)'''
+    create_text_table = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS ARTICLES_TEXT USING fts5(Content,
+    content='')'''
+    create_dictionary_table = '''
+CREATE TABLE IF NOT EXISTS DICTIONARIES(Id INTEGER PRIMARY KEY,
+        Codec INTEGER,
+        Data BLOB)'''
+    create_url_table = '''
+CREATE TABLE URLS(Id INTEGER PRIMARY KEY, Url TEXT UNIQUE)'''
+    create_tag_name_table = '''
+CREATE TABLE TAG_NAMES(Id INTEGER PRIMARY KEY, Tag TEXT UNIQUE)'''
+    create_link_id_table = '''
+CREATE TABLE LINK_IDS(UrlId INTEGER, LinkedId INTEGER,
+        PRIMARY KEY (UrlId, LinkedId)) WITHOUT ROWID'''
+    create_tag_id_table = '''
+CREATE TABLE TAG_IDS(UrlId INTEGER, TagId INTEGER,
+        PRIMARY KEY (UrlId, TagId)) WITHOUT ROWID'''
+    create_linked_id_index = '''
+CREATE INDEX IF NOT EXISTS LINKS_LINKED ON LINKS(LinkedId)'''
+    create_tag_id_index = '''
+CREATE INDEX IF NOT EXISTS TAGS_TAG ON TAGS(TagId)'''
+    intern_url = '''
+INSERT OR IGNORE INTO URLS(Url) VALUES (?)'''
+    intern_tag = '''
+INSERT OR IGNORE INTO TAG_NAMES(Tag) VALUES (?)'''
+    insert_article = '''
+INSERT INTO ARTICLES(Id, Url, Article, Domain, Codec, Dictionary, Hash, Spans,
+    Modified)
+VALUES ((SELECT Id FROM URLS WHERE Url = ?1), ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8)'''
+    insert_link = '''
+INSERT INTO LINKS(UrlId, LinkedId)
+SELECT (SELECT Id FROM URLS WHERE Url = ?), Id FROM URLS WHERE Url = ?'''
+    insert_tag = '''
+INSERT INTO TAGS(UrlId, TagId)
+SELECT (SELECT Id FROM URLS WHERE Url = ?), Id FROM TAG_NAMES WHERE Tag = ?'''
+    delete_links = '''
+DELETE FROM LINKS WHERE UrlId = (SELECT Id FROM URLS WHERE Url = ?)'''
+    delete_tags = '''
+DELETE FROM TAGS WHERE UrlId = (SELECT Id FROM URLS WHERE Url = ?)'''
+    update_article = '''
+UPDATE ARTICLES SET Article = ?, Codec = ?, Dictionary = ?, Hash = ?,
+    Spans = ?
+WHERE Url = ?'''
+    touch_article = '''
+UPDATE ARTICLES SET Version = Version + 1, Modified = ? WHERE Id = ?'''
+    touch_neighbours = '''
+UPDATE ARTICLES SET Version = Version + 1, Modified = ?1
+WHERE Id IN (SELECT LinkedId FROM LINKS WHERE UrlId = ?2
+    UNION SELECT UrlId FROM LINKS WHERE LinkedId = ?2)'''
+    create_new_ids_table = '''
+CREATE TEMP TABLE IF NOT EXISTS NEW_IDS(Id INTEGER PRIMARY KEY)'''
+    insert_new_id = '''
+INSERT OR IGNORE INTO temp.NEW_IDS SELECT Id FROM URLS WHERE Url = ?'''
+    touch_new_neighbours = '''
+UPDATE ARTICLES SET Version = Version + 1, Modified = ?
+WHERE Id IN (SELECT LinkedId FROM LINKS WHERE UrlId IN temp.NEW_IDS
+    UNION SELECT UrlId FROM LINKS WHERE LinkedId IN temp.NEW_IDS)'''
+    create_new_values_table = '''
+CREATE TEMP TABLE IF NOT EXISTS NEW_VALUES(Value TEXT PRIMARY KEY)'''
+    insert_new_value = '''
+INSERT OR IGNORE INTO temp.NEW_VALUES VALUES (?)'''
+    intern_new_values = '''
+INSERT OR IGNORE INTO {names}({name}) SELECT Value FROM temp.NEW_VALUES'''
+    delete_old_values = '''
+DELETE FROM {table} WHERE UrlId = ? AND {column} NOT IN
+    (SELECT Id FROM {names} WHERE {name} IN (SELECT Value FROM temp.NEW_VALUES))'''
+    insert_new_values = '''
+INSERT OR IGNORE INTO {table}(UrlId, {column})
+SELECT ?, Id FROM {names} WHERE {name} IN (SELECT Value FROM temp.NEW_VALUES)'''
+    insert_text = '''
+INSERT INTO ARTICLES_TEXT(rowid, Content) VALUES (?, ?)'''
+    insert_text_by_url = '''
+INSERT INTO ARTICLES_TEXT(rowid, Content)
+SELECT Id, ? FROM ARTICLES WHERE Url = ?'''
+    delete_text = '''
+INSERT INTO ARTICLES_TEXT(ARTICLES_TEXT, rowid, Content)
+VALUES ('delete', ?, ?)'''
+    get_stored_content = '''
+SELECT Article, Codec, Dictionary FROM ARTICLES WHERE Id = ?'''
+    rank_text = '''
+SELECT ARTICLES.Url FROM ARTICLES_TEXT
+JOIN ARTICLES ON ARTICLES.Id = ARTICLES_TEXT.rowid
+WHERE ARTICLES_TEXT MATCH ?
+ORDER BY ARTICLES_TEXT.rank'''
+    # One page of the results of a compiled query, in order - either the
+    # first page, or the page after a given URL
+    first_page = '''
+SELECT Url FROM ({query}) ORDER BY Url LIMIT ?'''
+    next_page = '''
+SELECT Url FROM ({query}) WHERE Url > ? ORDER BY Url LIMIT ?'''
     search_base_query = '''
 SELECT ARTICLES.Url FROM ARTICLES 
 WHERE '''
     count_matching_urls = '''
 SELECT COUNT(Articles.Url) FROM ARTICLES WHERE Url = ?'''
+    get_article_parts = '''
+SELECT 0, Url, Article, Codec, Dictionary, Spans FROM ARTICLES
+    WHERE Url IN ({urls})
+UNION ALL SELECT 1, URLS.Url, TAG_NAMES.Tag, NULL, NULL, NULL FROM URLS
+    JOIN TAGS ON TAGS.UrlId = URLS.Id
+    JOIN TAG_NAMES ON TAG_NAMES.Id = TAGS.TagId
+    WHERE URLS.Url IN ({urls})
+UNION ALL SELECT 2, Source.Url, Target.Url, NULL, NULL, NULL FROM URLS AS Source
+    JOIN LINKS ON LINKS.UrlId = Source.Id
+    JOIN URLS AS Target ON Target.Id = LINKS.LinkedId
+    WHERE Source.Url IN ({urls})
+UNION ALL SELECT 3, Target.Url, Source.Url, NULL, NULL, NULL FROM URLS AS Target
+    JOIN LINKS ON LINKS.LinkedId = Target.Id
+    JOIN URLS AS Source ON Source.Id = LINKS.UrlId
+    WHERE Target.Url IN ({urls})'''
+    get_article_contents_and_tags = '''
+SELECT 0, Url, Article, Codec, Dictionary, Spans FROM ARTICLES
+    WHERE Url IN ({urls})
+UNION ALL SELECT 1, URLS.Url, TAG_NAMES.Tag, NULL, NULL, NULL FROM URLS
+    JOIN TAGS ON TAGS.UrlId = URLS.Id
+    JOIN TAG_NAMES ON TAG_NAMES.Id = TAGS.TagId
+    WHERE URLS.Url IN ({urls})'''
+    get_linked_urls = '''
+SELECT URLS.Id, URLS.Url FROM LINKS
+JOIN URLS ON URLS.Id = LINKS.LinkedId
+WHERE LINKS.UrlId = ?'''
+    iter_articles = '''
+SELECT Id, Url, Article, Codec, Dictionary, Spans, Modified FROM ARTICLES
+ORDER BY Id'''
+    iter_tags = '''
+SELECT TAGS.UrlId, TAG_NAMES.Tag FROM TAGS
+CROSS JOIN TAG_NAMES ON TAG_NAMES.Id = TAGS.TagId
+ORDER BY TAGS.UrlId'''
+    iter_links = '''
+SELECT LINKS.UrlId, URLS.Url FROM LINKS
+CROSS JOIN URLS ON URLS.Id = LINKS.LinkedId
+ORDER BY LINKS.UrlId'''
+    get_dangling_links = '''
+SELECT Source.Url, Target.Url FROM LINKS
+LEFT JOIN ARTICLES ON ARTICLES.Id = LINKS.LinkedId
+CROSS JOIN URLS AS Source ON Source.Id = LINKS.UrlId
+CROSS JOIN URLS AS Target ON Target.Id = LINKS.LinkedId
+WHERE ARTICLES.Id IS NULL'''
+    get_dangling_links_from = '''
+SELECT Source.Url, Target.Url FROM URLS AS Source
+JOIN LINKS ON LINKS.UrlId = Source.Id
+JOIN URLS AS Target ON Target.Id = LINKS.LinkedId
+WHERE Source.Url IN ({urls})
+AND NOT EXISTS (SELECT 1 FROM ARTICLES WHERE ARTICLES.Id = LINKS.LinkedId)'''
+    get_orphans = '''
+SELECT Url FROM ARTICLES
+WHERE NOT EXISTS (SELECT 1 FROM LINKS
+    WHERE LinkedId = ARTICLES.Id AND UrlId != ARTICLES.Id)'''
+    get_tag_counts = '''
+SELECT TAG_NAMES.Tag, COUNT(*) FROM TAGS
+JOIN TAG_NAMES ON TAG_NAMES.Id = TAGS.TagId
+GROUP BY TAGS.TagId'''
     check_tag = '''
-EXISTS (SELECT 1 FROM TAGS WHERE Tag = ? AND Url = ARTICLES.Url)'''
+EXISTS (SELECT 1 FROM TAGS
+    WHERE TagId = (SELECT Id FROM TAG_NAMES WHERE Tag = ?)
+    AND UrlId = ARTICLES.Id)'''
     check_domain = '''
 ARTICLES.Domain = ?'''
     check_links = '''
-EXISTS (SELECT 1 FROM LINKS WHERE Linked = ? AND Url = ARTICLES.Url)'''
+EXISTS (SELECT 1 FROM LINKS
+    WHERE LinkedId = (SELECT Id FROM URLS WHERE Url = ?)
+    AND UrlId = ARTICLES.Id)'''
     check_linked = '''
-EXISTS (SELECT 1 FROM LINKS WHERE Url = ? AND Linked = ARTICLES.Url)'''
+EXISTS (SELECT 1 FROM LINKS
+    WHERE UrlId = (SELECT Id FROM URLS WHERE Url = ?)
+    AND LinkedId = ARTICLES.Id)'''
     check_url = '''
 ARTICLES.Url = ?'''
+    check_text = '''
+ARTICLES.Id IN (SELECT rowid FROM ARTICLES_TEXT WHERE ARTICLES_TEXT MATCH ?)'''
+    check_reach = '''
+ARTICLES.Id IN ({reached})'''.format(reached=REACHED_IDS)
+    check_reach_graph = '''
+ARTICLES.Url IN (SELECT value FROM json_each(?))'''
+    check_nothing = '''
+0'''
+    check_everything = '''
+1'''
+    set_all_articles = '''
+SELECT Url FROM ARTICLES'''
+    set_tag = '''
+SELECT Url FROM ARTICLES WHERE Id IN (SELECT UrlId FROM TAGS
+    WHERE TagId = (SELECT Id FROM TAG_NAMES WHERE Tag = ?))'''
+    set_domain = '''
+SELECT Url FROM ARTICLES WHERE Domain = ?'''
+    set_links = '''
+SELECT Url FROM ARTICLES WHERE Id IN (SELECT UrlId FROM LINKS
+    WHERE LinkedId = (SELECT Id FROM URLS WHERE Url = ?))'''
+    set_linked = '''
+SELECT Url FROM ARTICLES WHERE Id IN (SELECT LinkedId FROM LINKS
+    WHERE UrlId = (SELECT Id FROM URLS WHERE Url = ?))'''
+    set_url = '''
+SELECT Url FROM ARTICLES WHERE Url = ?'''
+    set_text = '''
+SELECT Url FROM ARTICLES WHERE Id IN
+    (SELECT rowid FROM ARTICLES_TEXT WHERE ARTICLES_TEXT MATCH ?)'''
+    set_reach = '''
+SELECT Url FROM ARTICLES WHERE Id IN ({reached})'''.format(reached=REACHED_IDS)
+    set_reach_graph = '''
+SELECT Url FROM ARTICLES WHERE Url IN (SELECT value FROM json_each(?))'''
+    set_nothing = '''
+SELECT Url FROM ARTICLES WHERE 0'''
+    estimate_tag = '''
+SELECT COUNT(*) FROM (SELECT 1 FROM TAGS
+    WHERE TagId = (SELECT Id FROM TAG_NAMES WHERE Tag = ?) LIMIT ?)'''
+    estimate_domain = '''
+SELECT COUNT(*) FROM (SELECT 1 FROM ARTICLES WHERE Domain = ? LIMIT ?)'''
+    estimate_links = '''
+SELECT COUNT(*) FROM (SELECT 1 FROM LINKS
+    WHERE LinkedId = (SELECT Id FROM URLS WHERE Url = ?) LIMIT ?)'''
+    estimate_linked = '''
+SELECT COUNT(*) FROM (SELECT 1 FROM LINKS
+    WHERE UrlId = (SELECT Id FROM URLS WHERE Url = ?) LIMIT ?)'''
+    estimate_text = '''
+SELECT COUNT(*) FROM
+    (SELECT 1 FROM ARTICLES_TEXT WHERE ARTICLES_TEXT MATCH ? LIMIT ?)'''
+    estimate_reach = '''
+SELECT COUNT(*) FROM ({reached} LIMIT ?)'''.format(reached=REACHED_IDS)
+    estimate_everything = '''
+SELECT MAX(rowid) FROM ARTICLES'''
+
+# The secondary indexes, which `bulk_create_articles' can drop while importing
+# and rebuild afterwards
+DEFERRABLE_INDEXES = {
+    'LINKS_LINKED': Queries.create_linked_id_index,
+    'TAGS_TAG': Queries.create_tag_id_index,
+    'ARTICLES_DOMAIN': Queries.create_domain_index,
+}
 
-def load_database(path):
+def load_database(path, pragmas=None, codec=None):
     """
     Loads the database from a file, which is then used for the whole module.
-    @note The globals `DB` and `CURSOR` are configured here.
+
+    The pragmas are the storage options (see `pool.PRAGMAS') which are set on
+    each connection to the database - `config.storage_profile' produces them
+    from the configuration file. The codec is the name of the codec which
+    new articles are compressed with (see `set_codec').
+    @note The globals `POOL`, `DB` and `CURSOR` are configured here.
     """
-    global DB
-    DB = sqlite3.connect(path)
+    if codec is not None:
+        set_codec(codec)
+
+    global POOL, DB, CURSOR, GRAPH
+    if POOL is not None:
+        POOL.close()
+
+    # The link graph belongs to whatever database was loaded before - the
+    # caller can load a new one once this database is ready
+    GRAPH = None
 
-    global CURSOR
+    POOL = pool.ConnectionPool(path, pragmas)
+    DB = POOL.writer
     CURSOR = DB.cursor()
 
     # Create the requisite tables - the tables are documented in schema.markdown
     # for the relationships and meaning between these tables.
-    CURSOR.execute(Queries.create_article_table)
-    CURSOR.execute(Queries.create_links_table)
-    CURSOR.execute(Queries.create_tags_table)
+    with POOL.write() as cursor:
+        cursor.execute(Queries.create_article_table)
+        cursor.execute(Queries.create_links_table)
+        cursor.execute(Queries.create_tags_table)
+
+    migrate_database(DB)
+    load_dictionaries()
+
+    # Any cached results came from whatever database was loaded before
+    invalidate_results()
+
+def migrate_to_1(cursor):
+    """
+    Adds secondary indexes for backlink, tag and domain lookups, which would
+    otherwise have to scan the whole table since they don't use the leftmost
+    column of the primary key.
+    """
+    cursor.execute(Queries.create_linked_index)
+    cursor.execute(Queries.create_tag_index)
+    cursor.execute(Queries.create_domain_index)
+
+def migrate_to_2(cursor):
+    """
+    Adds the full-text index of article content.
+
+    The index refers to articles by their rowid, so ARTICLES has to be
+    rebuilt with an INTEGER PRIMARY KEY first - otherwise, a VACUUM could
+    renumber the articles out from under the index. The index is only
+    created here, and filled by `migrate_to_8', which builds it again
+    anyway.
+    """
+    cursor.execute(Queries.create_article_table_with_id)
+    cursor.execute('''
+INSERT INTO ARTICLES_WITH_ID(Url, Article, Domain)
+SELECT Url, Article, Domain FROM ARTICLES''')
+    cursor.execute('DROP TABLE ARTICLES')
+    cursor.execute('ALTER TABLE ARTICLES_WITH_ID RENAME TO ARTICLES')
+    cursor.execute(Queries.create_domain_index)
+
+    cursor.execute(Queries.create_text_table)
+
+def migrate_to_3(cursor):
+    """
+    Records which codec (and which dictionary, if any) compressed each
+    article. Every article that already exists was compressed with zlib.
+    """
+    cursor.execute('''
+ALTER TABLE ARTICLES ADD COLUMN Codec INTEGER NOT NULL DEFAULT {:d}'''.format(
+        compression.ZlibCodec.id))
+    cursor.execute('ALTER TABLE ARTICLES ADD COLUMN Dictionary INTEGER')
+    cursor.execute(Queries.create_dictionary_table)
+
+def migrate_to_4(cursor):
+    """
+    Records a hash of each article's content, so that `update_article' can
+    tell when the content hasn't changed. Existing articles are left without
+    a hash, and are treated as changed the next time they are updated.
+    """
+    cursor.execute('ALTER TABLE ARTICLES ADD COLUMN Hash BLOB')
+
+def migrate_to_5(cursor):
+    """
+    Replaces the URLs and tags in LINKS and TAGS with integer ids, which take
+    up less space and are quicker to compare than strings.
+
+    Each URL is stored once in URLS, and each tag once in TAG_NAMES. An
+    article's URL has the same id as the article itself, so that queries can
+    go from LINKS and TAGS to ARTICLES without looking up any URLs.
+    """
+    cursor.execute(Queries.create_url_table)
+    cursor.execute('INSERT INTO URLS(Id, Url) SELECT Id, Url FROM ARTICLES')
+    cursor.execute('''
+INSERT OR IGNORE INTO URLS(Url)
+SELECT Url FROM LINKS UNION SELECT Linked FROM LINKS UNION SELECT Url FROM TAGS''')
+    cursor.execute(Queries.create_tag_name_table)
+    cursor.execute('INSERT OR IGNORE INTO TAG_NAMES(Tag) SELECT Tag FROM TAGS')
+
+    # The old columns are STRING, which has numeric affinity - comparing them
+    # to the TEXT columns directly would keep SQLite from using the indexes
+    # on URLS and TAG_NAMES, making this take quadratic time
+    cursor.execute(Queries.create_link_id_table)
+    cursor.execute('''
+INSERT INTO LINK_IDS(UrlId, LinkedId)
+SELECT Source.Id, Target.Id FROM LINKS
+JOIN URLS AS Source ON Source.Url = CAST(LINKS.Url AS TEXT)
+JOIN URLS AS Target ON Target.Url = CAST(LINKS.Linked AS TEXT)''')
+    cursor.execute('DROP TABLE LINKS')
+    cursor.execute('ALTER TABLE LINK_IDS RENAME TO LINKS')
+    cursor.execute(Queries.create_linked_id_index)
+
+    cursor.execute(Queries.create_tag_id_table)
+    cursor.execute('''
+INSERT INTO TAG_IDS(UrlId, TagId)
+SELECT URLS.Id, TAG_NAMES.Id FROM TAGS
+JOIN URLS ON URLS.Url = CAST(TAGS.Url AS TEXT)
+JOIN TAG_NAMES ON TAG_NAMES.Tag = CAST(TAGS.Tag AS TEXT)''')
+    cursor.execute('DROP TABLE TAGS')
+    cursor.execute('ALTER TABLE TAG_IDS RENAME TO TAGS')
+    cursor.execute(Queries.create_tag_id_index)
+
+def migrate_to_6(cursor):
+    """
+    Stores where the links are in each article's content, so that articles
+    don't have to be searched for links every time they are shown. Existing
+    articles are left without spans until they are next saved, and are
+    searched as they always were.
+    """
+    cursor.execute('ALTER TABLE ARTICLES ADD COLUMN Spans BLOB')
+
+def migrate_to_7(cursor):
+    """
+    Gives each article a version, which goes up whenever anything shown
+    along with the article changes, and the time that happened. Existing
+    articles start at version 0, with no time.
+    """
+    cursor.execute(
+        'ALTER TABLE ARTICLES ADD COLUMN Version INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('ALTER TABLE ARTICLES ADD COLUMN Modified REAL')
+
+def migrate_to_8(cursor):
+    """
+    Rebuilds the full-text index without a copy of each article's content,
+    which it kept uncompressed alongside the compressed copy in ARTICLES.
+    """
+    cursor.execute('DROP TABLE ARTICLES_TEXT')
+    cursor.execute(Queries.create_text_table)
+
+    # The dictionaries haven't been loaded yet, and reading them through the
+    # pool would have to wait for this transaction
+    dictionaries = dict(cursor.connection.execute(
+        'SELECT Id, Data FROM DICTIONARIES'))
+    articles = cursor.connection.execute(
+        'SELECT Id, Article, Codec, Dictionary FROM ARTICLES')
+    for article_id, data, codec_id, dictionary_id in articles:
+        codec = compression.CODECS[codec_id]
+        content = codec.decompress(data,
+            dictionaries.get(dictionary_id)).decode('utf-8')
+        cursor.execute(Queries.insert_text, (article_id, content))
+
+def migrate_to_9(cursor):
+    """
+    Rebuilds ARTICLES with TEXT columns for the Url and Domain. They were
+    STRING, which has numeric affinity, so an article whose URL looks like a
+    number (say, '2024') had it stored as a number and read back as an int.
+    """
+    cursor.execute(Queries.create_article_table_with_text_url)
+    cursor.execute('''
+INSERT INTO ARTICLES_WITH_TEXT_URL(Id, Url, Article, Domain, Codec, Dictionary,
+    Hash, Spans, Version, Modified)
+SELECT Id, CAST(Url AS TEXT), Article, CAST(Domain AS TEXT), Codec, Dictionary,
+    Hash, Spans, Version, Modified
+FROM ARTICLES''')
+    cursor.execute('DROP TABLE ARTICLES')
+    cursor.execute('ALTER TABLE ARTICLES_WITH_TEXT_URL RENAME TO ARTICLES')
+    cursor.execute(Queries.create_domain_index)
+
+# The migrations which upgrade the schema - the migration at index N upgrades
+# a database from version N to version N + 1.
+MIGRATIONS = [
+    migrate_to_1,
+    migrate_to_2,
+    migrate_to_3,
+    migrate_to_4,
+    migrate_to_5,
+    migrate_to_6,
+    migrate_to_7,
+    migrate_to_8,
+    migrate_to_9,
+]
+
+def migrate_database(connection):
+    """
+    Upgrades the schema of a database to `SCHEMA_VERSION', by running all of
+    the migrations it is missing inside of a single transaction.
+    @raise ValueError If the database is newer than this module.
+    """
+    cursor = connection.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise ValueError(
+            'Database schema version {} is newer than supported version {}'
+                .format(version, SCHEMA_VERSION))
+    elif version == SCHEMA_VERSION:
+        return
+
+    cursor.execute('BEGIN')
+    try:
+        for migration in MIGRATIONS[version:]:
+            migration(cursor)
+
+        # PRAGMA statements can't be parameterized, but this is always an int
+        cursor.execute('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION))
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+def set_codec(name):
+    """
+    Changes the codec which new and updated articles are compressed with.
+    Articles which are already stored keep their codec until they are
+    rewritten, or until `recompress_articles' is run.
+    @raise KeyError If there is no codec by that name.
+    @raise ImportError If the codec needs a module which isn't installed.
+    """
+    global CODEC
+    CODEC = compression.get_codec(name)
+
+def load_dictionaries():
+    """
+    Reads the trained dictionaries out of the database.
+    """
+    DICTIONARIES.clear()
+    LATEST_DICTIONARIES.clear()
+    with POOL.read() as connection:
+        for dictionary_id, codec_id, data in connection.execute(
+                'SELECT Id, Codec, Data FROM DICTIONARIES ORDER BY Id'):
+            DICTIONARIES[dictionary_id] = data
+            LATEST_DICTIONARIES[codec_id] = dictionary_id
+
+def get_dictionary(dictionary_id):
+    """
+    Gets the data of a dictionary by its id, or None if the id is None.
+    """
+    if dictionary_id is None:
+        return None
+
+    # Another process may have trained a dictionary since this one loaded the
+    # database, so anything that's missing has to be looked for again
+    if dictionary_id not in DICTIONARIES:
+        with POOL.read() as connection:
+            row = connection.execute(
+                'SELECT Data FROM DICTIONARIES WHERE Id = ?',
+                (dictionary_id,)).fetchone()
+        if row is None:
+            raise KeyError('Database has no dictionary {}'.format(dictionary_id))
+        DICTIONARIES[dictionary_id] = row[0]
+
+    return DICTIONARIES[dictionary_id]
+
+def encode_content(content, codec=None):
+    """
+    Compresses the content of an article, returning a tuple of the compressed
+    bytes, the codec's id and the dictionary's id (which is None if the
+    codec doesn't use one).
+    """
+    if codec is None:
+        codec = CODEC
+
+    dictionary_id = None
+    if codec.uses_dictionary:
+        dictionary_id = LATEST_DICTIONARIES.get(codec.id)
+
+    data = codec.compress(bytes(content, 'utf-8'),
+        get_dictionary(dictionary_id))
+    return data, codec.id, dictionary_id
+
+def hash_content(content):
+    """
+    Gets the hash of an article's content which is stored alongside it.
+    """
+    return hashlib.sha1(bytes(content, 'utf-8')).digest()
+
+def encode_spans(spans):
+    """
+    Packs the spans of an article's links (see `utils.get_link_spans') into
+    bytes, as little-endian 32-bit offsets.
+    """
+    offsets = array(SPAN_TYPE, itertools.chain.from_iterable(spans))
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return offsets.tobytes()
+
+def decode_spans(data):
+    """
+    Unpacks spans packed by `encode_spans', as a list of (start, end)
+    offsets. Articles which were saved without spans give None.
+    """
+    if data is None:
+        return None
+
+    offsets = array(SPAN_TYPE)
+    offsets.frombytes(data)
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return list(zip(offsets[::2], offsets[1::2]))
+
+def read_stored_content(cursor, article_id):
+    """
+    Reads back the content of an article as it is stored, so that it can be
+    taken out of the full-text index, which doesn't keep the text it indexed.
+    """
+    data, codec_id, dictionary_id = cursor.execute(
+        Queries.get_stored_content, (article_id,)).fetchone()
+    return decode_content(data, codec_id, dictionary_id)
+
+def decode_content(data, codec_id, dictionary_id):
+    """
+    Decompresses the content of an article, given the codec and dictionary
+    that `encode_content' returned along with it.
+    @raise ImportError If the codec needs a module which isn't installed.
+    """
+    codec = compression.CODECS[codec_id]
+    if not codec.is_available():
+        raise ImportError('Article was compressed with {}, which needs a '
+            'module which is not installed'.format(codec.name))
+
+    return codec.decompress(data, get_dictionary(dictionary_id)).decode('utf-8')
+
+def text_query(text):
+    """
+    Converts a word into a full-text query which matches that word, or which
+    matches any word starting with it if it ends in '*'.
+    """
+    # Quoting the word keeps FTS from treating any of its characters as
+    # operators - since quotes inside are doubled, it can't escape the quotes
+    if text.endswith('*'):
+        return '"' + text[:-1].replace('"', '""') + '"*'
+    else:
+        return '"' + text.replace('"', '""') + '"'
+
+def leaf_variables(query_node, attr_name):
+    """
+    Gets the variables which are passed to SQLite for a leaf of a query tree.
+    """
+    attr_value = getattr(query_node, attr_name)
+    if isinstance(query_node, query.Content):
+        return (text_query(attr_value),)
+    elif isinstance(query_node, query.Reach):
+        return (attr_value, query_node.depth)
+    else:
+        return (attr_value,)
 
 def sql_from_query(query_node):
     """
@@ -91,13 +787,25 @@ def sql_from_query(query_node):
         query.Domain: (Queries.check_domain, 'domain'),
         query.Links: (Queries.check_links, 'url'),
         query.LinkedBy: (Queries.check_linked, 'url'),
-        query.Url: (Queries.check_url, 'url')
+        query.Url: (Queries.check_url, 'url'),
+        query.Content: (Queries.check_text, 'text'),
+        query.Reach: (Queries.check_reach, 'url'),
+    }
+
+    constant_types = {
+        query.Nothing: Queries.check_nothing,
+        query.Everything: Queries.check_everything,
     }
 
-    if isinstance(query_node, tuple(simple_types)):
+    if isinstance(query_node, query.Reach) and GRAPH is not None:
+        # The URLs are filled in from the link graph when the query is run
+        # (see `bind_variables'), rather than following LINKS in SQL
+        return (Queries.check_reach_graph, (query_node,))
+    elif isinstance(query_node, tuple(simple_types)):
         query_template, attr_name = simple_types[type(query_node)]
-        attr_value = getattr(query_node, attr_name)
-        return (query_template, (attr_value,))
+        return (query_template, leaf_variables(query_node, attr_name))
+    elif isinstance(query_node, tuple(constant_types)):
+        return (constant_types[type(query_node)], ())
     elif isinstance(query_node, query.And):
         sql_1, variables_1 = sql_from_query(query_node.oper_1)
         sql_2, variables_2 = sql_from_query(query_node.oper_2)
@@ -114,94 +822,748 @@ def sql_from_query(query_node):
         sql, variables = sql_from_query(query_node.expr)
         return ('NOT (' + sql + ')', variables)
 
-def execute_query(query_tree):
+def set_sql_from_query(query_node):
     """
-    Processes a query tree, returning a list of eligible URIs.
+    Outputs templated SQL, as well as the list of templates to fill them.
+
+    Unlike `sql_from_query', this produces a complete SELECT statement, where
+    each leaf is an uncorrelated `Url IN (...)' lookup which SQLite runs only
+    once, and each operator is a compound SELECT:
+
+     - AND becomes INTERSECT
+     - OR becomes UNION
+     - NOT becomes EXCEPT, subtracting from the set of all articles (or from
+       the other operand, when it is under an AND)
+
+    The return value is a tuple:
+     - The raw SQL to insert
+     - The variables to add to the query formatter
+    """
+    simple_types = {
+        query.Tag: (Queries.set_tag, 'tag'),
+        query.Domain: (Queries.set_domain, 'domain'),
+        query.Links: (Queries.set_links, 'url'),
+        query.LinkedBy: (Queries.set_linked, 'url'),
+        query.Url: (Queries.set_url, 'url'),
+        query.Content: (Queries.set_text, 'text'),
+        query.Reach: (Queries.set_reach, 'url'),
+    }
+
+    compound_types = {
+        query.And: 'INTERSECT',
+        query.Or: 'UNION',
+    }
+
+    constant_types = {
+        query.Nothing: Queries.set_nothing,
+        query.Everything: Queries.set_all_articles,
+    }
+
+    # SQLite doesn't allow parentheses around the operands of a compound
+    # SELECT, so nested statements have to be wrapped up as subqueries
+    wrap = lambda sql: 'SELECT Url FROM (' + sql + ')'
+
+    if isinstance(query_node, query.Reach) and GRAPH is not None:
+        return (Queries.set_reach_graph, (query_node,))
+    elif isinstance(query_node, tuple(simple_types)):
+        query_template, attr_name = simple_types[type(query_node)]
+        return (query_template, leaf_variables(query_node, attr_name))
+    elif isinstance(query_node, tuple(constant_types)):
+        return (constant_types[type(query_node)], ())
+    elif (isinstance(query_node, query.And) and
+            isinstance(query_node.oper_2, query.Not)):
+        # 'a AND NOT b' can subtract b from a directly, rather than
+        # subtracting b from every article and then intersecting with a
+        sql_1, variables_1 = set_sql_from_query(query_node.oper_1)
+        sql_2, variables_2 = set_sql_from_query(query_node.oper_2.expr)
+        return (wrap(sql_1) + ' EXCEPT ' + wrap(sql_2),
+                variables_1 + variables_2)
+    elif (isinstance(query_node, query.And) and
+            isinstance(query_node.oper_1, query.Not)):
+        return set_sql_from_query(
+            query.And(query_node.oper_2, query_node.oper_1))
+    elif isinstance(query_node, tuple(compound_types)):
+        sql_1, variables_1 = set_sql_from_query(query_node.oper_1)
+        sql_2, variables_2 = set_sql_from_query(query_node.oper_2)
+        return ('{query1} {operator} {query2}'.format(
+                    query1=wrap(sql_1),
+                    operator=compound_types[type(query_node)],
+                    query2=wrap(sql_2)),
+                variables_1 + variables_2)
+    elif isinstance(query_node, query.Not):
+        sql, variables = set_sql_from_query(query_node.expr)
+        return (Queries.set_all_articles + ' EXCEPT ' + wrap(sql), variables)
+
+def compile_exists_query(query_tree):
+    """
+    Compiles a query tree into a complete statement, using `sql_from_query'.
     """
     # Introduce the proper tables into the query before passing it off to
     # the query->sql converter
-    base_query = Queries.search_base_query
     sql, variables = sql_from_query(query_tree)
-    results = set(row[0] for row in DB.execute(base_query + sql, variables))
+    return (Queries.search_base_query + sql, variables)
+
+# The different ways of turning a query tree into a SELECT statement, which
+# can be chosen between when calling `execute_query'
+COMPILERS = {
+    'exists': compile_exists_query,
+    'set': set_sql_from_query,
+}
+
+# The compiler used by `execute_query' when none is given
+QUERY_COMPILER = 'set'
+
+# The compiler used by `search_page' and `iter_search' when none is given. Its
+# single pass over ARTICLES follows the index on Url, so reading a page only
+# goes as far as the end of the page, where the set compiler would gather up
+# every result again for each page.
+ORDERED_COMPILER = 'exists'
+
+def compile_query(query_tree, compiler=None):
+    """
+    Compiles a query tree into a complete SELECT statement, which produces the
+    URL of each matching article. The return value is a tuple:
+     - The SQL statement
+     - The variables to add to the query formatter
+    @raise KeyError If the compiler doesn't exist.
+    """
+    if compiler is None:
+        compiler = QUERY_COMPILER
+    return COMPILERS[compiler](query_tree)
+
+def estimate_query_size(query_node):
+    """
+    Estimates how many articles a leaf of a query tree matches, for use by the
+    optimizer.
+    """
+    simple_types = {
+        query.Tag: (Queries.estimate_tag, 'tag'),
+        query.Domain: (Queries.estimate_domain, 'domain'),
+        query.Links: (Queries.estimate_links, 'url'),
+        query.LinkedBy: (Queries.estimate_linked, 'url'),
+        query.Content: (Queries.estimate_text, 'text'),
+        query.Reach: (Queries.estimate_reach, 'url'),
+    }
+
+    if isinstance(query_node, query.Url):
+        return 1
+
+    link_graph = current_link_graph()
+    if isinstance(query_node, query.Reach) and link_graph is not None:
+        return len(link_graph.reachable(query_node.url, query_node.depth))
+
+    with POOL.read() as connection:
+        if isinstance(query_node, query.Everything):
+            # The largest rowid is close enough to the number of articles, and
+            # unlike COUNT(*) it doesn't have to walk the whole table
+            count = connection.execute(
+                Queries.estimate_everything).fetchone()[0]
+            return count or 0
+        else:
+            query_template, attr_name = simple_types[type(query_node)]
+            variables = leaf_variables(query_node, attr_name)
+            return connection.execute(query_template,
+                variables + (ESTIMATE_LIMIT,)).fetchone()[0]
+
+def prepare_query(query_tree, compiler=None):
+    """
+    Optimizes and compiles a query tree. The return value is a tuple:
+     - The SQL statement, or None if the query can't match any articles
+     - The variables to add to the query formatter
+    """
+    query_tree = optimize.optimize(query_tree, estimate_query_size)
+    if isinstance(query_tree, query.Nothing):
+        return (None, ())
+
+    return compile_query(query_tree, compiler)
+
+def bind_variables(connection, variables):
+    """
+    Fills in the variables of a compiled query which are left until it is
+    run. A `reach:' term compiled while the link graph is loaded is left as
+    its `query.Reach' node, so that the compiled query stays good as the
+    links change, and is replaced here by the JSON list of URLs it reaches.
+    If the graph has been dropped since, then the database is asked instead.
+    """
+    if not any(isinstance(variable, query.Reach) for variable in variables):
+        return variables
+
+    link_graph = current_link_graph()
+    bound = []
+    for variable in variables:
+        if not isinstance(variable, query.Reach):
+            bound.append(variable)
+        elif link_graph is not None:
+            bound.append(json.dumps(list(
+                link_graph.reachable(variable.url, variable.depth))))
+        else:
+            bound.append(json.dumps([row[0] for row in
+                connection.execute(Queries.set_reach, variable)]))
+    return tuple(bound)
+
+def get_cached_results(key, sql, variables, build):
+    """
+    Gets the results of a query from `RESULT_CACHE', or runs it and passes
+    the URIs it produces to `build' to make something to cache.
+    """
+    with POOL.read() as connection:
+        # Another process (say, the CLI while the web server is running) may
+        # have changed the database since the results were cached. SQLite
+        # changes the data version whenever another connection commits, and
+        # since each thread has its own connection, each thread has to keep
+        # track of the last version it saw.
+        data_version = connection.execute(
+            'PRAGMA data_version').fetchone()[0]
+        if getattr(POOL.local, 'data_version', None) != data_version:
+            invalidate_results()
+            POOL.local.data_version = data_version
+
+        generation = GENERATION
+        results = RESULT_CACHE.get(key)
+        if results is None:
+            results = build(row[0] for row in connection.execute(sql,
+                bind_variables(connection, variables)))
+
+            with RESULT_LOCK:
+                if generation == GENERATION:
+                    RESULT_CACHE.put(key, results)
+
     return results
 
+def execute_prepared_query(sql, variables):
+    """
+    Runs a query produced by `prepare_query', returning a set of eligible URIs.
+    """
+    if sql is None:
+        return set()
+
+    # Callers are free to modify the result, so they can't have the cached copy
+    return set(get_cached_results((sql, variables), sql, variables, frozenset))
+
+def invalidate_results():
+    """
+    Throws away all cached query results, after the articles have changed.
+    """
+    global GENERATION
+    with RESULT_LOCK:
+        GENERATION += 1
+        RESULT_CACHE.clear()
+
+def cache_stats():
+    """
+    Gets the performance of each cache, as a dict of the form:
+
+        {'cache-name': {'hits': ..., 'misses': ..., 'hit-rate': ...}, ...}
+    """
+    caches = {'queries': QUERY_CACHE, 'results': RESULT_CACHE}
+    return {name: {'hits': the_cache.hits,
+                   'misses': the_cache.misses,
+                   'hit-rate': the_cache.hit_rate()}
+            for name, the_cache in caches.items()}
+
+def execute_query(query_tree, compiler=None):
+    """
+    Processes a query tree, returning a list of eligible URIs.
+
+    The query tree is optimized before it is compiled. The compiler is one of
+    the keys of `COMPILERS' - if it isn't given, then `QUERY_COMPILER' is used.
+
+    As with `search', the compiled form of the query is kept in
+    `QUERY_CACHE', so that running it again doesn't have to estimate the
+    size of each of its terms again.
+    """
+    if compiler is None:
+        compiler = QUERY_COMPILER
+
+    # Whether the link graph is loaded changes how `reach:' is compiled
+    cache_key = ('tree', optimize.node_key(query_tree), compiler,
+        GRAPH is not None)
+    prepared = QUERY_CACHE.get(cache_key)
+    if prepared is None:
+        prepared = prepare_query(query_tree, compiler)
+        QUERY_CACHE.put(cache_key, prepared)
+
+    sql, variables = prepared
+    return execute_prepared_query(sql, variables)
+
+def search(query_text, compiler=None):
+    """
+    Parses a query string and processes it, returning a list of eligible URIs.
+
+    The compiled form of the query is kept in `QUERY_CACHE', so that searching
+    for the same thing again (even with different spacing) doesn't have to
+    parse and compile the query again.
+    @raise SyntaxError If the query string is malformed.
+    """
+    sql, variables = prepare_search(query_text, compiler)
+    return execute_prepared_query(sql, variables)
+
+def prepare_search(query_text, compiler=None):
+    """
+    Parses and compiles a query string, as `search' does, without running
+    it.
+    @raise SyntaxError If the query string is malformed.
+    """
+    if compiler is None:
+        compiler = QUERY_COMPILER
+
+    cache_key = (query.normalize_query(query_text), compiler,
+        GRAPH is not None)
+    prepared = QUERY_CACHE.get(cache_key)
+    if prepared is None:
+        prepared = prepare_query(query.parse_query(query_text), compiler)
+        QUERY_CACHE.put(cache_key, prepared)
+    return prepared
+
+def execute_prepared_query_page(sql, variables, limit, after=None):
+    """
+    Runs a query produced by `prepare_query', returning a list of at most
+    `limit' eligible URIs in order, starting after the URI `after'.
+
+    The ordering, the starting point and the limit are all left to SQLite,
+    so only the page itself is read out (see `ORDERED_COMPILER').
+    """
+    if sql is None:
+        return []
+
+    if after is None:
+        page_sql = Queries.first_page.format(query=sql)
+        page_variables = variables + (limit,)
+    else:
+        page_sql = Queries.next_page.format(query=sql)
+        page_variables = variables + (after, limit)
+
+    return list(get_cached_results(('page', sql, variables, after, limit),
+        page_sql, page_variables, tuple))
+
+def make_search_token(url):
+    """
+    Makes a continuation token for `search_page', which picks up after the
+    given URL.
+    """
+    return base64.urlsafe_b64encode(url.encode('utf-8')).decode('ascii')
+
+def read_search_token(token):
+    """
+    Gets back the URL that a token from `make_search_token' picks up after.
+    @raise ValueError If the token is malformed.
+    """
+    if not isinstance(token, str):
+        raise ValueError('Invalid continuation token: {!r}'.format(token))
+
+    try:
+        return base64.b64decode(token.encode('ascii'), b'-_',
+            validate=True).decode('utf-8')
+    except (TypeError, UnicodeError, binascii.Error) as err:
+        raise ValueError('Invalid continuation token: {!r}'.format(token)) \
+            from err
+
+def search_page(query_text, limit=SEARCH_PAGE_SIZE, token=None,
+        compiler=None):
+    """
+    Parses a query string and processes it, returning a `SearchPage' with at
+    most `limit' eligible URIs, ordered by URI. If no compiler is given, then
+    `ORDERED_COMPILER' is used.
+
+    The page's token is given back to get the next page, and is None once
+    there aren't any more. The token only records where the page ended, so
+    articles created or deleted between pages are picked up or dropped if
+    they come after it.
+    @raise SyntaxError If the query string is malformed.
+    @raise ValueError If the limit or token is invalid.
+    """
+    if limit < 1:
+        raise ValueError('Invalid page size: {}'.format(limit))
+
+    if compiler is None:
+        compiler = ORDERED_COMPILER
+
+    after = None if token is None else read_search_token(token)
+    sql, variables = prepare_search(query_text, compiler)
+
+    # One extra URL is taken to find out if there's another page
+    urls = execute_prepared_query_page(sql, variables, limit + 1, after)
+    if len(urls) > limit:
+        del urls[limit:]
+        return SearchPage(urls, make_search_token(urls[-1]))
+    return SearchPage(urls, None)
+
+def iter_search(query_text, compiler=None):
+    """
+    Parses a query string and processes it, returning an iterator over the
+    eligible URIs in order.
+
+    The URIs are read `SEARCH_BATCH_SIZE' at a time, each batch picking up
+    after the last URI of the one before (as `search_page' does), so only
+    one batch is held at once and no connection is held between batches.
+    The query is parsed when this is called, rather than when the first URI
+    is read, so that a malformed query is reported straight away. As with
+    `search_page', `ORDERED_COMPILER' is used if no compiler is given.
+    @raise SyntaxError If the query string is malformed.
+    """
+    if compiler is None:
+        compiler = ORDERED_COMPILER
+    sql, variables = prepare_search(query_text, compiler)
+
+    def iter_batches():
+        after = None
+        while True:
+            urls = execute_prepared_query_page(sql, variables,
+                SEARCH_BATCH_SIZE, after)
+            yield from urls
+            if len(urls) < SEARCH_BATCH_SIZE:
+                return
+            after = urls[-1]
+
+    return iter_batches()
+
+def load_link_graph():
+    """
+    Builds the in-memory link graph out of the database. Once it is loaded,
+    the functions which change articles keep it up to date, and the
+    functions which look up links use it instead of the database.
+    """
+    global GRAPH, GRAPH_VERSION
+    with POOL.write_lock:
+        # The version is taken first, so that anything committed while the
+        # graph is being built causes it to be built again
+        GRAPH_VERSION = POOL.writer.execute(
+            'PRAGMA data_version').fetchone()[0]
+        GRAPH = graph.LinkGraph.load(POOL.writer)
+
+def current_link_graph():
+    """
+    Gets the link graph, or None if it hasn't been loaded.
+
+    Another process may have changed the database since the graph was
+    loaded, in which case the graph is loaded again. Unlike the reading
+    connections, the writing connection's data version doesn't change when
+    this process commits, so it only shows changes from other processes.
+    When another thread is writing, the check is left for the next call
+    rather than waiting for the write to finish.
+    """
+    if GRAPH is None or getattr(POOL.local, 'writing', False):
+        return GRAPH
+
+    if POOL.write_lock.acquire(blocking=False):
+        try:
+            data_version = POOL.writer.execute(
+                'PRAGMA data_version').fetchone()[0]
+            if data_version != GRAPH_VERSION:
+                load_link_graph()
+        finally:
+            POOL.write_lock.release()
+
+    return GRAPH
+
+def update_link_graph(cursor, article_id, url):
+    """
+    Copies an article's links into the link graph, once the write that
+    changed them has been committed. Does nothing if the graph isn't loaded.
+    """
+    if GRAPH is None:
+        return
+
+    linked = cursor.execute(Queries.get_linked_urls, (article_id,)).fetchall()
+    POOL.on_commit(lambda: GRAPH.set_article(article_id, url, linked))
+
 def create_article(url, content, links, tags):
     """
-    Inserts a new article in the database.
+    Inserts a new article in the database. If links is None, then the
+    links in the content are used, which is cheaper than finding them
+    beforehand since the content is searched for links anyway.
     @raise KeyError If the article exists already.
     """
     url = utils.normalize_url(url)
-    # First, ensure that no article by the given URI exists in the database
-    # already
-    count_set = set(row[0] for row in
-            CURSOR.execute(Queries.count_matching_urls, (url,)))
-    if count_set.pop() > 0:
-        raise KeyError('Already have article about ' + url)
+    spans = utils.get_link_spans(content)
+    if links is None:
+        links = utils.get_links(content, spans)
+
+    with POOL.write() as cursor:
+        # First, ensure that no article by the given URI exists in the database
+        # already
+        count_set = set(row[0] for row in
+                cursor.execute(Queries.count_matching_urls, (url,)))
+        if count_set.pop() > 0:
+            raise KeyError('Already have article about ' + url)
+
+        # The article takes the id of its URL, which may have been given one
+        # already by an article that links to it
+        cursor.execute(Queries.intern_url, (url,))
+        data, codec_id, dictionary_id = encode_content(content)
+        cursor.execute(Queries.insert_article,
+            (url, data, utils.get_domain(url), codec_id, dictionary_id,
+                hash_content(content), encode_spans(spans), time.time()))
+        article_id = cursor.lastrowid
+        cursor.execute(Queries.insert_text, (article_id, content))
+
+        cursor.executemany(Queries.intern_url, ((link,) for link in links))
+        cursor.executemany(Queries.insert_link,
+            ((url, link) for link in links))
 
-    content_bytes = bytes(content, 'utf-8')
-    CURSOR.execute('INSERT INTO ARTICLES VALUES (?, ?, ?)',
-        (url, zlib.compress(content_bytes, COMPRESS), utils.get_domain(url)))
+        cursor.executemany(Queries.intern_tag, ((tag,) for tag in tags))
+        cursor.executemany(Queries.insert_tag, ((url, tag) for tag in tags))
 
-    for link in links:
-        CURSOR.execute('INSERT INTO LINKS VALUES (?, ?)', (url, link))
+        # The articles this links to have a new backlink, and the articles
+        # that link to this no longer have a missing link
+        cursor.execute(Queries.touch_neighbours, (time.time(), article_id))
 
-    for tag in tags:
-        CURSOR.execute('INSERT INTO TAGS VALUES (?, ?)', (url, tag))
+        update_link_graph(cursor, article_id, url)
 
-    DB.commit()
+    invalidate_results()
 
-def update_multimap_table(url, table, column, values):
+def bulk_create_articles(articles, defer_indexes=False, progress=None):
+    """
+    Inserts many new articles in the database, within a single transaction.
+
+    The articles can be any iterable of (url, content, links, tags) tuples,
+    where links can be None as for `create_article'. They are read in
+    batches of `BULK_BATCH_SIZE', so a generator can be used to import more
+    articles than fit in memory.
+
+    If indexes are deferred, then the secondary indexes are dropped before
+    importing and rebuilt afterwards, which is faster when importing many
+    articles at once. The progress function, if given, is called with the
+    number of articles inserted so far after each batch.
+    @return The number of articles inserted.
+    @raise KeyError If any of the articles exist already, in which case none
+        of the articles are inserted.
+    """
+    articles = iter(articles)
+    count = 0
+    modified = time.time()
+    with POOL.write() as cursor:
+        cursor.execute(Queries.create_new_ids_table)
+        cursor.execute('DELETE FROM temp.NEW_IDS')
+
+        if defer_indexes:
+            for index in DEFERRABLE_INDEXES:
+                cursor.execute('DROP INDEX IF EXISTS ' + index)
+
+        while True:
+            batch = list(itertools.islice(articles, BULK_BATCH_SIZE))
+            if not batch:
+                break
+
+            article_rows = []
+            text_rows = []
+            link_rows = []
+            tag_rows = []
+            for url, content, links, tags in batch:
+                url = utils.normalize_url(url)
+                spans = utils.get_link_spans(content)
+                if links is None:
+                    links = utils.get_links(content, spans)
+
+                data, codec_id, dictionary_id = encode_content(content)
+                article_rows.append((url, data, utils.get_domain(url),
+                    codec_id, dictionary_id, hash_content(content),
+                    encode_spans(spans), modified))
+                text_rows.append((content, url))
+                link_rows.extend((url, link) for link in links)
+                tag_rows.extend((url, tag) for tag in tags)
+
+            try:
+                cursor.executemany(Queries.intern_url,
+                    ((row[0],) for row in article_rows))
+                cursor.executemany(Queries.insert_article, article_rows)
+            except sqlite3.IntegrityError as ex:
+                raise KeyError(
+                    'Already have article about one of the imported URLs') \
+                    from ex
+
+            cursor.executemany(Queries.insert_new_id,
+                ((row[0],) for row in article_rows))
+            cursor.executemany(Queries.insert_text_by_url, text_rows)
+            cursor.executemany(Queries.intern_url,
+                ((link,) for _, link in link_rows))
+            cursor.executemany(Queries.insert_link, link_rows)
+            cursor.executemany(Queries.intern_tag,
+                ((tag,) for _, tag in tag_rows))
+            cursor.executemany(Queries.insert_tag, tag_rows)
+
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+
+        if defer_indexes:
+            for create_index in DEFERRABLE_INDEXES.values():
+                cursor.execute(create_index)
+
+        # This is done once all the links are in (and indexed), rather than
+        # article by article
+        cursor.execute(Queries.touch_new_neighbours, (modified,))
+        cursor.execute('DELETE FROM temp.NEW_IDS')
+
+        # Rebuilding the graph is cheaper than updating it one article at a
+        # time, when there are enough articles to bother with a bulk import
+        if GRAPH is not None:
+            POOL.on_commit(load_link_graph)
+
+    invalidate_results()
+    return count
+
+# The one-to-many tables which `update_multimap_table' can update, along with
+# the column holding the ids of the values, and the table and column which map
+# those ids to the values themselves
+MULTIMAP_TABLES = {
+    'TAGS': ('TagId', 'TAG_NAMES', 'Tag'),
+    'LINKS': ('LinkedId', 'URLS', 'Url'),
+}
+
+def update_multimap_table(url, table, values):
     """
     Updates a one-to-many table, by setting a list of values to a URI.
 
-    This routine is meant to do this intelligently, by calculating the
-    difference between the existing values and the new set of values, and
-    adding/deleting as little as possible.
+    The new values are loaded into a temporary table, and the difference
+    between them and the existing values is applied by one DELETE and one
+    INSERT, rather than by a statement for each value that changed.
+    @return Whether any rows were added or removed.
     """
-    # First, figure out what rows are already in the DB
-    existing_values = set(row[0] for row in
-        CURSOR.execute('SELECT {} FROM {} WHERE Url = ?'.format(column, table),
-            (url,)))
+    column, names, name = MULTIMAP_TABLES[table]
+    names_format = {'table': table, 'column': column,
+                    'names': names, 'name': name}
+
+    with POOL.write() as cursor:
+        url_id = cursor.execute('SELECT Id FROM URLS WHERE Url = ?',
+            (url,)).fetchone()[0]
+
+        cursor.execute(Queries.create_new_values_table)
+        cursor.execute('DELETE FROM temp.NEW_VALUES')
+        cursor.executemany(Queries.insert_new_value,
+            ((value,) for value in values))
+        cursor.execute(Queries.intern_new_values.format(**names_format))
 
-    # Then, get the difference between existing values and what should/should
-    # not be in the table
-    to_add = values - existing_values
-    to_remove = existing_values - values
+        # Rows which are already in the table are ignored by the INSERT, so
+        # only the values which were missing are added
+        cursor.execute(Queries.delete_old_values.format(**names_format),
+            (url_id,))
+        removed = cursor.rowcount
+        cursor.execute(Queries.insert_new_values.format(**names_format),
+            (url_id,))
+        added = cursor.rowcount
 
-    # Finally, do the insertions/removals
-    for val in to_add:
-        CURSOR.execute('INSERT INTO {} VALUES (?, ?)'.format(table, column),
-            (url, val))
+        cursor.execute('DELETE FROM temp.NEW_VALUES')
 
-    for val in to_remove:
-        CURSOR.execute(
-            'DELETE FROM {} WHERE Url = ? AND {} = ?'.format(table, column),
-            (url, val))
+    return bool(added or removed)
 
 def update_article(url, content, links, tags):
     """
     Updates an existing article in the database.
-    @note Both links and tags must each be a set()
+
+    If the content hasn't changed (going by its hash), then it isn't
+    rewritten. The links are replaced by the given links either way, with
+    only the difference being written - or, if links is None, they are
+    replaced by the links in the new content if it has changed, and left
+    alone if it hasn't. The tags are always replaced, in the same way.
+    @note Tags must be a set(), as must links unless it is None
     @raise KeyError If the article doesn't yet exist.
     """
     url = utils.normalize_url(url)
-    # First, ensure that 1 article by the given URI exists in the database
-    # already
-    count_set = set(row[0] for row in
-            CURSOR.execute(Queries.count_matching_urls, (url,)))
+    content_hash = hash_content(content)
+    with POOL.write() as cursor:
+        # First, ensure that the article exists in the database already
+        row = cursor.execute('SELECT Id, Hash FROM ARTICLES WHERE Url = ?',
+            (url,)).fetchone()
+        if row is None:
+            raise KeyError('Database has no article about ' + url)
 
-    if count_set.pop() != 1:
-        raise KeyError('Database has no article about ' + url)
+        article_id, old_hash = row
+        content_changed = old_hash != content_hash
+        modified = time.time()
+        if content_changed:
+            # The spans are replaced along with the content, so they can't go
+            # out of date
+            spans = utils.get_link_spans(content)
+            cursor.execute(Queries.delete_text,
+                (article_id, read_stored_content(cursor, article_id)))
+            cursor.execute(Queries.insert_text, (article_id, content))
 
-    content_bytes = bytes(content, 'utf-8')
-    CURSOR.execute('UPDATE ARTICLES SET Article = ? WHERE Url = ?',
-        (zlib.compress(content_bytes, COMPRESS), url))
+            data, codec_id, dictionary_id = encode_content(content)
+            cursor.execute(Queries.update_article,
+                (data, codec_id, dictionary_id, content_hash,
+                    encode_spans(spans), url))
 
-    # Update the tag/links tables
-    update_multimap_table(url, 'TAGS', 'Tag', tags)
-    update_multimap_table(url, 'LINKS', 'Linked', links)
+            if links is None:
+                links = utils.get_links(content, spans)
 
-    DB.commit()
+        # Update the tag/links tables
+        tags_changed = update_multimap_table(url, 'TAGS', tags)
+        links_changed = False
+        if links is not None:
+            old_linked_ids = [row[0] for row in cursor.execute(
+                'SELECT LinkedId FROM LINKS WHERE UrlId = ?', (article_id,))]
+            links_changed = update_multimap_table(url, 'LINKS', links)
+
+        if links_changed:
+            # Both the articles which this used to link to, and the ones it
+            # links to now, have different backlinks
+            cursor.executemany(Queries.touch_article,
+                ((modified, linked_id) for linked_id in old_linked_ids))
+            cursor.execute(Queries.touch_neighbours, (modified, article_id))
+            update_link_graph(cursor, article_id, url)
+
+        if content_changed or tags_changed or links_changed:
+            cursor.execute(Queries.touch_article, (modified, article_id))
+
+    if content_changed or tags_changed or links_changed:
+        invalidate_results()
+
+def update_tags(url, tags):
+    """
+    Replaces the tags of an existing article, without reading or rewriting
+    its content and links.
+    @note The tags must be a set()
+    @raise KeyError If the article doesn't yet exist.
+    """
+    url = utils.normalize_url(url)
+    with POOL.write() as cursor:
+        row = cursor.execute('SELECT Id FROM ARTICLES WHERE Url = ?',
+            (url,)).fetchone()
+        if row is None:
+            raise KeyError('Database has no article about ' + url)
+
+        tags_changed = update_multimap_table(url, 'TAGS', tags)
+        if tags_changed:
+            cursor.execute(Queries.touch_article, (time.time(), row[0]))
+
+    if tags_changed:
+        invalidate_results()
+
+def get_content_hash(url):
+    """
+    Gets the hash of an article's content (see `hash_content') without
+    reading the content itself. This is None for articles which haven't been
+    saved since hashes were first stored.
+    @raise KeyError If the article doesn't exist.
+    """
+    url = utils.normalize_url(url)
+    with POOL.read() as connection:
+        row = connection.execute('SELECT Hash FROM ARTICLES WHERE Url = ?',
+            (url,)).fetchone()
+
+    if row is None:
+        raise KeyError('Database has no article about ' + url)
+    return row[0]
+
+def get_article_version(url):
+    """
+    Gets the version of an article, as an ArticleVersion. The version goes
+    up whenever anything that `get_article' returns for the article changes
+    (including its backlinks), or whether any of the URLs it links to have
+    articles. The modification time is None for articles which haven't
+    changed since versions were first stored.
+    @raise KeyError If the article doesn't exist.
+    """
+    url = utils.normalize_url(url)
+    with POOL.read() as connection:
+        row = connection.execute(
+            'SELECT Id, Version, Modified FROM ARTICLES WHERE Url = ?',
+            (url,)).fetchone()
+
+    if row is None:
+        raise KeyError('Database has no article about ' + url)
+    return ArticleVersion(*row)
 
 def get_article(url):
     """
@@ -209,35 +1571,293 @@ def get_article(url):
     @raise KeyError If the article doesn't exist.
     """
     url = utils.normalize_url(url)
-    # Get the content, and convert it from zlib compressed bytes to UTF-8
-    try:
-        article_row = next(
-            CURSOR.execute('SELECT Article FROM ARTICLES WHERE Url = ?',
-                (url,)))
-        zlib_content_bytes = article_row[0]
-    except StopIteration:
+    articles = get_articles([url])
+    if url not in articles:
         raise KeyError('Database has no article about ' + url)
 
-    content_bytes = zlib.decompress(zlib_content_bytes)
-    content = content_bytes.decode('utf-8')
+    return articles[url]
+
+def get_articles(urls):
+    """
+    Gets the content of many articles at once, as a dict mapping each URL
+    (after being normalized) to an Article object. URLs which don't have
+    articles are left out.
+
+    The content, tags, links and backlinks of a whole batch of articles are
+    fetched by a single statement, rather than a statement for each part of
+    each article. If the link graph is loaded, the links and backlinks come
+    from there instead.
+    """
+    urls = list(set(utils.normalize_url(url) for url in urls))
+
+    # What each kind of row returned by `get_article_parts' contains
+    CONTENT, TAG, LINK, BACKLINK = range(4)
+
+    link_graph = current_link_graph()
+    if link_graph is None:
+        parts_query = Queries.get_article_parts
+    else:
+        parts_query = Queries.get_article_contents_and_tags
+
+    # Each part of the query takes its own copy of the URLs
+    copies = parts_query.count('{urls}')
+
+    contents = {}
+    parts = {url: {TAG: set(), LINK: set(), BACKLINK: set()} for url in urls}
+    with POOL.read() as connection:
+        for start in range(0, len(urls), GET_BATCH_SIZE):
+            batch = urls[start:start + GET_BATCH_SIZE]
+            sql = parts_query.format(urls=', '.join('?' * len(batch)))
 
-    # Get all the tags and links for the article
-    tags = set(row[0] for row in
-        CURSOR.execute('SELECT Tag FROM TAGS WHERE Url = ?', (url,)))
-    links = set(row[0] for row in
-        CURSOR.execute('SELECT Linked FROM LINKS WHERE Url = ?', (url,)))
-    backlinks = set(row[0] for row in
-        CURSOR.execute('SELECT Url FROM LINKS WHERE Linked = ?', (url,)))
+            for kind, url, value, codec_id, dictionary_id, spans in \
+                    connection.execute(sql, batch * copies):
+                if kind == CONTENT:
+                    contents[url] = (value, codec_id, dictionary_id, spans)
+                else:
+                    parts[url][kind].add(value)
 
-    return Article(url, content, links, backlinks, tags)
+    articles = {}
+    for url, (data, codec_id, dictionary_id, spans) in contents.items():
+        content = decode_content(data, codec_id, dictionary_id)
+        url_parts = parts[url]
+        if link_graph is not None:
+            url_parts[LINK] = link_graph.links(url)
+            url_parts[BACKLINK] = link_graph.backlinks(url)
+        articles[url] = Article(url, content, url_parts[LINK],
+            url_parts[BACKLINK], url_parts[TAG])
+        articles[url].spans = decode_spans(spans)
+
+    return articles
+
+def get_dangling_links(urls=None):
+    """
+    Finds the links to URLs which don't have articles, as a dict mapping
+    each article's URL to the set of missing URLs that it links to. If URLs
+    are given, only the links from those articles are checked - which lets a
+    frontend mark the missing links in an article without looking up each
+    link.
+
+    The links of particular articles come from the link graph, if it is
+    loaded. Checking every link is done by a single query either way, since
+    SQLite gets through the LINKS table faster than Python gets through
+    the graph.
+    """
+    if urls is not None:
+        urls = list(set(utils.normalize_url(url) for url in urls))
+
+        link_graph = current_link_graph()
+        if link_graph is not None:
+            return link_graph.dangling_links(urls)
+
+    dangling = {}
+    with POOL.read() as connection:
+        if urls is None:
+            batches = [(Queries.get_dangling_links, [])]
+        else:
+            batches = [
+                (Queries.get_dangling_links_from.format(
+                    urls=', '.join('?' * len(batch))), batch)
+                for batch in (urls[start:start + GET_BATCH_SIZE]
+                    for start in range(0, len(urls), GET_BATCH_SIZE))]
+
+        for sql, variables in batches:
+            for url, missing_url in connection.execute(sql, variables):
+                dangling.setdefault(url, set()).add(missing_url)
+
+    return dangling
+
+def get_orphans():
+    """
+    Finds the articles which no other article links to, as a set of URLs.
+    Uses the link graph if it is loaded, and otherwise a single query.
+    """
+    link_graph = current_link_graph()
+    if link_graph is not None:
+        return link_graph.orphans()
+
+    with POOL.read() as connection:
+        return set(row[0] for row in connection.execute(Queries.get_orphans))
+
+def get_tag_counts():
+    """
+    Counts how many articles have each tag, as a dict mapping each tag to its
+    count. Tags which no article has any more are left out.
+    """
+    with POOL.read() as connection:
+        return dict(connection.execute(Queries.get_tag_counts))
+
+def rank_text_matches(words):
+    """
+    Finds the articles which contain all of the given words, returning a list
+    of their URLs with the most relevant articles first.
+
+    A word ending with '*' matches any word which starts with it.
+    """
+    if not words:
+        return []
+
+    match = ' '.join(text_query(word) for word in words)
+    with POOL.read() as connection:
+        return [row[0] for row in
+            connection.execute(Queries.rank_text, (match,))]
+
+def iter_articles():
+    """
+    Goes through every article in the database, in the order they were
+    created, as Article objects. Since backlinks would take another lookup
+    per article, the backlinks of each Article are None.
+
+    The ARTICLES, TAGS and LINKS tables are each read in order of their
+    primary keys (which all start with the article's id) by their own
+    cursor, and merged together as they go, so this uses the same amount of
+    memory no matter how many articles there are. Each article's content is
+    only decompressed when that article is reached.
+    """
+    with POOL.read() as connection:
+        article_rows = connection.execute(Queries.iter_articles)
+        tag_groups = itertools.groupby(
+            connection.execute(Queries.iter_tags),
+            key=lambda row: row[0])
+        link_groups = itertools.groupby(
+            connection.execute(Queries.iter_links),
+            key=lambda row: row[0])
+
+        # The next group of rows from each table which hasn't been matched up
+        # with an article yet
+        next_tags = next(tag_groups, None)
+        next_links = next(link_groups, None)
+
+        for article_id, url, data, codec_id, dictionary_id, spans, modified in \
+                article_rows:
+            # Since each table is in the same order, the rows for this article
+            # are the next ones, unless the article has no rows in that table
+            while next_tags is not None and next_tags[0] < article_id:
+                next_tags = next(tag_groups, None)
+
+            tags = set()
+            if next_tags is not None and next_tags[0] == article_id:
+                tags = set(row[1] for row in next_tags[1])
+                next_tags = next(tag_groups, None)
+
+            while next_links is not None and next_links[0] < article_id:
+                next_links = next(link_groups, None)
+
+            links = set()
+            if next_links is not None and next_links[0] == article_id:
+                links = set(row[1] for row in next_links[1])
+                next_links = next(link_groups, None)
+
+            content = decode_content(data, codec_id, dictionary_id)
+            article = Article(url, content, links, None, tags)
+            article.spans = decode_spans(spans)
+            article.modified = modified
+            yield article
 
 def delete_article(url):
     """
     Deletes the article, along with its tags and links.
     """
     url = utils.normalize_url(url)
-    CURSOR.execute('DELETE FROM ARTICLES WHERE Url = ?', (url,))
-    CURSOR.execute('DELETE FROM TAGS WHERE Url = ?', (url,))
-    CURSOR.execute('DELETE FROM LINKS WHERE Url = ?', (url,))
+    with POOL.write() as cursor:
+        row = cursor.execute('SELECT Id FROM ARTICLES WHERE Url = ?',
+            (url,)).fetchone()
+
+        # The articles this linked to lose a backlink, and the articles that
+        # link to this now have a missing link
+        if row is not None:
+            cursor.execute(Queries.touch_neighbours, (time.time(), row[0]))
+            cursor.execute(Queries.delete_text,
+                (row[0], read_stored_content(cursor, row[0])))
+
+        cursor.execute('DELETE FROM ARTICLES WHERE Url = ?', (url,))
+        cursor.execute(Queries.delete_tags, (url,))
+        cursor.execute(Queries.delete_links, (url,))
+
+        if GRAPH is not None and row is not None:
+            POOL.on_commit(lambda: GRAPH.remove_article(row[0]))
+
+    invalidate_results()
+
+def train_dictionary(codec_name, sample_size=DICTIONARY_SAMPLES):
+    """
+    Trains a dictionary for a codec on a random sample of the articles, which
+    is used for any articles compressed with that codec from then on.
+    @return The id of the new dictionary, or None if there weren't enough
+            articles to train one (in which case the codec goes on working
+            without a dictionary).
+    @raise ValueError If the codec doesn't use dictionaries.
+    """
+    codec = compression.get_codec(codec_name)
+    if not codec.uses_dictionary:
+        raise ValueError('The {} codec does not use a dictionary'.format(
+            codec_name))
+
+    with POOL.read() as connection:
+        samples = [
+            bytes(decode_content(data, codec_id, dictionary_id), 'utf-8')
+            for data, codec_id, dictionary_id in connection.execute(
+                '''SELECT Article, Codec, Dictionary FROM ARTICLES
+                   ORDER BY RANDOM() LIMIT ?''', (sample_size,))]
+
+    data = codec.train(samples)
+    if data is None:
+        return None
+
+    with POOL.write() as cursor:
+        cursor.execute('INSERT INTO DICTIONARIES(Codec, Data) VALUES (?, ?)',
+            (codec.id, data))
+        dictionary_id = cursor.lastrowid
+
+    DICTIONARIES[dictionary_id] = data
+    LATEST_DICTIONARIES[codec.id] = dictionary_id
+    return dictionary_id
+
+def recompress_articles(codec_name, batch_size=RECOMPRESS_BATCH_SIZE,
+        progress=None):
+    """
+    Compresses every article with a codec (and its latest dictionary), if it
+    wasn't already.
+
+    The articles are rewritten a batch at a time, each batch in its own
+    transaction, so that other writers only have to wait for one batch
+    rather than for the whole database. The progress function, if given, is
+    called with the number of articles checked so far after each batch.
+    @return The number of articles which were rewritten.
+    """
+    codec = compression.get_codec(codec_name)
+    target = (codec.id, None)
+    if codec.uses_dictionary:
+        target = (codec.id, LATEST_DICTIONARIES.get(codec.id))
+
+    last_id = 0
+    checked = 0
+    rewritten = 0
+    while True:
+        with POOL.write() as cursor:
+            rows = cursor.execute(
+                '''SELECT Id, Article, Codec, Dictionary FROM ARTICLES
+                   WHERE Id > ? ORDER BY Id LIMIT ?''',
+                (last_id, batch_size)).fetchall()
+
+            updates = []
+            for article_id, data, codec_id, dictionary_id in rows:
+                if (codec_id, dictionary_id) == target:
+                    continue
+
+                content = decode_content(data, codec_id, dictionary_id)
+                updates.append(encode_content(content, codec) + (article_id,))
+
+            cursor.executemany(
+                '''UPDATE ARTICLES SET Article = ?, Codec = ?, Dictionary = ?
+                   WHERE Id = ?''', updates)
+
+        if not rows:
+            break
+
+        last_id = rows[-1][0]
+        checked += len(rows)
+        rewritten += len(updates)
+        if progress is not None:
+            progress(checked)
 
-    DB.commit()
+    return rewritten
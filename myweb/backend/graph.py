@@ -0,0 +1,187 @@
+"""
+An in-memory index of the links between articles, which answers backlink and
+neighbourhood lookups without going to the database.
+
+This is meant for long-running processes like the web server, which can
+afford to build it once at startup - see `db.load_link_graph'.
+"""
+
+from array import array
+from collections import deque
+import itertools
+import threading
+
+# The typecode of the arrays of URL ids - these are SQLite rowids, which are
+# 64-bit integers
+ID_TYPE = 'q'
+
+EMPTY = array(ID_TYPE)
+
+class LinkGraph:
+    """
+    The links between URLs, stored as arrays of URL ids (the ids in the URLS
+    table), in both directions.
+
+    Only one thread may change the graph at a time, but any number of
+    threads can look things up in it while it is being changed. Instead of
+    changing an array in place, a new array is built and put in place of the
+    old one, so readers always see either the old links or the new links.
+    """
+    def __init__(self):
+        self.forward = {}
+        self.reverse = {}
+        self.urls = {}
+        self.ids = {}
+        self.articles = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, connection):
+        """
+        Builds a graph out of the URLS, ARTICLES and LINKS tables.
+        """
+        graph = cls()
+        for url_id, url in connection.execute('SELECT Id, Url FROM URLS'):
+            graph.urls[url_id] = url
+            graph.ids[url] = url_id
+
+        graph.articles.update(row[0] for row in
+            connection.execute('SELECT Id FROM ARTICLES'))
+
+        # LINKS is stored in order of its primary key, so sorting it costs
+        # nothing - without the ORDER BY, SQLite may read it through the index
+        # on LinkedId instead
+        reverse = {}
+        links = connection.execute(
+            'SELECT UrlId, LinkedId FROM LINKS ORDER BY UrlId, LinkedId')
+        for url_id, rows in itertools.groupby(links, key=lambda row: row[0]):
+            linked_ids = array(ID_TYPE, (row[1] for row in rows))
+            graph.forward[url_id] = linked_ids
+            for linked_id in linked_ids:
+                reverse.setdefault(linked_id, []).append(url_id)
+
+        graph.reverse = {linked_id: array(ID_TYPE, url_ids)
+                         for linked_id, url_ids in reverse.items()}
+        return graph
+
+    def set_article(self, url_id, url, linked):
+        """
+        Adds an article, or replaces the links of an existing article. The
+        links are given as (id, URL) pairs.
+        """
+        with self.lock:
+            self.urls[url_id] = url
+            self.ids[url] = url_id
+            for linked_id, linked_url in linked:
+                self.urls[linked_id] = linked_url
+                self.ids[linked_url] = linked_id
+
+            self.set_links(url_id, [linked_id for linked_id, _ in linked])
+            self.articles.add(url_id)
+
+    def remove_article(self, url_id):
+        """
+        Removes an article, along with its links. The URL stays in the graph,
+        since other articles may still link to it.
+        """
+        with self.lock:
+            self.set_links(url_id, [])
+            self.articles.discard(url_id)
+
+    def set_links(self, url_id, linked_ids):
+        """
+        Replaces the links from one URL, updating the reverse links of every
+        URL which it links to now, or used to link to.
+        @note The caller must hold the lock.
+        """
+        old_ids = set(self.forward.get(url_id, EMPTY))
+        new_ids = set(linked_ids)
+
+        for linked_id in old_ids - new_ids:
+            self.reverse[linked_id] = array(ID_TYPE,
+                (other_id for other_id in self.reverse[linked_id]
+                    if other_id != url_id))
+
+        for linked_id in new_ids - old_ids:
+            self.reverse[linked_id] = (self.reverse.get(linked_id, EMPTY) +
+                array(ID_TYPE, [url_id]))
+
+        if new_ids:
+            self.forward[url_id] = array(ID_TYPE, sorted(new_ids))
+        else:
+            self.forward.pop(url_id, None)
+
+    def links(self, url):
+        """
+        Gets the set of URLs which a URL links to.
+        """
+        url_id = self.ids.get(url)
+        return {self.urls[linked_id]
+                for linked_id in self.forward.get(url_id, EMPTY)}
+
+    def backlinks(self, url):
+        """
+        Gets the set of URLs which link to a URL.
+        """
+        url_id = self.ids.get(url)
+        return {self.urls[other_id]
+                for other_id in self.reverse.get(url_id, EMPTY)}
+
+    def reachable(self, url, depth):
+        """
+        Gets the set of articles which can be reached from a URL by following
+        at most `depth' links - the same articles as `reach:URL depth:N'.
+
+        Each URL is only visited once, so links which form cycles cost no
+        more than any other links.
+        """
+        start_id = self.ids.get(url)
+        if start_id is None:
+            return set()
+
+        reached = set()
+        seen = {start_id}
+        pending = deque([(start_id, 0)])
+        while pending:
+            url_id, url_depth = pending.popleft()
+            if url_depth == depth:
+                continue
+
+            for linked_id in self.forward.get(url_id, EMPTY):
+                if linked_id in self.articles:
+                    reached.add(self.urls[linked_id])
+                if linked_id not in seen:
+                    seen.add(linked_id)
+                    pending.append((linked_id, url_depth + 1))
+
+        return reached
+
+    def dangling_links(self, urls=None):
+        """
+        Gets the links to URLs which don't have articles, as a dict mapping
+        each article's URL to the set of missing URLs that it links to. If
+        URLs are given, only the links from those articles are checked.
+        """
+        with self.lock:
+            if urls is None:
+                url_ids = list(self.forward)
+            else:
+                url_ids = [self.ids[url] for url in urls if url in self.ids]
+
+            dangling = {}
+            for url_id in url_ids:
+                missing = {self.urls[linked_id]
+                           for linked_id in self.forward.get(url_id, EMPTY)
+                           if linked_id not in self.articles}
+                if missing:
+                    dangling[self.urls[url_id]] = missing
+            return dangling
+
+    def orphans(self):
+        """
+        Gets the set of articles which no other article links to.
+        """
+        with self.lock:
+            return {self.urls[url_id] for url_id in self.articles
+                    if not any(other_id != url_id for other_id in
+                               self.reverse.get(url_id, EMPTY))}
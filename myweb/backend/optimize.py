@@ -0,0 +1,204 @@
+"""
+Rewrites query trees into cheaper, equivalent forms before they are compiled
+into SQL.
+
+The optimizer works in three passes:
+
+ - Negations are pushed down onto the leaves using De Morgan's laws, which
+   also removes any double negations.
+ - AND and OR chains are flattened into lists of operands, so that duplicate
+   operands (including ones which only differ in the order of their own
+   operands) can be removed, and contradictions (`a AND NOT a') and tautologies
+   (`a OR NOT a') can be folded into constants.
+ - The lists are turned back into trees, ordering the operands by how many
+   articles they are likely to match, and gathering the negations under a
+   single NOT where De Morgan's laws allow it.
+"""
+
+from collections import namedtuple
+
+import myweb.backend.query as query
+
+# The flattened forms of And and Or, which hold a tuple of any number of
+# operands rather than exactly two
+Conjunction = namedtuple('Conjunction', ['operands'])
+Disjunction = namedtuple('Disjunction', ['operands'])
+
+LEAF_TYPES = (query.Tag, query.Domain, query.Links, query.LinkedBy, query.Url,
+              query.Content, query.Reach)
+
+def push_negations(node, negate=False):
+    """
+    Converts a query tree so that NOT only appears directly above leaves.
+    """
+    if isinstance(node, query.Not):
+        return push_negations(node.expr, not negate)
+    elif isinstance(node, (query.And, query.Or)):
+        operator = type(node)
+        if negate:
+            # NOT (a AND b) ==> NOT a OR NOT b
+            # NOT (a OR b) ==> NOT a AND NOT b
+            operator = query.Or if operator is query.And else query.And
+
+        return operator(push_negations(node.oper_1, negate),
+                        push_negations(node.oper_2, negate))
+    elif isinstance(node, query.Nothing):
+        return query.Everything() if negate else node
+    elif isinstance(node, query.Everything):
+        return query.Nothing() if negate else node
+    else:
+        return query.Not(node) if negate else node
+
+def negation_of(node):
+    """
+    Gets the negation of a leaf, or of a negated leaf.
+    """
+    if isinstance(node, query.Not):
+        return node.expr
+    else:
+        return query.Not(node)
+
+def node_key(node):
+    """
+    Gets a key which identifies a node by its type as well as its fields.
+
+    The nodes are namedtuples, which compare equal whenever their fields do
+    (so `Tag('news') == Domain('news')'), so they can't be compared directly.
+    The operands of Conjunctions and Disjunctions are sorted, since their
+    order doesn't change what they match.
+    """
+    if isinstance(node, (Conjunction, Disjunction)):
+        fields = sorted(node_key(operand) for operand in node.operands)
+    else:
+        fields = [node_key(field) if isinstance(field, tuple) else field
+                  for field in node]
+
+    return (type(node).__name__,) + tuple(fields)
+
+def flatten(node):
+    """
+    Converts a tree with negations pushed down into a tree of Conjunctions and
+    Disjunctions, simplifying each of them along the way.
+    """
+    group_types = {
+        query.And: (Conjunction, query.Nothing, query.Everything),
+        query.Or: (Disjunction, query.Everything, query.Nothing),
+    }
+
+    if not isinstance(node, tuple(group_types)):
+        return node
+
+    # The absorbing element makes the whole group equal to itself (like 0 in
+    # a product), while the identity element can be dropped (like 1)
+    group, absorbing, identity = group_types[type(node)]
+
+    # Collect the operands of this node, and of any children of the same type
+    # directly beneath it
+    pending = [node.oper_1, node.oper_2]
+    operands = []
+    keys = set()
+    while pending:
+        operand = pending.pop(0)
+        if isinstance(operand, type(node)):
+            pending[0:0] = [operand.oper_1, operand.oper_2]
+            continue
+
+        operand = flatten(operand)
+        if isinstance(operand, group):
+            pending[0:0] = operand.operands
+        elif isinstance(operand, absorbing):
+            return absorbing()
+        elif not isinstance(operand, identity):
+            key = node_key(operand)
+            if key not in keys:
+                keys.add(key)
+                operands.append(operand)
+
+    # Check for contradictions, or tautologies if this is an OR
+    for operand in operands:
+        if isinstance(operand, LEAF_TYPES + (query.Not,)):
+            if node_key(negation_of(operand)) in keys:
+                return absorbing()
+
+    if not operands:
+        return identity()
+    elif len(operands) == 1:
+        return operands[0]
+    else:
+        return group(tuple(operands))
+
+def estimate_size(node, estimate):
+    """
+    Estimates how many articles a flattened node matches, given a function
+    which estimates the size of leaves and of `Everything'.
+    """
+    if isinstance(node, query.Nothing):
+        return 0
+    elif isinstance(node, query.Not):
+        return max(0, estimate(query.Everything()) -
+                      estimate_size(node.expr, estimate))
+    elif isinstance(node, Conjunction):
+        return min(estimate_size(operand, estimate)
+                   for operand in node.operands)
+    elif isinstance(node, Disjunction):
+        return min(estimate(query.Everything()),
+                   sum(estimate_size(operand, estimate)
+                       for operand in node.operands))
+    else:
+        return estimate(node)
+
+def chain(operator, operands):
+    """
+    Combines a list of nodes into a left-leaning tree using the operator.
+    """
+    node = operands[0]
+    for operand in operands[1:]:
+        node = operator(node, operand)
+    return node
+
+def unflatten(node, estimate=None):
+    """
+    Converts a flattened node back into a tree of And, Or and Not nodes.
+
+    If there is an estimation function, the operands of AND are ordered with
+    the most selective first, and the operands of OR with the least selective
+    first, so that the operands most likely to decide the result come first.
+    """
+    if isinstance(node, query.Not):
+        return query.Not(unflatten(node.expr, estimate))
+    elif not isinstance(node, (Conjunction, Disjunction)):
+        return node
+
+    operands = list(node.operands)
+    if estimate is not None:
+        operands.sort(key=lambda operand: estimate_size(operand, estimate),
+                      reverse=isinstance(node, Disjunction))
+
+    positives = [unflatten(operand, estimate) for operand in operands
+                 if not isinstance(operand, query.Not)]
+    negatives = [unflatten(operand.expr, estimate) for operand in operands
+                 if isinstance(operand, query.Not)]
+
+    if isinstance(node, Conjunction):
+        # a AND NOT b AND NOT c ==> (a AND NOT b) AND NOT c, which subtracts
+        # from a instead of from every article. When there is nothing to
+        # subtract from, NOT b AND NOT c ==> NOT (b OR c)
+        if not positives:
+            return query.Not(chain(query.Or, negatives))
+        return chain(query.And,
+                     positives + [query.Not(negative) for negative in negatives])
+    else:
+        # a OR NOT b OR NOT c ==> a OR NOT (b AND c), so that there is only one
+        # negation (and only one pass over every article)
+        if negatives:
+            positives.append(query.Not(chain(query.And, negatives)))
+        return chain(query.Or, positives)
+
+def optimize(node, estimate=None):
+    """
+    Optimizes a query tree, returning an equivalent query tree.
+
+    The estimation function, if given, takes in a leaf node (or an
+    `Everything' node) and returns roughly how many articles it matches.
+    """
+    return unflatten(flatten(push_negations(node)), estimate)
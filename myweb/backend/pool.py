@@ -0,0 +1,192 @@
+"""
+Manages the SQLite connections used by the database layer, so that it can be
+used from more than one thread at a time.
+"""
+
+import contextlib
+import re
+import sqlite3
+import threading
+import weakref
+
+# How long (in seconds) a connection waits for another connection's lock to be
+# released before giving up
+TIMEOUT = 30
+
+# The PRAGMAs which can be given to a pool, in the order they are applied - the
+# journal mode has to come first, since it can't be changed inside a
+# transaction
+PRAGMAS = ['journal_mode', 'synchronous', 'cache_size', 'mmap_size',
+           'temp_store']
+
+# PRAGMA values can't be passed as parameters, so they are restricted to things
+# which can be safely pasted into a statement - names and integers
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+def is_memory_path(path):
+    """
+    Checks whether a database path refers to an in-memory database, which
+    can't be shared between connections.
+    """
+    return path == ':memory:' or path.startswith('file::memory:')
+
+class ThreadConnection:
+    """
+    Holds a thread's reading connection. The pool closes the connection once
+    this is garbage collected, which happens when the thread that owns it
+    exits and its thread-local data is thrown away.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+class ConnectionPool:
+    """
+    Hands out connections to a single database.
+
+    Each thread gets its own connection for reading, so that readers never
+    have to wait on each other. All writes go through one connection, and
+    only one thread can write at a time - SQLite only allows a single writer
+    anyway, so this avoids having writers fail with 'database is locked'.
+
+    A thread's reading connection is closed when the thread exits, so that
+    servers which start a thread per request don't keep a connection open for
+    every request they've ever handled.
+
+    In-memory databases are private to the connection that created them, so
+    for those every thread shares the writing connection, taking turns for
+    both reading and writing.
+
+    The pragmas are a dict mapping the names in `PRAGMAS' to their values,
+    which are set on every connection as it is opened.
+    @raise ValueError If a pragma is unknown or has an invalid value.
+    """
+    def __init__(self, path, pragmas=None):
+        self.path = path
+        self.pragmas = dict(pragmas or {})
+        for pragma, value in self.pragmas.items():
+            if pragma not in PRAGMAS:
+                raise ValueError('Unknown storage option: {}'.format(pragma))
+            if not PRAGMA_VALUE.match(str(value)):
+                raise ValueError('Invalid value for {}: {}'.format(
+                    pragma, value))
+
+        self.shared = is_memory_path(path)
+        self.local = threading.local()
+        self.write_lock = threading.RLock()
+        self.connections_lock = threading.Lock()
+        self.connections = []
+        self.writer = self.connect()
+
+    def connect(self):
+        """
+        Opens a new connection to the database.
+        """
+        # Connections are only ever used by one thread at a time, but may be
+        # closed by a different thread than the one that opened them
+        connection = sqlite3.connect(self.path, timeout=TIMEOUT,
+            check_same_thread=False)
+
+        for pragma in PRAGMAS:
+            if pragma in self.pragmas:
+                connection.execute('PRAGMA {} = {}'.format(
+                    pragma, self.pragmas[pragma]))
+
+        with self.connections_lock:
+            self.connections.append(connection)
+        return connection
+
+    def reader(self):
+        """
+        Gets the calling thread's reading connection.
+        """
+        if self.shared:
+            return self.writer
+
+        holder = getattr(self.local, 'reader', None)
+        if holder is None:
+            holder = ThreadConnection(self.connect())
+            weakref.finalize(holder, self.release, holder.connection)
+            self.local.reader = holder
+        return holder.connection
+
+    def release(self, connection):
+        """
+        Closes a connection which is no longer needed.
+        """
+        with self.connections_lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+        connection.close()
+
+    @contextlib.contextmanager
+    def read(self):
+        """
+        A context manager which provides a connection for reading.
+
+        Within a write, this gives out the writing connection instead, so
+        that the writer sees its own uncommitted changes.
+        """
+        if self.shared:
+            with self.write_lock:
+                yield self.writer
+        elif getattr(self.local, 'writing', False):
+            yield self.writer
+        else:
+            yield self.reader()
+
+    @contextlib.contextmanager
+    def write(self):
+        """
+        A context manager which provides a cursor on the writing connection,
+        committing once the block finishes, or rolling back if it raises an
+        exception.
+
+        The transaction is started explicitly, so that schema changes made
+        inside the block are rolled back along with everything else.
+        """
+        with self.write_lock:
+            was_writing = getattr(self.local, 'writing', False)
+            self.local.writing = True
+            if not was_writing:
+                self.local.on_commit = []
+            try:
+                cursor = self.writer.cursor()
+                if not was_writing:
+                    cursor.execute('BEGIN IMMEDIATE')
+                yield cursor
+                if not was_writing:
+                    self.writer.commit()
+            except BaseException:
+                if not was_writing:
+                    self.writer.rollback()
+                    self.local.on_commit = []
+                raise
+            finally:
+                self.local.writing = was_writing
+
+            if not was_writing:
+                callbacks = self.local.on_commit
+                self.local.on_commit = []
+                for callback in callbacks:
+                    callback()
+
+    def on_commit(self, callback):
+        """
+        Arranges for a function to be called once the current write has been
+        committed. If the write is rolled back instead, the function is never
+        called.
+
+        The function is called while the write lock is still held, so that
+        functions from different writes are called in the same order as the
+        writes were committed.
+        """
+        self.local.on_commit.append(callback)
+
+    def close(self):
+        """
+        Closes every connection that the pool has opened.
+        """
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections.clear()
@@ -13,9 +13,30 @@ Domain = namedtuple('Domain', ['domain'])
 Links = namedtuple('Links', ['url'])
 LinkedBy = namedtuple('LinkedBy', ['url'])
 Url = namedtuple('Url', ['url'])
+Content = namedtuple('Content', ['text'])
+Reach = namedtuple('Reach', ['url', 'depth'])
+
+# How many links `reach:' follows, when it isn't given a `depth:', and the
+# most that it can be given - the work done grows with the depth even when the
+# links form cycles, since a URL can be reached again at each depth
+REACH_DEPTH = 2
+MAX_REACH_DEPTH = 10
+
+# These never come out of the parser, but are produced by the optimizer when it
+# can prove that a query matches no articles, or every article
+Nothing = namedtuple('Nothing', [])
+Everything = namedtuple('Everything', [])
 
 # Spaces-out parenthesis to make them easier to parse
 EXPAND_PARENS = str.maketrans({'(': ' ( ', ')': ' ) '})
+def normalize_query(query_string):
+    """
+    Converts a query string into a canonical form, where queries that differ
+    only in their spacing are the same.
+    """
+    expanded_query = query_string.translate(EXPAND_PARENS)
+    return ' '.join(expanded_query.split())
+
 def parse_query(query_string):
     """
     Parses a query string, into a tree of nodes.
@@ -24,7 +45,7 @@ def parse_query(query_string):
     them.
     """
     expanded_query = query_string.translate(EXPAND_PARENS)
-    words = expanded_query.split()
+    words = attach_depths(expanded_query.split())
 
     # Take a flat word list, and convert it to a nested token list depending
     # upon where parenthesis fall.
@@ -60,12 +81,51 @@ def parse_query(query_string):
     else:
         return wordlist_to_node(tokens)
 
+def attach_depths(words):
+    """
+    Joins each `depth:N' word onto the `reach:' word before it, so that the
+    two are parsed as a single term.
+    """
+    joined = []
+    for word in words:
+        if word.startswith('depth:'):
+            # Words never contain spaces, so a space means that the reach:
+            # word already has a depth
+            if (not joined or not joined[-1].startswith('reach:') or
+                    ' ' in joined[-1]):
+                raise SyntaxError('depth: must come after a reach: term')
+            joined[-1] += ' ' + word
+        else:
+            joined.append(word)
+    return joined
+
+def reach_from_word(word):
+    """
+    Converts the text of a `reach:' term (with its `depth:' attached, if it
+    has one) into a Reach node.
+    """
+    url, _, depth = word.partition(' depth:')
+    if not depth:
+        return Reach(url, REACH_DEPTH)
+
+    try:
+        depth = int(depth)
+    except ValueError:
+        raise SyntaxError('Depth must be a number: ' + depth)
+
+    if not 1 <= depth <= MAX_REACH_DEPTH:
+        raise SyntaxError('Depth must be between 1 and {}'.format(
+            MAX_REACH_DEPTH))
+    return Reach(url, depth)
+
 QUERY_WORD = {
     'domain:': Domain,
     'tag:': Tag,
     'links:': Links,
     'linked:': LinkedBy,
-    'url:': Url
+    'url:': Url,
+    'text:': Content,
+    'reach:': reach_from_word,
 }
 
 BINARY_OPS = {
@@ -205,7 +265,11 @@ def node_to_string(node):
         Domain: lambda node: 'domain:' + node.domain,
         Links: lambda node: 'links:' + node.url,
         LinkedBy: lambda node: 'linked:' + node.url,
-        Url: lambda node: 'url:' + node.url
+        Url: lambda node: 'url:' + node.url,
+        Content: lambda node: 'text:' + node.text,
+        Reach: lambda node: 'reach:{} depth:{}'.format(node.url, node.depth),
+        Nothing: lambda node: 'NOTHING',
+        Everything: lambda node: 'EVERYTHING'
     }
 
     if type(node) in formatting:
@@ -5,7 +5,8 @@ from collections import namedtuple
 import re
 from urllib.parse import urlparse
 
-URL_REGEX = re.compile(r'\[\[[^\]]+\]\]')
+# The URL of a link is the part between the brackets
+URL_REGEX = re.compile(r'\[\[([^\]]+)\]\]')
 
 # Types used to indicate the return value of `get_list_chunks`
 Link = namedtuple('Link', ['url'])
@@ -15,9 +16,7 @@ def normalize_url(url):
     """
     Normalizes a URL by stripping the terminating '/'.
     """
-    while url.endswith('/'):
-        url = url[:-1]
-    return url
+    return url.rstrip('/')
 
 def get_domain(url):
     """
@@ -26,41 +25,54 @@ def get_domain(url):
     parsed_url = urlparse(normalize_url(url))
     return parsed_url.netloc
 
-def get_links(text):
+def get_link_spans(text):
+    """
+    Finds where each link is in a piece of text, as a list of (start, end)
+    offsets covering the link and its brackets. The other functions here can
+    use these instead of searching the text again.
+    """
+    return [match.span() for match in URL_REGEX.finditer(text)]
+
+def get_links(text, spans=None):
     """
     Parses out a list of links from a piece of text, returning a set of URLs.
     """
-    urls = URL_REGEX.findall(text)
-    return set(normalize_url(url[2:-2]) for url in urls)
+    if spans is None:
+        return set(normalize_url(url) for url in URL_REGEX.findall(text))
+
+    return set(normalize_url(text[link_start + 2:link_end - 2])
+               for link_start, link_end in spans)
 
-def get_link_chunks(text):
+def iter_link_chunks(text, spans=None):
     """
-    Gets a list of elements, where each is either a:
+    Goes through a piece of text, yielding a Text for the text before each
+    link, followed by a Link for the link itself, and finally a Text for
+    whatever comes after the last link.
 
-     - Link
-     - Text
+    The text is scanned once (or not at all, if the spans of its links are
+    given), and only the pieces which are yielded are copied out of it, so
+    this takes time in proportion to the length of the text no matter how
+    many links it has.
     """
-    items = []
-    while text:
-        match = URL_REGEX.search(text)
+    if spans is None:
+        spans = (match.span() for match in URL_REGEX.finditer(text))
 
-        # No match indicates that there isn't a link in the remaining text;
-        # store it as a single Text node
-        if match is None:
-            items.append(Text(text))
-            text = ''
-        else:
-            # First, get all the pre-link text in as a Text node
-            link_start, link_end = match.span()
-            pre_link = text[:link_start]
-            items.append(Text(pre_link))
+    position = 0
+    for link_start, link_end in spans:
+        yield Text(text[position:link_start])
+        yield Link(normalize_url(text[link_start + 2:link_end - 2]))
+        position = link_end
 
-            # Then, get the link text
-            link = text[link_start:link_end]
-            raw_link = link[2:-2]
-            items.append(Link(normalize_url(raw_link)))
+    if position < len(text):
+        yield Text(text[position:])
 
-            # Finally, strip off everything we just consumed
-            text = text[link_end:]
+def get_link_chunks(text, spans=None):
+    """
+    Gets a list of elements, where each is either a:
+
+     - Link
+     - Text
 
-    return items
+    See `iter_link_chunks'.
+    """
+    return list(iter_link_chunks(text, spans))
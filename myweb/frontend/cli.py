@@ -2,13 +2,18 @@
 A command-line based frontend for interacting with myweb.
 """
 
-from myweb.backend import config, db, query, utils
+from myweb.backend import compression, config, db
 
 import argparse
+import io
+import json
 import os
 import re
 import sys
+import tarfile
 import tempfile
+import time
+import urllib.parse
 
 HELP = """myweb-cli - A command-line interface to myweb.
 Usage:
@@ -16,7 +21,11 @@ Usage:
 
 Commands:
     search QUERY
-        Searches the database using the given query.
+        Searches the database using the given query, showing the matching
+        URLs in order.
+    search-text WORD...
+        Searches the content of every article for the given words, showing
+        the most relevant articles first.
     print URL
         Shows the content of the URL, including backlinks, to stdout.
     view [--no-backlinks] URL
@@ -37,6 +46,28 @@ Commands:
         Updates the list of tags for the URL.
     delete
         Removes the given URL from the database.
+    import [--defer-indexes] [--url-prefix PREFIX] [--tag TAG...] PATH
+        Imports many articles at once, all in a single transaction. PATH is
+        either a JSON Lines file (or - for stdin) with one object like
+        {"url": "...", "content": "...", "tags": [...], "links": [...]}
+        per line (the links are found in the content if not given), or a
+        directory, where each file becomes an article whose URL is the
+        file's path (relative to the directory) after PREFIX, and whose tags
+        are the given TAGs.
+    export [--format jsonl|tar]
+        Writes every article to stdout, either as JSON Lines (which can be
+        read back in by import) or as a tar archive with one file per
+        article.
+    recompress [--codec CODEC] [--train] [--batch-size N]
+        Compresses every article with CODEC (by default, the codec in the
+        configuration file), a batch of N articles at a time. The zlib-dict
+        and zstd codecs use a dictionary trained on the articles, which is
+        trained first if there isn't one yet or if --train is given (zstd
+        goes without one if there are too few articles to train on).
+    report [--dangling] [--orphans] [--tags]
+        Lists the links to URLs which have no article, the articles which
+        no other article links to, and how many articles have each tag. If
+        none of the options are given, all three are listed.
     help
         Show a complete help page.
 """
@@ -51,8 +82,107 @@ def init_db(config_opts):
     """
     Loads the database.
     """
-    db.load_database(config_opts['myweb']['db'])
+    db.load_database(config_opts['myweb']['db'],
+        config.storage_profile(config_opts),
+        config_opts['myweb']['codec'])
         
+def read_jsonl_articles(stream):
+    """
+    Reads articles from a stream of JSON objects, one per line.
+
+    The links are taken from the "links" field if there is one (as there is
+    in the output of `export_jsonl'), so that exported articles come back
+    with the links they were stored with, and are otherwise left for the
+    database to find in the content.
+    """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+
+        record = json.loads(line)
+        try:
+            url = record['url']
+            content = record['content']
+        except KeyError as ex:
+            raise ValueError('Line {} has no "{}"'.format(
+                line_number, ex.args[0]))
+
+        links = set(record['links']) if 'links' in record else None
+        yield (url, content, links, set(record.get('tags', [])))
+
+def read_directory_articles(path, url_prefix, tags):
+    """
+    Reads articles from each of the files under a directory.
+    """
+    for dir_path, dir_names, file_names in os.walk(path):
+        # Walk in a consistent order, so that repeated imports of the same
+        # tree behave the same way
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            relative_path = os.path.relpath(file_path, path)
+            url = url_prefix + '/'.join(relative_path.split(os.sep))
+
+            with open(file_path, encoding='utf-8') as article_file:
+                content = article_file.read()
+            yield (url, content, None, set(tags))
+
+def print_recompress_progress(count):
+    """
+    Reports how many articles have been recompressed so far.
+    """
+    print('Checked', count, 'articles', file=sys.stderr)
+
+def print_import_progress(count):
+    """
+    Reports how many articles have been imported so far.
+    """
+    print('Imported', count, 'articles', file=sys.stderr)
+
+def export_jsonl(articles, stream):
+    """
+    Writes articles to a binary stream, as one JSON object per line.
+    """
+    for article in articles:
+        record = {
+            'url': article.url,
+            'content': article.content,
+            'tags': sorted(article.tags),
+            'links': sorted(article.links),
+        }
+        stream.write(bytes(json.dumps(record) + '\n', 'utf-8'))
+
+def export_tar(articles, stream):
+    """
+    Writes articles to a binary stream, as a tar archive.
+
+    Each article is a file named after its (URL encoded) URL, and dated when
+    the article was last modified (or now, if that wasn't recorded). The
+    original URL and the article's tags are stored as JSON in the PAX comment
+    of each file, which tar implementations keep but otherwise ignore.
+    """
+    now = time.time()
+    # A stream-mode archive never seeks, so it can be written to a pipe
+    with tarfile.open(fileobj=stream, mode='w|',
+            format=tarfile.PAX_FORMAT) as archive:
+        for article in articles:
+            content_bytes = bytes(article.content, 'utf-8')
+
+            info = tarfile.TarInfo(urllib.parse.quote(article.url, ''))
+            info.size = len(content_bytes)
+            info.mtime = now if article.modified is None else article.modified
+            info.pax_headers = {
+                'comment': json.dumps({
+                    'url': article.url,
+                    'tags': sorted(article.tags)}),
+            }
+            archive.addfile(info, io.BytesIO(content_bytes))
+
+EXPORT_FORMATS = {
+    'jsonl': export_jsonl,
+    'tar': export_tar,
+}
+
 def main():
     "Parses the command line and initializes the given action."
     arg_parser = argparse.ArgumentParser()
@@ -66,6 +196,11 @@ def main():
     search_parser.add_argument('QUERY',
         help='A well-formed myweb query')
 
+    search_text_parser = sub_args.add_parser('search-text',
+        help='Search the content of articles, printing the best matches first')
+    search_text_parser.add_argument('WORDS', nargs='+',
+        help='The words which the articles must contain')
+
     print_parser = sub_args.add_parser('print',
         help='Prints the article for the URL, plus backlinks, to stdout.')
     print_parser.add_argument('URL',
@@ -115,6 +250,42 @@ def main():
     delete_parser.add_argument('URL',
         help='A URL which exists in the database')
 
+    import_parser = sub_args.add_parser('import',
+        help='Imports articles from a JSON Lines file or a directory')
+    import_parser.add_argument('--defer-indexes', action='store_true',
+        help='Rebuild the indexes after importing, rather than during')
+    import_parser.add_argument('--url-prefix', default='',
+        help='The prefix for URLs of articles imported from a directory')
+    import_parser.add_argument('--tag', action='append', default=[],
+        help='A tag to give to articles imported from a directory')
+    import_parser.add_argument('PATH',
+        help='A JSON Lines file, - for stdin, or a directory')
+
+    export_parser = sub_args.add_parser('export',
+        help='Writes every article to stdout')
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS,
+        default='jsonl', help='Either JSON Lines (jsonl) or a tar archive')
+
+    recompress_parser = sub_args.add_parser('recompress',
+        help='Compresses every article with a different codec')
+    recompress_parser.add_argument('--codec',
+        choices=sorted(compression.CODECS_BY_NAME),
+        help='The codec to use, instead of the configured one')
+    recompress_parser.add_argument('--train', action='store_true',
+        help='Train a new dictionary before recompressing')
+    recompress_parser.add_argument('--batch-size', type=int,
+        default=db.RECOMPRESS_BATCH_SIZE,
+        help='How many articles to rewrite in each transaction')
+
+    report_parser = sub_args.add_parser('report',
+        help='Lists dangling links, orphaned articles and tag counts')
+    report_parser.add_argument('--dangling', action='store_true',
+        help='List links to URLs which have no article')
+    report_parser.add_argument('--orphans', action='store_true',
+        help='List articles which no other article links to')
+    report_parser.add_argument('--tags', action='store_true',
+        help='List how many articles have each tag')
+
     arg_context = arg_parser.parse_args(sys.argv[1:])
 
     if arg_context.command is None:
@@ -128,16 +299,19 @@ def main():
         init_db(config_opts)
 
         try:
-            parsed = query.parse_query(arg_context.QUERY)
-            arg_contexts = db.execute_query(parsed)
-
-            for arg_context in arg_contexts:
-                print(arg_context)
+            for url in db.iter_search(arg_context.QUERY):
+                print(url)
         except (IndexError, SyntaxError) as ex:
             print('Invalid query string "{}"'.format(arg_context.QUERY),
                 file=sys.stderr)
             print('\t' + str(ex), file=sys.stderr)
             return 1
+    elif arg_context.command == 'search-text':
+        config_opts = load_config()
+        init_db(config_opts)
+
+        for url in db.rank_text_matches(arg_context.WORDS):
+            print(url)
     elif arg_context.command == 'print':
         config_opts = load_config()
         init_db(config_opts)
@@ -202,9 +376,8 @@ def main():
 
         article = sys.stdin.read()
         tags = set(arg_context.TAGS)
-        links = utils.get_links(article)
         try:
-            db.create_article(arg_context.URL, article, links, tags)
+            db.create_article(arg_context.URL, article, None, tags)
         except KeyError:
             print('Article for', arg_context.URL, 'already exists',
                 file=sys.stderr)
@@ -216,8 +389,7 @@ def main():
         article = sys.stdin.read()
         try:
             old_article = db.get_article(arg_context.URL)
-            links = utils.get_links(article)
-            db.update_article(arg_context.URL, article, links, 
+            db.update_article(arg_context.URL, article, None,
                 old_article.tags)
         except KeyError:
             print('Article for', arg_context.URL, 'does not exist',
@@ -252,8 +424,7 @@ def main():
                 article_file.seek(0)
                 new_article_text = article_file.read()
 
-            links = utils.get_links(new_article_text)
-            db.update_article(arg_context.URL, new_article_text, links,
+            db.update_article(arg_context.URL, new_article_text, None,
                 article.tags)
                 
         except KeyError:
@@ -265,10 +436,7 @@ def main():
         init_db(config_opts)
 
         try:
-            old_article = db.get_article(arg_context.URL)
-            tags = set(arg_context.TAGS)
-            db.update_article(arg_context.URL, old_article.content,
-                old_article.links, tags)
+            db.update_tags(arg_context.URL, set(arg_context.TAGS))
         except KeyError:
             print('Article for', arg_context.URL, 'does not exist',
                 file=sys.stderr)
@@ -278,3 +446,84 @@ def main():
         init_db(config_opts)
         
         db.delete_article(arg_context.URL)
+    elif arg_context.command == 'import':
+        config_opts = load_config()
+        init_db(config_opts)
+
+        try:
+            if arg_context.PATH == '-':
+                articles = read_jsonl_articles(sys.stdin)
+                count = db.bulk_create_articles(articles,
+                    arg_context.defer_indexes, print_import_progress)
+            elif os.path.isdir(arg_context.PATH):
+                articles = read_directory_articles(arg_context.PATH,
+                    arg_context.url_prefix, arg_context.tag)
+                count = db.bulk_create_articles(articles,
+                    arg_context.defer_indexes, print_import_progress)
+            else:
+                with open(arg_context.PATH, encoding='utf-8') as jsonl_file:
+                    articles = read_jsonl_articles(jsonl_file)
+                    count = db.bulk_create_articles(articles,
+                        arg_context.defer_indexes, print_import_progress)
+        except KeyError as ex:
+            print('Import failed, nothing was imported:', ex.args[0],
+                file=sys.stderr)
+            return 1
+        except (OSError, ValueError) as ex:
+            print('Import failed, nothing was imported:', str(ex),
+                file=sys.stderr)
+            return 1
+
+        print('Imported', count, 'articles in total', file=sys.stderr)
+    elif arg_context.command == 'export':
+        config_opts = load_config()
+        init_db(config_opts)
+
+        exporter = EXPORT_FORMATS[arg_context.format]
+        exporter(db.iter_articles(), sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    elif arg_context.command == 'recompress':
+        config_opts = load_config()
+        init_db(config_opts)
+
+        codec_name = arg_context.codec or config_opts['myweb']['codec']
+        try:
+            codec = compression.get_codec(codec_name)
+        except ImportError as ex:
+            print(str(ex), file=sys.stderr)
+            return 1
+
+        if codec.uses_dictionary and (arg_context.train or
+                codec.id not in db.LATEST_DICTIONARIES):
+            print('Training a dictionary for', codec_name, file=sys.stderr)
+            if db.train_dictionary(codec_name) is None:
+                print('Not enough articles to train a dictionary, so',
+                    'compressing without one', file=sys.stderr)
+
+        count = db.recompress_articles(codec_name, arg_context.batch_size,
+            print_recompress_progress)
+        print('Recompressed', count, 'articles in total', file=sys.stderr)
+    elif arg_context.command == 'report':
+        config_opts = load_config()
+        init_db(config_opts)
+
+        show_all = not (arg_context.dangling or arg_context.orphans or
+            arg_context.tags)
+
+        if show_all or arg_context.dangling:
+            print('----- Dangling links -----')
+            for url, missing_urls in sorted(db.get_dangling_links().items()):
+                for missing_url in sorted(missing_urls):
+                    print(' - ', url, '->', missing_url)
+
+        if show_all or arg_context.orphans:
+            print('\n----- Orphans -----')
+            for url in sorted(db.get_orphans()):
+                print(' - ', url)
+
+        if show_all or arg_context.tags:
+            print('\n----- Tags -----')
+            tag_counts = db.get_tag_counts()
+            for tag in sorted(tag_counts,
+                    key=lambda tag: (-tag_counts[tag], tag)):
+                print(' - ', tag, tag_counts[tag])
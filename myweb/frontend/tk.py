@@ -2,7 +2,7 @@
 A tkinter-based frontend for interacting with myweb.
 """
 
-from myweb.backend import config, db, query, utils
+from myweb.backend import config, db, utils
 
 import tkinter as tk
 import tkinter.ttk as ttk
@@ -75,12 +75,11 @@ class CreateTab:
 
         url = article_url.strip()
         tags = set(article_tags.split())
-        links = utils.get_links(article_text)
         try:
             # Tk adds an extra newline, which we need to strip
             article_text = article_text[:-1]
 
-            db.create_article(url, article_text, links, tags)
+            db.create_article(url, article_text, None, tags)
             tk_message.showinfo('OK', 'Successfully saved article')
             self.app.close(self)
         except IOError:
@@ -152,12 +151,11 @@ class EditTab:
         article_tags = self.tags.get()
 
         tags = set(article_tags.split())
-        links = utils.get_links(article_text)
         try:
             # Tk adds an extra newline, which we need to strip
             article_text = article_text[:-1]
 
-            db.update_article(self.url, article_text, links, tags)
+            db.update_article(self.url, article_text, None, tags)
             tk_message.showinfo('OK', 'Successfully saved article')
         except IOError:
             tk_message.showerror('Error', 'No article exists for that URL')
@@ -205,16 +203,22 @@ class ViewTab:
             self.view.tag_delete(tag)
         self.view_tags.clear()
 
+        # Links to articles which don't exist yet are shown differently, like
+        # the red links of a traditional wiki
+        missing_links = db.get_dangling_links([article.url]).get(
+            article.url, set())
+
         # First, generate the main body text, and filter out any links
-        for chunk in utils.get_link_chunks(article.content):
+        for chunk in article.chunks():
             if isinstance(chunk, utils.Text):
                 self.view.insert('end', chunk.text)
             elif isinstance(chunk, utils.Link):
                 link_tag = 'link-' + chunk.url
                 if link_tag not in self.view_tags:
                     self.view_tags.add(link_tag)
-                    self.view.tag_configure(link_tag,
-                        underline=True, foreground='blue')
+                    self.view.tag_configure(link_tag, underline=True,
+                        foreground='red' if chunk.url in missing_links
+                            else 'blue')
                     self.view.tag_bind(link_tag, '<Button-1>', self.open_link)
 
                 self.view.insert('end', chunk.url, link_tag)
@@ -358,8 +362,7 @@ class SearchTab:
             if not query_text.strip():
                 return
 
-            parsed = query.parse_query(self.query.get())
-            results = db.execute_query(parsed)
+            results = db.search(query_text)
             self.items.insert('end', *results)
         except SyntaxError as ex:
             tk_message.showerror('Error', str(ex))
@@ -459,7 +462,9 @@ def main():
     root.wm_title('myweb')
 
     config_opts = config.load_config({'tk': {'theme': 'default'}})
-    db.load_database(config_opts['myweb']['db'])
+    db.load_database(config_opts['myweb']['db'],
+        config.storage_profile(config_opts),
+        config_opts['myweb']['codec'])
 
     theme_name = config_opts['tk']['theme']
     style = ttk.Style()
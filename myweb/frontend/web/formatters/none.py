@@ -7,14 +7,15 @@ import urllib.parse
 
 from myweb.backend import utils
 
-def to_html(article_text, backlinks):
+def to_html(article_text, backlinks, spans=None):
     """
-    Converts an article into simple HTML.
+    Converts an article into simple HTML. The spans of the article's links
+    can be given, if they are known, to save searching for them.
     """
     html_buffer = io.StringIO()
 
     print('<pre>', end='', file=html_buffer)
-    for chunk in utils.get_link_chunks(article_text):
+    for chunk in utils.iter_link_chunks(article_text, spans):
         if isinstance(chunk, utils.Text):
             print(html.escape(chunk.text), end='', file=html_buffer)
         else:
@@ -8,13 +8,15 @@ import urllib.parse
 
 from myweb.backend import utils
 
-def to_html(article_text, backlinks):
+def to_html(article_text, backlinks, spans=None):
     """
     Converts the article to HTML, using restructuredtext as an intermediary.
+    The spans of the article's links can be given, if they are known, to save
+    searching for them.
     """
     rest_buffer = io.StringIO()
 
-    for chunk in utils.get_link_chunks(article_text):
+    for chunk in utils.iter_link_chunks(article_text, spans):
         if isinstance(chunk, utils.Text):
             print(chunk.text, end='', file=rest_buffer)
         else:
@@ -21,6 +21,57 @@ function ajax(uri, data, headers, on_ready) {
 
     xhr.send(data);
 }
+
+function ajax_get(uri, on_ready) {
+    var xhr = new XMLHttpRequest();
+
+    xhr.onreadystatechange = (function() {
+        if (xhr.readyState == 4) {
+            on_ready(xhr.responseText);
+        }
+    });
+
+    xhr.open('GET', uri, true);
+    xhr.send();
+}
+
+function ajax_stream(uri, data, headers, on_line) {
+    // Like ajax, but for newline-delimited responses - on_line is called
+    // with each line as soon as it arrives. The request is returned, so
+    // that it can be aborted.
+    var xhr = new XMLHttpRequest();
+    var seen = 0;
+
+    var read_lines = (function() {
+        var end = xhr.responseText.lastIndexOf('\\n');
+        if (end < seen) {
+            return;
+        }
+
+        var lines = xhr.responseText.substring(seen, end).split('\\n');
+        seen = end + 1;
+        for (var i = 0; i < lines.length; i++) {
+            if (lines[i]) {
+                on_line(lines[i]);
+            }
+        }
+    });
+
+    xhr.onprogress = read_lines;
+    xhr.onreadystatechange = (function() {
+        if (xhr.readyState == 4) {
+            read_lines();
+        }
+    });
+
+    xhr.open('POST', uri, true);
+    for (var key in headers) {
+        xhr.setRequestHeader(key, headers[key].toString());
+    }
+
+    xhr.send(data);
+    return xhr;
+}
 '''
 
 ###############################################################################
@@ -46,11 +97,25 @@ function do_new() {
     window.location.pathname = '/new';
 }
 
+// The search that's still streaming in, if any
+var current_search = null;
+
 function do_search() {
     var query = document.getElementById("query").value;
-    var query_body = JSON.stringify({'query': query});
+    var query_body = JSON.stringify({'query': query, 'stream': true});
+    var result_list = document.getElementById('results');
 
-    ajax('/ajax/query', query_body, {
+    if (current_search) {
+        current_search.abort();
+    }
+
+    while (result_list.firstChild) {
+        result_list.removeChild(result_list.firstChild);
+    }
+
+    // The results come in a batch per line, in order, so each batch is
+    // shown as soon as it arrives
+    current_search = ajax_stream('/ajax/query', query_body, {
             'Content-Type': 'application/json',
             'Content-Length': query_body.length
         },
@@ -61,11 +126,6 @@ function do_search() {
             alert("Malformed query");
         } else {
             var articles = result['articles'];
-            var result_list = document.getElementById('results');
-
-            while (result_list.firstChild) {
-                result_list.removeChild(result_list.firstChild);
-            }
 
             for (var i = 0; i < articles.length; i++) {
                 var uri = articles[i];
@@ -164,11 +224,10 @@ function load_article_content() {
     // components[2] == <article-uri>
     var uri = components.slice(2).join('/');
 
-    var request_body = JSON.stringify({'uri': decodeURIComponent(uri)});
-    ajax('/ajax/get-article', request_body, {
-            'Content-Type': 'application/json',
-            'Content-Length': request_body.length
-        },
+    // This is a GET so that the browser can cache the article, and only has
+    // to ask whether it has changed when it's viewed again
+    ajax_get('/ajax/get-article?uri=' +
+            encodeURIComponent(decodeURIComponent(uri)),
     (function(result_text) {
         var result = JSON.parse(result_text);
         if (result['was-error']) {
@@ -250,6 +309,31 @@ function escapeHTML(s) {
             .replace(/>/g, '&gt;');
 }
 
+// Draws the links to URLs which have no article in red, like the red links
+// of a traditional wiki. The formatters give links as the quoted URL, either
+// under /view/ or relative to it.
+function mark_missing_links(missing_links) {
+    var links = document.getElementById('content').getElementsByTagName('a');
+    for (var i = 0; i < links.length; i++) {
+        var href = links[i].getAttribute('href') || '';
+        if (href.indexOf('/view/') == 0) {
+            href = href.substring('/view/'.length);
+        }
+
+        var url;
+        try {
+            url = decodeURIComponent(href);
+        } catch (e) {
+            continue;
+        }
+
+        if (missing_links.indexOf(url) != -1) {
+            links[i].style.color = 'red';
+            links[i].title = 'No article yet';
+        }
+    }
+}
+
 function load_article_content() {
     var components = window.location.pathname.split('/');
     // componets[0] == ""
@@ -257,11 +341,10 @@ function load_article_content() {
     // components[2] == <article-uri>
     var uri = components.slice(2).join('/');
 
-    var request_body = JSON.stringify({'uri': decodeURIComponent(uri)});
-    ajax('/ajax/get-article', request_body, {
-            'Content-Type': 'application/json',
-            'Content-Length': request_body.length
-        },
+    // This is a GET so that the browser can cache the article, and only has
+    // to ask whether it has changed when it's viewed again
+    ajax_get('/ajax/get-article?uri=' +
+            encodeURIComponent(decodeURIComponent(uri)),
     (function(result_text) {
         var result = JSON.parse(result_text);
         if (result['was-error']) {
@@ -270,6 +353,7 @@ function load_article_content() {
         } else {
             document.getElementById('uri').innerHTML = escapeHTML(decodeURIComponent(uri));
             document.getElementById('content').innerHTML = result['html-content'];
+            mark_missing_links(result['missing-links']);
 
             var tags_elem = document.getElementById('tags');
             tags_elem.innerHTML = '';
@@ -0,0 +1,107 @@
+"""
+A cache of the HTML that formatters produce for articles, so that an article
+which hasn't changed isn't formatted again every time it's viewed.
+
+The HTML is kept in memory, and optionally in an SQLite database of its own,
+so that it survives the server being restarted.
+"""
+
+import hashlib
+
+from myweb.backend import cache, pool
+
+# How much HTML (in characters) is kept in memory by default
+RENDER_CACHE_SIZE = 16 * 1024 * 1024
+
+class Queries:
+    """
+    The statements used on the on-disk cache.
+    """
+    create_rendered_table = '''
+CREATE TABLE IF NOT EXISTS RENDERED(Formatter TEXT, Url TEXT, Digest BLOB,
+    Html TEXT, PRIMARY KEY(Formatter, Url)) WITHOUT ROWID'''
+    get_rendered = '''
+SELECT Digest, Html FROM RENDERED WHERE Formatter = ? AND Url = ?'''
+    put_rendered = '''
+INSERT OR REPLACE INTO RENDERED(Formatter, Url, Digest, Html)
+VALUES (?, ?, ?, ?)'''
+    delete_rendered = '''
+DELETE FROM RENDERED WHERE Url = ?'''
+
+def render_digest(content, backlinks):
+    """
+    Digests everything that a formatter's output depends on - the article's
+    content and its backlinks.
+    """
+    digest = hashlib.sha1(content.encode('utf-8'))
+    for backlink in sorted(backlinks):
+        digest.update(b'\0' + backlink.encode('utf-8'))
+    return digest.digest()
+
+class RenderCache:
+    """
+    Wraps a formatter's `to_html', keeping the HTML it produces for each
+    article.
+
+    Each article has one entry, which records a digest of the content and
+    backlinks it was rendered from. When either changes - because the article
+    was edited, or because an article linking to it was - the digest no
+    longer matches, and the article is formatted again. The entries live in
+    an LRU cache, and also in an SQLite database if a path is given.
+    """
+    def __init__(self, to_html, formatter, size=RENDER_CACHE_SIZE, path=None):
+        self.to_html = to_html
+        self.formatter = formatter
+        self.memory = cache.LRUCache(size,
+            lambda entry: len(entry[1]) + len(entry[0]))
+
+        self.disk = None
+        if path:
+            self.disk = pool.ConnectionPool(path)
+            with self.disk.write() as cursor:
+                cursor.execute(Queries.create_rendered_table)
+
+    def render(self, url, content, backlinks, spans=None):
+        """
+        Gets the HTML for an article, formatting it only if the cache doesn't
+        have HTML for the same content and backlinks.
+        """
+        digest = render_digest(content, backlinks)
+
+        entry = self.memory.get(url)
+        if entry is not None and entry[0] == digest:
+            return entry[1]
+
+        if self.disk is not None:
+            with self.disk.read() as connection:
+                entry = connection.execute(Queries.get_rendered,
+                    (self.formatter, url)).fetchone()
+
+            if entry is not None and entry[0] == digest:
+                self.memory.put(url, entry)
+                return entry[1]
+
+        html = self.to_html(content, backlinks, spans)
+        self.memory.put(url, (digest, html))
+        if self.disk is not None:
+            with self.disk.write() as cursor:
+                cursor.execute(Queries.put_rendered,
+                    (self.formatter, url, digest, html))
+
+        return html
+
+    def discard(self, url):
+        """
+        Throws away the HTML for an article, once it has been deleted.
+        """
+        self.memory.discard(url)
+        if self.disk is not None:
+            with self.disk.write() as cursor:
+                cursor.execute(Queries.delete_rendered, (url,))
+
+    def close(self):
+        """
+        Closes the on-disk cache, if there is one.
+        """
+        if self.disk is not None:
+            self.disk.close()
@@ -5,20 +5,47 @@ This is to make it easy to use myweb without having to open an external
 application.
 
 Note that, if you want to, you can use this with mod_wsgi instead of the
-builtin wsgiref server.
+builtin servers (see `myweb.frontend.web.serving').
 """
 
+import email.utils
+import hashlib
 import html
 import importlib
+import itertools
 import json
 import os, os.path
-from wsgiref import simple_server
+import urllib.parse
+import zlib
 
-from myweb.backend import config, db, query, utils
+from myweb.backend import config, db, utils
+from myweb.frontend.web import render_cache, serving
 from myweb.frontend.web.html import *
 
 FORMAT_TO_HTML = None
 
+# Keeps the output of FORMAT_TO_HTML - see myweb.frontend.web.render_cache
+RENDER_CACHE = None
+
+# The content codings that responses can be compressed with, in order of
+# preference, and the zlib window bits which produce each of them
+CONTENT_CODINGS = (('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS))
+
+# Responses smaller than this (in bytes) aren't worth compressing
+COMPRESS_THRESHOLD = 1024
+
+# How hard responses are compressed when they're sent. The static pages are
+# only compressed once, so they always get the best compression.
+COMPRESS_LEVEL = 6
+
+# The most URLs that /ajax/query sends back in one page, or in one line of a
+# streamed response
+QUERY_PAGE_LIMIT = 1000
+
+# How long (in seconds) browsers can keep the static pages without checking
+# back
+STATIC_MAX_AGE = 24 * 60 * 60
+
 def make_headers(header_dict):
     """
     Creates a list of headers for WSGI from a dict.
@@ -40,6 +67,68 @@ def make_headers(header_dict):
 
     return headers
 
+def choose_encoding(environ):
+    """
+    Picks the content coding for a response from the client's
+    Accept-Encoding, or returns None if the response shouldn't be
+    compressed.
+    """
+    qualities = {}
+    for item in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    best_coding, best_quality = None, 0.0
+    for coding, _ in CONTENT_CODINGS:
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best_coding, best_quality = coding, quality
+    return best_coding
+
+def compress_body(data, coding, level=COMPRESS_LEVEL):
+    """
+    Compresses a response body with one of the CONTENT_CODINGS.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED,
+        dict(CONTENT_CODINGS)[coding])
+    return compressor.compress(data) + compressor.flush()
+
+def encode_response(environ, header_dict, body):
+    """
+    Compresses a response body if the client accepts it and the body is
+    large enough to be worth it, returning the body along with the headers
+    to send it with.
+
+    A compressed body isn't byte-for-byte what its ETag (if it has one) was
+    made from, so the ETag is weakened, which is still enough for a
+    conditional GET to match it.
+    """
+    header_dict = dict(header_dict, Vary='Accept-Encoding')
+
+    coding = choose_encoding(environ)
+    if coding is not None and len(body) >= COMPRESS_THRESHOLD:
+        body = compress_body(body, coding)
+        header_dict['Content-Encoding'] = coding
+
+        etag = header_dict.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            header_dict['ETag'] = 'W/' + etag
+
+    header_dict['Content-Length'] = len(body)
+    return header_dict, body
+
 def generate_404(_, start_response):
     """
     Generates an error when loading a nonexistent page.
@@ -54,19 +143,137 @@ def generate_404(_, start_response):
 def generate_html_page(page_data):
     """
     Generates a function which returns the HTML for a page.
+
+    The page never changes, so it's compressed ahead of time in each of the
+    CONTENT_CODINGS. Each version has its own strong ETag, and browsers can
+    keep them for STATIC_MAX_AGE.
     """
-    def page_maker(_, start_response):
+    digest = hashlib.sha1(page_data).hexdigest()
+    versions = {None: (page_data, '"{}"'.format(digest))}
+    for coding, _ in CONTENT_CODINGS:
+        versions[coding] = (compress_body(page_data, coding, 9),
+            '"{}-{}"'.format(digest, coding))
+
+    def page_maker(environ, start_response):
         """
         Returns a simple HTML page.
         """
-        start_response('200 OK',
-                make_headers({
-                    'Content-Length': len(page_data),
-                    'Content-Type': 'text/html'
-                }))
-        return [page_data]
+        coding = choose_encoding(environ)
+        body, etag = versions[coding]
+        header_dict = {
+            'Cache-Control': 'public, max-age={}'.format(STATIC_MAX_AGE),
+            'ETag': etag,
+            'Vary': 'Accept-Encoding'
+        }
+
+        if is_not_modified(environ, etag, None):
+            start_response('304 NOT MODIFIED', make_headers(header_dict))
+            return []
+
+        if coding is not None:
+            header_dict['Content-Encoding'] = coding
+        header_dict['Content-Length'] = len(body)
+        header_dict['Content-Type'] = 'text/html'
+        start_response('200 OK', make_headers(header_dict))
+        return [body]
     return page_maker
 
+def make_etag(content_hash):
+    """
+    Creates a strong ETag out of the hash of an article's content.
+    """
+    return '"' + content_hash.hex() + '"'
+
+def make_article_etag(version):
+    """
+    Creates a strong ETag for what /ajax/get-article returns about an
+    article, which depends on the article's version (see
+    `db.get_article_version') and on the formatter that renders it.
+    """
+    tag = '{}:{}:{!r}:{}'.format(version.id, version.version,
+        version.modified, FORMAT_TO_HTML.__module__)
+    return make_etag(hashlib.sha1(tag.encode('utf-8')).digest())
+
+def is_not_modified(environ, etag, modified):
+    """
+    Checks whether a conditional request asks for something the client
+    already has, so that it can be answered with a 304.
+
+    If-None-Match is used over If-Modified-Since when both are given, since
+    HTTP dates only go down to the second, and an ETag can tell apart two
+    changes made within the same second.
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in etags or etag in etags or 'W/' + etag in etags
+
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None and modified is not None:
+        try:
+            since = email.utils.mktime_tz(
+                email.utils.parsedate_tz(if_modified_since))
+        except (TypeError, ValueError):
+            return False
+        return int(modified) <= since
+
+    return False
+
+def generate_cache_stats(environ, start_response):
+    """
+    Returns how well each of the caches is doing, as JSON of the form:
+
+     {"queries": {"hits": ..., "misses": ..., "hit-rate": ...},
+      "results": {...}, "rendered": {...}}
+
+    The counts cover every request since the server started, which makes
+    them more useful than anything a single run of the CLI could report.
+    """
+    stats = db.cache_stats()
+    stats['rendered'] = {'hits': RENDER_CACHE.memory.hits,
+                         'misses': RENDER_CACHE.memory.misses,
+                         'hit-rate': RENDER_CACHE.memory.hit_rate()}
+
+    header_dict, json_response = encode_response(environ,
+        {'Cache-Control': 'no-cache', 'Content-Type': 'application/json'},
+        bytes(json.dumps(stats), 'utf-8'))
+    start_response('200 OK', make_headers(header_dict))
+    return [json_response]
+
+def generate_raw_article(environ, start_response):
+    """
+    Returns the content of an article as plain text, with its content hash
+    as the ETag. If the client already has that version, then the answer is
+    a 304 and the article's content isn't read at all.
+    """
+    # WSGI gives out the path as Latin-1, whatever its real encoding was, and
+    # a path which isn't UTF-8 can't be the URL of any article
+    article_uri = environ['PATH_INFO'][len('/raw/'):]
+    try:
+        article_uri = article_uri.encode('latin-1').decode('utf-8')
+    except UnicodeError:
+        return generate_404(environ, start_response)
+
+    try:
+        content_hash = db.get_content_hash(article_uri)
+        if (content_hash is not None and
+                is_not_modified(environ, make_etag(content_hash), None)):
+            start_response('304 NOT MODIFIED',
+                    make_headers({'ETag': make_etag(content_hash),
+                                  'Vary': 'Accept-Encoding'}))
+            return []
+
+        article = db.get_article(article_uri)
+    except KeyError:
+        return generate_404(environ, start_response)
+
+    header_dict, content = encode_response(environ, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'ETag': make_etag(db.hash_content(article.content))
+    }, bytes(article.content, 'utf-8'))
+    start_response('200 OK', make_headers(header_dict))
+    return [content]
+
 generate_search_page = generate_html_page(SEARCH_PAGE)
 generate_new_page = generate_html_page(NEW_PAGE)
 generate_edit_page = generate_html_page(EDIT_PAGE)
@@ -85,15 +292,96 @@ def handle_ajax_query(request_body):
 
      { "was-error": true, "articles": []} or
      { "was-error": false, "articles": [...]}
+
+    To get the articles a page at a time, in order, the request can also
+    give a "limit" (at most QUERY_PAGE_LIMIT), and the "continue" token from
+    the previous page:
+
+     { "query": "...", "limit": 100, "continue": "..." }
+
+    which produces JSON of the following form, where "continue" is null on
+    the last page:
+
+     { "was-error": false, "articles": [...], "continue": "..." }
+
+    See `stream_ajax_query' for what happens when "stream" is given.
     """
     query_text = request_body['query']
     try:
-        parsed_query = query.parse_query(query_text)
-        article_list = [uri for uri in db.execute_query(parsed_query)]
+        if 'limit' in request_body or 'continue' in request_body:
+            limit = min(int(request_body.get('limit') or db.SEARCH_PAGE_SIZE),
+                        QUERY_PAGE_LIMIT)
+            page = db.search_page(query_text, limit,
+                request_body.get('continue'))
+            return {'was-error': False, 'articles': page.urls,
+                    'continue': page.token}
+
+        article_list = [uri for uri in db.search(query_text)]
         return {'was-error': False, 'articles': article_list}
-    except SyntaxError:
+    except (SyntaxError, TypeError, ValueError):
         return {'was-error': True, 'articles': []}
 
+def stream_ajax_query(environ, start_response, request_body):
+    """
+    Handles an /ajax/query request of the following form:
+
+     { "query": "...", "stream": true, "limit": 100 }
+
+    The articles are sent back in order as newline-delimited JSON, a batch
+    at a time. The URLs are read from the database in batches too (see
+    `db.iter_search'), and every server mode sends each line as soon as
+    it's made, so only a batch or so of the results is held at once and the
+    client can start showing them straight away. Each line is of the form:
+
+     { "was-error": false, "articles": [...] }
+
+    with at most "limit" articles. If the query is malformed, the only line
+    is { "was-error": true, "articles": [] }.
+    """
+    try:
+        limit = min(int(request_body.get('limit') or db.SEARCH_PAGE_SIZE),
+                    QUERY_PAGE_LIMIT)
+        if limit < 1:
+            raise ValueError('Invalid page size: {}'.format(limit))
+
+        urls = db.iter_search(request_body['query'])
+    except (SyntaxError, TypeError, ValueError):
+        header_dict, body = encode_response(environ,
+            {'Content-Type': 'application/x-ndjson'},
+            bytes(json.dumps({'was-error': True, 'articles': []}) + '\n',
+                  'utf-8'))
+        start_response('200 OK', make_headers(header_dict))
+        return [body]
+
+    def generate_lines():
+        while True:
+            batch = list(itertools.islice(urls, limit))
+            if not batch:
+                return
+            yield bytes(json.dumps({'was-error': False, 'articles': batch}) +
+                        '\n', 'utf-8')
+
+    # The length isn't known ahead of time, so the response ends when the
+    # connection is closed, and compressed responses are flushed after each
+    # line so that the client doesn't have to wait for the rest
+    header_dict = {'Content-Type': 'application/x-ndjson',
+                   'Vary': 'Accept-Encoding'}
+    coding = choose_encoding(environ)
+    if coding is None:
+        start_response('200 OK', make_headers(header_dict))
+        return generate_lines()
+
+    def compress_lines():
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED,
+            dict(CONTENT_CODINGS)[coding])
+        for line in generate_lines():
+            yield compressor.compress(line) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    header_dict['Content-Encoding'] = coding
+    start_response('200 OK', make_headers(header_dict))
+    return compress_lines()
+
 def handle_ajax_get_article(request_body):
     """
     The /ajax/get-article request takes in JSON of the following form:
@@ -104,21 +392,26 @@ def handle_ajax_get_article(request_body):
 
      {"was-error": true} or
      {"was-error": false, "raw-content": "...", "html-content": "...",
-          "tags": [...]}
+          "backlinks": [...], "missing-links": [...], "tags": [...]}
 
     Note that the "html-content" field is in fact HTML, and the links
     and backlinks are pre-processed by the server. Thus, the result
     can be easily inserted into a <div>, while "raw-content" is not
-    processed and is intended to be used for editing.
+    processed and is intended to be used for editing. The "missing-links"
+    are the links to URLs which have no article.
     """
     article_uri = request_body['uri']
 
     try:
         article = db.get_article(article_uri)
+        missing_links = db.get_dangling_links([article.url]).get(
+            article.url, set())
         return {
             'raw-content': article.content,
-            'html-content': FORMAT_TO_HTML(article.content, article.backlinks),
+            'html-content': RENDER_CACHE.render(article.url, article.content,
+                article.backlinks, article.spans),
             'backlinks': list(article.backlinks),
+            'missing-links': list(missing_links),
             'tags': list(article.tags)}
     except KeyError:
         return {'was-error': True}
@@ -136,11 +429,9 @@ def handle_ajax_submit_new(request_body):
     article_uri = request_body['uri']
     article_content = request_body['content']
     article_tags = set(request_body['tags'])
-    article_links = utils.get_links(article_content)
 
     try:
-        db.create_article(article_uri, article_content,
-                article_links, article_tags)
+        db.create_article(article_uri, article_content, None, article_tags)
         return {'was-error': False}
     except IOError:
         return {'was-error': True}
@@ -159,11 +450,10 @@ def handle_ajax_submit_edit(request_body):
     article_uri = request_body['uri']
     article_content = request_body['content']
     article_tags = set(request_body['tags'])
-    article_links = utils.get_links(article_content)
 
     try:
-        db.update_article(article_uri, article_content,
-                article_links, article_tags)
+        # The links are only extracted again if the content has changed
+        db.update_article(article_uri, article_content, None, article_tags)
         return {'was-error': False}
     except IOError:
         return {'was-error': True}
@@ -182,6 +472,7 @@ def handle_ajax_submit_delete(request_body):
     article_uri = request_body['uri']
     try:
         db.delete_article(article_uri)
+        RENDER_CACHE.discard(utils.normalize_url(article_uri))
         return {'was-error': False}
     except IOError:
         return {'was-error': True}
@@ -193,6 +484,62 @@ AJAX_HANDLERS = {
     'submit-edit': handle_ajax_submit_edit,
     'submit-delete': handle_ajax_submit_delete,
 }
+def read_request_body(environ):
+    """
+    Reads the JSON sent along with a request, or None if there isn't any.
+    """
+    content_length = int(environ.get('CONTENT_LENGTH') or 0)
+    if content_length == 0:
+        return None
+
+    utf8_input = str(environ['wsgi.input'].read(content_length), 'utf-8')
+    return json.loads(utf8_input)
+
+def handle_ajax_get_article_request(environ, start_response):
+    """
+    Handles /ajax/get-article, which (unlike the other AJAX requests) can
+    also be sent as a GET, with the URI given as /ajax/get-article?uri=...,
+    so that the browser can cache it.
+
+    The response has an ETag and Last-Modified for the article's version,
+    and a request for a version the client already has is answered with a
+    304, without reading the article or running the formatter.
+    """
+    if environ['REQUEST_METHOD'] == 'GET':
+        query_args = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+        request_body = {'uri': query_args.get('uri', [''])[0]}
+    else:
+        request_body = read_request_body(environ)
+
+    # The client has to check back every time, since other articles can
+    # change this one's backlinks at any time
+    validators = {'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    result = None
+    if request_body is not None:
+        try:
+            version = db.get_article_version(request_body['uri'])
+        except KeyError:
+            version = None
+
+        if version is not None:
+            etag = make_article_etag(version)
+            validators['ETag'] = etag
+            if version.modified is not None:
+                validators['Last-Modified'] = email.utils.formatdate(
+                    version.modified, usegmt=True)
+
+            if is_not_modified(environ, etag, version.modified):
+                start_response('304 NOT MODIFIED', make_headers(validators))
+                return []
+
+        result = handle_ajax_get_article(request_body)
+
+    header_dict, json_response = encode_response(environ,
+        dict(validators, **{'Content-Type': 'application/json'}),
+        bytes(json.dumps(result), 'utf-8'))
+    start_response('200 OK', make_headers(header_dict))
+    return [json_response]
+
 def handle_ajax_request(environ, start_response):
     """
     Handles requests sent by the web browser.
@@ -201,26 +548,25 @@ def handle_ajax_request(environ, start_response):
     """
     path_parts = environ['PATH_INFO'].split('/')
     ajax_request = path_parts[2]
+    if ajax_request == 'get-article':
+        return handle_ajax_get_article_request(environ, start_response)
 
     # All requests must provide some form of input - if there isn't any, then
-    content_length = int(environ.get('CONTENT_LENGTH', 0))
-    if content_length == 0:
+    request_body = read_request_body(environ)
+    if (ajax_request == 'query' and isinstance(request_body, dict) and
+            request_body.get('stream')):
+        return stream_ajax_query(environ, start_response, request_body)
+
+    if request_body is None:
         result = None
     else:
-        utf8_input = str(environ['wsgi.input'].read(content_length), 'utf-8')
-        request_body = json.loads(utf8_input)
-
         responder = AJAX_HANDLERS.get(ajax_request, lambda request_body: None)
         result = responder(request_body)
 
-    json_response = bytes(json.dumps(result), 'utf-8')
-
-    start_response('200 OK',
-            make_headers({
-                'Content-Length': len(json_response),
-                'Content-Type': 'application/json'
-            }))
-
+    header_dict, json_response = encode_response(environ,
+        {'Content-Type': 'application/json'},
+        bytes(json.dumps(result), 'utf-8'))
+    start_response('200 OK', make_headers(header_dict))
     return [json_response]
 
 def application(environ, start_response):
@@ -233,9 +579,13 @@ def application(environ, start_response):
     # |- /new
     # |- /edit/{urlencoded-title}
     # |- /view/{urlencoded-title}
+    # |- /raw/{title} {the plain text of an article}
+    # |- /stats {the hit rates of the caches}
     # \- /ajax
-    #  |- /ajax/query {does searches based upon a query}
-    #  |- /ajax/get-article {gets all the information about an article}
+    #  |- /ajax/query {does searches based upon a query, all at once, a
+    #  |                page at a time, or streamed}
+    #  |- /ajax/get-article {gets all the information about an article,
+    #  |                    by POST or by GET with ?uri=...}
     #  |- /ajax/submit-new {submits a new article}
     #  |- /ajax/submit-edit {submits a new version of an article}
     #  \- /ajax/submit-delete {deletes an existing article}
@@ -248,6 +598,10 @@ def application(environ, start_response):
         return generate_edit_page(environ, start_response)
     elif environ['PATH_INFO'].startswith('/view'):
         return generate_view_page(environ, start_response)
+    elif environ['PATH_INFO'].startswith('/raw/'):
+        return generate_raw_article(environ, start_response)
+    elif environ['PATH_INFO'] == '/stats':
+        return generate_cache_stats(environ, start_response)
     elif environ['PATH_INFO'].startswith('/ajax'):
         return handle_ajax_request(environ, start_response)
     else:
@@ -260,14 +614,30 @@ def main():
     # Load the relevant options from the configuration file, and do some
     # validation of the configuration file as well
     config_opts = config.load_config({'web': 
-        {'port': '8080', 'formatter': 'none'}})
+        {'port': '8080', 'formatter': 'none', 'link_graph': 'yes',
+         'render_cache': '',
+         'render_cache_size': str(render_cache.RENDER_CACHE_SIZE),
+         'server': 'threaded', 'workers': str(serving.WORKERS),
+         'queue_depth': str(serving.QUEUE_DEPTH)}})
     web_opts = config_opts['web']
     try:
         port = int(web_opts['port'])
         if port > 65536 or port < 0:
             raise ValueError('Invalid port number: {}'.format(port))
 
-        global FORMAT_TO_HTML
+        render_cache_size = int(web_opts['render_cache_size'])
+
+        workers = int(web_opts['workers'])
+        queue_depth = int(web_opts['queue_depth'])
+        if workers < 1 or queue_depth < 0:
+            raise ValueError('Invalid worker count or queue depth: {}, {}'
+                .format(workers, queue_depth))
+
+        if web_opts['server'] not in serving.SERVER_MODES:
+            raise ValueError('Invalid server: {} (expected one of {})'.format(
+                web_opts['server'], ', '.join(serving.SERVER_MODES)))
+
+        global FORMAT_TO_HTML, RENDER_CACHE
         formatter = web_opts['formatter']
         try:
             formatter_module = importlib.import_module(
@@ -280,6 +650,15 @@ def main():
         print(str(ex))
         return
 
-    db.load_database(config_opts['myweb']['db'])
-    http = simple_server.make_server('', port, application)
+    RENDER_CACHE = render_cache.RenderCache(FORMAT_TO_HTML, formatter,
+        render_cache_size, web_opts['render_cache'] or None)
+
+    db.load_database(config_opts['myweb']['db'],
+        config.storage_profile(config_opts),
+        config_opts['myweb']['codec'])
+    if web_opts['link_graph'] == 'yes':
+        db.load_link_graph()
+
+    http = serving.make_server(web_opts['server'], '', port, application,
+        workers, queue_depth)
     http.serve_forever()
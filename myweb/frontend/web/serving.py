@@ -0,0 +1,359 @@
+"""
+The HTTP servers which can run the web interface.
+
+wsgiref's own server handles one request at a time, so one slow request
+(formatting a large article, or waiting on a write) holds up every other
+client. The other servers here hand requests to a pool of worker threads,
+which is safe since the database layer gives each thread its own connection
+for reading and takes turns for writing.
+
+Each server has the same interface as wsgiref's: `server_address',
+`serve_forever', `shutdown' and `server_close'.
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import socket
+import sys
+import threading
+import traceback
+import urllib.parse
+from wsgiref import simple_server
+
+# The kinds of server which `make_server' can make
+SERVER_MODES = ('simple', 'threaded', 'asyncio')
+
+# How many requests are handled at once, and how many more can wait for a
+# worker before new requests are turned away
+WORKERS = 8
+QUEUE_DEPTH = 32
+
+# The most headers that the asyncio server reads from a request
+MAX_HEADERS = 100
+
+# How long (in seconds) the asyncio server waits for a client to make room for
+# more of a response before giving up on it
+SEND_TIMEOUT = 30
+
+# What a client is told when every worker is busy and the queue is full
+BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                 b'Content-Type: text/plain\r\n'
+                 b'Content-Length: 5\r\n'
+                 b'Retry-After: 1\r\n'
+                 b'Connection: close\r\n\r\n'
+                 b'Busy\n')
+
+# What a client is told when the application fails
+ERROR_RESPONSE = (b'HTTP/1.1 500 Internal Server Error\r\n'
+                  b'Content-Type: text/plain\r\n'
+                  b'Content-Length: 6\r\n'
+                  b'Connection: close\r\n\r\n'
+                  b'Error\n')
+
+class ThreadedWSGIServer(simple_server.WSGIServer):
+    """
+    wsgiref's server, but with each request handled by a pool of worker
+    threads. When all the workers are busy and `queue_depth' requests are
+    already waiting, new requests get a 503 rather than waiting.
+    """
+    def __init__(self, server_address, handler_class, workers=WORKERS,
+            queue_depth=QUEUE_DEPTH):
+        super().__init__(server_address, handler_class)
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    def process_request(self, request, client_address):
+        """
+        Passes a request on to a worker, or turns it away if there are
+        already too many waiting.
+        """
+        if not self.slots.acquire(blocking=False):
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+
+        self.executor.submit(self.process_request_in_worker, request,
+            client_address)
+
+    def process_request_in_worker(self, request, client_address):
+        """
+        Handles a request on a worker thread.
+        """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+class AsyncioWSGIServer:
+    """
+    A server which accepts connections and reads requests on an asyncio
+    event loop, and runs the application on a pool of worker threads.
+
+    Clients which are slow to send their requests only take up the event
+    loop's time while they're sending, rather than a whole thread. As with
+    wsgiref's server, each connection carries one request. Requests which
+    have been read count against `queue_depth' until they're finished.
+
+    Responses are sent as the application produces them, so a streamed
+    response reaches the client a piece at a time rather than all at once
+    when it's finished.
+    """
+    def __init__(self, server_address, app, workers=WORKERS,
+            queue_depth=QUEUE_DEPTH):
+        self.app = app
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.limit = workers + queue_depth
+        self.pending = 0
+        self.running = set()
+        self.loop = None
+        self.server = None
+        self.started = threading.Event()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(128)
+        self.server_address = self.socket.getsockname()
+
+    def serve_forever(self):
+        """
+        Runs the event loop until `shutdown' is called, and then until the
+        requests that the workers are still running have been answered.
+        """
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.server = self.loop.run_until_complete(asyncio.start_server(
+                self.handle_connection, sock=self.socket))
+            self.started.set()
+            self.loop.run_until_complete(self.server.serve_forever())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # The workers send their responses through the loop, so it has to
+            # keep going until they're done
+            if self.running:
+                self.loop.run_until_complete(asyncio.gather(*self.running,
+                    return_exceptions=True))
+            self.loop.close()
+
+    def shutdown(self):
+        """
+        Stops `serve_forever', from another thread.
+        """
+        self.started.wait()
+        self.loop.call_soon_threadsafe(self.server.close)
+
+    def server_close(self):
+        self.socket.close()
+        self.executor.shutdown()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Reads a request from a connection, and writes back the response.
+        """
+        try:
+            request = await self.read_request(reader)
+            if request is None:
+                return
+
+            if self.pending >= self.limit:
+                writer.write(BUSY_RESPONSE)
+                await writer.drain()
+                return
+
+            self.pending += 1
+            task = asyncio.current_task()
+            self.running.add(task)
+            try:
+                await self.loop.run_in_executor(self.executor,
+                    self.run_application, request,
+                    writer.get_extra_info('peername'), writer)
+            finally:
+                self.pending -= 1
+                self.running.discard(task)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # The client went away, or sent something which isn't HTTP
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """
+        Reads the request line, headers and body of a request, as a tuple of
+        (method, target, version, headers, body). None is returned if the
+        client closed the connection without sending anything.
+        @raise ValueError If the request is malformed.
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+
+        method, target, version = \
+            request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+
+        headers = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) == MAX_HEADERS:
+                raise ValueError('Too many headers')
+
+            name, _, value = line.decode('latin-1').partition(':')
+            headers.append((name.strip(), value.strip()))
+
+        body = b''
+        for name, value in headers:
+            if name.lower() == 'content-length' and int(value) > 0:
+                body = await reader.readexactly(int(value))
+
+        return (method, target, version, headers, body)
+
+    def make_environ(self, request, peer):
+        """
+        Builds the WSGI environment for a request, as wsgiref's server would.
+        """
+        method, target, version, headers, body = request
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote(path, 'iso-8859-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': str(self.server_address[0]),
+            'SERVER_PORT': str(self.server_address[1]),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0] if peer else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+
+            if key in environ:
+                environ[key] += ',' + value
+            else:
+                environ[key] = value
+
+        return environ
+
+    async def send(self, writer, data):
+        """
+        Writes part of a response, waiting until the client has taken enough
+        of what was written before to make room for it.
+        """
+        writer.write(data)
+        await writer.drain()
+
+    def send_from_worker(self, writer, data):
+        """
+        Writes part of a response from a worker thread, by way of the event
+        loop.
+        @raise ConnectionError If the client went away, or stopped reading.
+        """
+        future = asyncio.run_coroutine_threadsafe(self.send(writer, data),
+            self.loop)
+        try:
+            future.result(SEND_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ConnectionError('Timed out sending to the client')
+
+    def run_application(self, request, peer, writer):
+        """
+        Runs the application on a request, on a worker thread, sending the
+        response to the client as each piece of the body is produced.
+
+        The head is held back until the first non-empty piece of the body
+        (or the end of the body), as WSGI asks, so that an application which
+        fails before then still gets a 500 sent in its place. The length of
+        the response isn't known up front, so it ends when the connection is
+        closed.
+        """
+        response = {'sent': False}
+
+        def write(data):
+            if not response['sent']:
+                lines = ['HTTP/1.1 ' + response['status']]
+                lines.extend('{}: {}'.format(name, value)
+                    for name, value in response['headers']
+                    if name.lower() != 'connection')
+                lines.append('Connection: close')
+
+                head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+                self.send_from_worker(writer, head)
+                response['sent'] = True
+
+            if data and request[0] != 'HEAD':
+                self.send_from_worker(writer, data)
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and response['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+
+            response['status'] = status
+            response['headers'] = headers
+            return write
+
+        try:
+            result = self.app(self.make_environ(request, peer), start_response)
+            try:
+                for data in result:
+                    if data:
+                        write(data)
+
+                if not response['sent']:
+                    write(b'')
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except ConnectionError:
+            # The client went away partway through - there's nobody left to
+            # tell about it
+            pass
+        except Exception:
+            traceback.print_exc()
+            if not response['sent']:
+                try:
+                    self.send_from_worker(writer, ERROR_RESPONSE)
+                except ConnectionError:
+                    pass
+
+def make_server(mode, host, port, app, workers=WORKERS,
+        queue_depth=QUEUE_DEPTH):
+    """
+    Makes a server of one of the `SERVER_MODES', listening on the given host
+    and port.
+    @raise ValueError If the mode is unknown.
+    """
+    if mode == 'simple':
+        return simple_server.make_server(host, port, app)
+    elif mode == 'threaded':
+        server = ThreadedWSGIServer((host, port),
+            simple_server.WSGIRequestHandler, workers, queue_depth)
+        server.set_app(app)
+        return server
+    elif mode == 'asyncio':
+        return AsyncioWSGIServer((host, port), app, workers, queue_depth)
+    else:
+        raise ValueError('Unknown server mode: {} (expected one of {})'.format(
+            mode, ', '.join(SERVER_MODES)))
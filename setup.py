@@ -2,6 +2,10 @@ from setuptools import setup
 
 setup(name='myweb',
     packages = ['myweb', 'myweb.frontend', 'myweb.backend', 'myweb.frontend.web', 'myweb.frontend.web.formatters'],
+    extras_require = {
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+    },
     entry_points = {
         'console_scripts':
             ['myweb-tk = myweb.frontend.tk:main',
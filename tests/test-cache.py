@@ -0,0 +1,45 @@
+"""
+Tests the eviction and bookkeeping of the LRU cache.
+"""
+
+from myweb.backend.cache import LRUCache
+
+CACHE = LRUCache(2)
+CACHE.put('a', 1)
+CACHE.put('b', 2)
+
+# Using 'a' makes 'b' the least recently used, so it is evicted first
+assert CACHE.get('a') == 1
+CACHE.put('c', 3)
+assert 'b' not in CACHE
+assert CACHE.get('b') is None
+assert CACHE.get('c') == 3
+assert len(CACHE) == 2
+
+assert CACHE.hits == 2
+assert CACHE.misses == 1
+assert CACHE.hit_rate() == 2 / 3
+
+CACHE.clear()
+assert len(CACHE) == 0
+assert CACHE.get('a', 'missing') == 'missing'
+
+# A sized cache evicts by the total size of its values, and drops values that
+# are bigger than the whole cache
+SIZED = LRUCache(10, size_of=len)
+SIZED.put('a', 'xxxx')
+SIZED.put('b', 'xxxx')
+SIZED.put('c', 'xxxx')
+assert 'a' not in SIZED and 'b' in SIZED and 'c' in SIZED
+assert SIZED.size == 8
+
+SIZED.put('b', 'x')
+assert SIZED.size == 5
+
+SIZED.put('d', 'x' * 11)
+assert len(SIZED) == 0 and SIZED.size == 0
+
+SIZED.put('e', 'xxx')
+SIZED.discard('e')
+SIZED.discard('e')
+assert 'e' not in SIZED and SIZED.size == 0
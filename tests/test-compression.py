@@ -0,0 +1,55 @@
+"""
+Tests that every codec gives back what it was given.
+"""
+
+from myweb.backend import compression
+
+SAMPLES = [
+    b'',
+    b'a short article',
+    b'a longer article, which links to http://example.com/ ' * 50,
+    bytes('non-ASCII text é中', 'utf-8'),
+]
+
+for codec in compression.CODECS.values():
+    if not codec.is_available():
+        continue
+
+    dictionaries = [None]
+    if codec.uses_dictionary:
+        dictionaries.append(codec.train(SAMPLES * 20))
+
+    for dictionary in dictionaries:
+        for sample in SAMPLES:
+            compressed = codec.compress(sample, dictionary)
+            assert codec.decompress(compressed, dictionary) == sample, \
+                (codec.name, sample)
+
+# The dictionary should help with text that is common across articles
+codec = compression.get_codec('zlib-dict')
+dictionary = codec.train(SAMPLES * 10)
+assert 0 < len(dictionary) <= compression.DICTIONARY_SIZE
+assert (len(codec.compress(SAMPLES[2][:200], dictionary)) <
+        len(codec.compress(SAMPLES[2][:200], None)))
+
+# zstd can't train on only a handful of short articles, and goes without a
+# dictionary rather than failing
+codec = compression.CODECS_BY_NAME['zstd']
+if codec.is_available():
+    assert codec.train(SAMPLES) is None
+    assert codec.train(SAMPLES * 20) is not None
+
+# Codecs without a dictionary can't be trained
+try:
+    compression.get_codec('zlib').train(SAMPLES * 20)
+except ValueError:
+    pass
+else:
+    assert False
+
+try:
+    compression.get_codec('no-such-codec')
+except KeyError:
+    pass
+else:
+    assert False
@@ -2,8 +2,11 @@
 Tests used to make sure that the database layer works as it should.
 """
 
+import itertools
+
 import myweb.backend.db as db
 import myweb.backend.query as query
+import myweb.backend.utils as utils
 
 # The ARTICLES to create initially
 ARTICLES = [
@@ -35,7 +38,19 @@ QUERIES = [
     ('tag-1 OR tag-3', {'http://1.com/a', 'http://1.com/b'}),
     ('tag-1 AND tag-3', set()),
     ('NOT tag-1', {'http://1.com/b'}),
-    ('url:http://1.com/b', {'http://1.com/b'})
+    ('NOT (tag-1 OR tag-3)', set()),
+    ('tag-1 AND NOT tag-1', set()),
+    ('tag-1 OR NOT tag-1', {'http://1.com/a', 'http://1.com/b'}),
+    ('tag-2 AND NOT (tag-1 AND links:http://1.com/b)', {'http://1.com/b'}),
+    ('url:http://1.com/b', {'http://1.com/b'}),
+    ('text:1', {'http://1.com/a'}),
+    ('text:1 OR text:2', {'http://1.com/a', 'http://1.com/b'}),
+    ('tag-2 AND NOT text:2', {'http://1.com/a'}),
+    ('text:"', set()),
+    ('reach:http://1.com/a depth:1', {'http://1.com/b'}),
+    ('reach:http://1.com/a depth:5', {'http://1.com/a', 'http://1.com/b'}),
+    ('reach:http://1.com/a AND NOT url:http://1.com/a', {'http://1.com/b'}),
+    ('reach:http://1.com/missing', set()),
 ]
 
 db.load_database(':memory:')
@@ -44,15 +59,17 @@ db.load_database(':memory:')
 for article in ARTICLES:
     db.create_article(article.url, article.content, article.links, article.tags)
 
-# Then, go ahead and execute all the QUERIES and test their results
-for the_query, answer in QUERIES:
+# Then, go ahead and execute all the QUERIES and test their results, under
+# each of the query compilers
+for (the_query, answer), compiler in itertools.product(QUERIES, db.COMPILERS):
     parsed_query = query.parse_query(the_query)
-    result = db.execute_query(parsed_query)
+    result = db.execute_query(parsed_query, compiler)
     if result != answer:
         print('=== Query matching failed ===')
         print('Query:', the_query)
+        print('Compiler:', compiler)
         print('Parsed Query:', query.node_to_string(parsed_query))
-        sql, variables = db.sql_from_query(parsed_query)
+        sql, variables = db.compile_query(parsed_query, compiler)
         print('SQL:', sql)
         print('Variables:', variables)
         print('*' * 5)
@@ -60,6 +77,122 @@ for the_query, answer in QUERIES:
         print('Actual Answer:', result)
         assert False
 
+# Running a query tree again doesn't optimize it again, so the sizes of its
+# terms aren't estimated again
+estimates = []
+estimate_query_size = db.estimate_query_size
+db.estimate_query_size = (lambda node:
+    estimates.append(node) or estimate_query_size(node))
+db.execute_query(query.parse_query('tag-1 AND tag-2'))
+estimated = len(estimates)
+assert estimated > 0
+assert db.execute_query(query.parse_query('tag-1 AND tag-2')) == \
+    {'http://1.com/a'}
+assert len(estimates) == estimated
+db.estimate_query_size = estimate_query_size
+
+# Searching by query string should give the same results, and should only
+# compile each query once no matter how it is spaced
+for the_query, answer in QUERIES:
+    assert db.search(the_query) == answer
+
+hits = db.QUERY_CACHE.hits
+for the_query, answer in QUERIES:
+    assert db.search('  ' + the_query.replace(' ', '   ') + ' ') == answer
+assert db.QUERY_CACHE.hits == hits + len(QUERIES)
+
+# Results are cached, but writes have to invalidate them
+assert db.search('tag-2') == {'http://1.com/a', 'http://1.com/b'}
+hits = db.RESULT_CACHE.hits
+assert db.search('tag-2') == {'http://1.com/a', 'http://1.com/b'}
+assert db.RESULT_CACHE.hits == hits + 1
+
+# Results are sized by their URLs as text, including URLs which look like
+# numbers
+db.create_article('2024', '', set(), {'year'})
+assert db.search('year') == {'2024'}
+hits = db.RESULT_CACHE.hits
+assert db.search('year') == {'2024'}
+assert db.RESULT_CACHE.hits == hits + 1
+assert db.search_page('year', 1) == (['2024'], None)
+db.delete_article('2024')
+
+# Paging through the results, under either compiler, gives the same URLs in
+# order
+for compiler in db.COMPILERS:
+    for the_query, answer in QUERIES:
+        urls = []
+        page = db.search_page(the_query, 1, compiler=compiler)
+        urls.extend(page.urls)
+        while page.token is not None:
+            page = db.search_page(the_query, 1, page.token, compiler)
+            urls.extend(page.urls)
+        assert urls == sorted(answer), (the_query, compiler)
+
+        assert list(db.iter_search(the_query, compiler)) == sorted(answer)
+
+# Long results are streamed a batch at a time
+batch_size = db.SEARCH_BATCH_SIZE
+db.SEARCH_BATCH_SIZE = 1
+assert list(db.iter_search('tag-2')) == ['http://1.com/a', 'http://1.com/b']
+db.SEARCH_BATCH_SIZE = batch_size
+
+assert db.search_page('tag-2', 2) == (['http://1.com/a', 'http://1.com/b'],
+                                      None)
+
+# Each page is read by a query of its own, which only reads that page
+# (while SQLite does the sorting) and is cached until the articles change
+page = db.search_page('tag-2', 1)
+assert db.search_page('tag-2', 1, page.token).urls == ['http://1.com/b']
+hits = db.RESULT_CACHE.hits
+assert db.search_page('tag-2', 1, page.token).urls == ['http://1.com/b']
+assert db.RESULT_CACHE.hits == hits + 1
+
+sql, variables = db.prepare_search('tag-2', 'exists')
+plan = ' '.join(row[3] for row in db.DB.execute('EXPLAIN QUERY PLAN ' +
+    db.Queries.next_page.format(query=sql), variables + ('', 1)))
+assert 'Url>?' in plan and 'ORDER BY' not in plan, plan
+
+db.create_article('http://1.com/c', '', set(), {'tag-2'})
+page = db.search_page('tag-2', 1, page.token)
+assert page.urls == ['http://1.com/b']
+assert db.search_page('tag-2', 1, page.token) == (['http://1.com/c'], None)
+db.delete_article('http://1.com/c')
+for bad_token in ('!!', '_w'):
+    try:
+        db.search_page('tag-2', 1, bad_token)
+        assert False, 'Malformed tokens should be rejected'
+    except ValueError:
+        pass
+
+try:
+    db.iter_search('(tag-2')
+    assert False, 'Malformed queries should be rejected straight away'
+except SyntaxError:
+    pass
+
+# Leaves of different types, but with the same value, are different terms -
+# a tag named after a domain isn't the domain, and linking to a URL isn't
+# being linked from it
+db.create_article('http://mix.com/p', '', {'http://mix.com/q'}, {'x'})
+db.create_article('http://mix.com/q', '', set(), {'mix.com'})
+db.create_article('http://2.com/r', '', set(), {'mix.com'})
+MIXED_QUERIES = [
+    ('mix.com OR domain:mix.com',
+        {'http://mix.com/p', 'http://mix.com/q', 'http://2.com/r'}),
+    ('mix.com AND NOT domain:mix.com', {'http://2.com/r'}),
+    ('domain:mix.com AND NOT mix.com', {'http://mix.com/p'}),
+    ('links:http://mix.com/p OR linked:http://mix.com/p', {'http://mix.com/q'}),
+    ('linked:http://mix.com/p AND NOT links:http://mix.com/p',
+        {'http://mix.com/q'}),
+]
+for (the_query, answer), compiler in itertools.product(MIXED_QUERIES,
+        db.COMPILERS):
+    assert db.search(the_query, compiler) == answer, (the_query, compiler)
+
+for url in ('http://mix.com/p', 'http://mix.com/q', 'http://2.com/r'):
+    db.delete_article(url)
+
 # Update some ARTICLES
 for article in NEW_ARTICLES:
     db.update_article(article.url, article.content, article.links, article.tags)
@@ -72,6 +205,56 @@ for article in NEW_ARTICLES:
         print('Actual:', new_article)
         assert False
 
+assert db.search('tag-2') == {'http://1.com/b'}
+assert db.search('text:3') == {'http://1.com/a'}
+assert db.search('text:1') == set()
+
+# Saving the same content again should only touch the tags, while new content
+# has its links extracted when none are given
+article = NEW_ARTICLES[0]
+generation = db.GENERATION
+db.update_article(article.url, article.content, None, article.tags)
+assert db.GENERATION == generation
+assert db.get_article(article.url) == article
+
+db.update_article(article.url, article.content, None, {'tag-1'})
+assert db.GENERATION == generation + 1
+assert db.get_article(article.url) == article._replace(tags={'tag-1'})
+
+# Links which are given are applied even when the content is the same
+db.update_article(article.url, article.content, {'http://1.com/z'},
+    article.tags)
+assert db.get_article(article.url).links == {'http://1.com/z'}
+db.update_article(article.url, article.content, article.links, article.tags)
+assert db.get_article(article.url) == article
+
+db.update_article(article.url, 'see [[http://1.com/c]] and [[http://1.com/b]]',
+    None, article.tags)
+assert db.get_article(article.url).links == {'http://1.com/b', 'http://1.com/c'}
+
+# The spans of the links are stored with the content, and give the same
+# chunks as searching the content would
+linked_article = db.get_article(article.url)
+assert linked_article.spans == [(4, 22), (27, 45)]
+assert list(linked_article.chunks()) == utils.get_link_chunks(
+    linked_article.content)
+
+db.update_article(article.url, article.content, article.links, article.tags)
+assert db.get_article(article.url) == article
+
+# Tags can be changed without touching the content, whose hash is stored
+db.update_tags(article.url, {'tag-9'})
+assert db.get_article(article.url) == article._replace(tags={'tag-9'})
+assert db.get_content_hash(article.url) == db.hash_content(article.content)
+db.update_tags(article.url, article.tags)
+
+try:
+    db.update_tags('http://1.com/missing', {'tag-1'})
+except KeyError:
+    pass
+else:
+    assert False
+
 # Delete an article
 for article in DELETE_ARTICLES:
     db.delete_article(article)
@@ -83,3 +266,283 @@ for article in DELETE_ARTICLES:
         print('=== DB Failed To Delete Article ===')
         print('URL:', article)
         assert False
+
+assert db.search('tag-1') == set()
+assert db.search('text:3') == set()
+
+# Full-text matches can be ranked, with the articles that mention the words
+# most often first
+db.create_article('http://rank.com/1', 'apple banana', set(), set())
+db.create_article('http://rank.com/2', 'apple apple apple banana', set(), set())
+db.create_article('http://rank.com/3', 'cherry', set(), set())
+assert db.rank_text_matches(['apple']) == [
+    'http://rank.com/2', 'http://rank.com/1']
+assert db.rank_text_matches(['ban*', 'apple']) == [
+    'http://rank.com/2', 'http://rank.com/1']
+assert db.rank_text_matches([]) == []
+
+# The full-text index doesn't keep its own copy of each article, and so
+# editing and deleting have to take out exactly the words that were indexed
+assert db.DB.execute('SELECT Content FROM ARTICLES_TEXT').fetchall() == \
+    [(None,)] * db.DB.execute('SELECT COUNT(*) FROM ARTICLES').fetchone()[0]
+db.update_article('http://rank.com/1', 'damson', set(), set())
+assert db.search('text:apple') == {'http://rank.com/2'}
+assert db.search('text:damson') == {'http://rank.com/1'}
+db.delete_article('http://rank.com/2')
+assert db.search('text:apple') == set()
+assert db.search('text:banana') == set()
+
+# Make sure that the schema is current, and that an unversioned database is
+# upgraded in place when it is loaded
+assert db.DB.execute('PRAGMA user_version').fetchone()[0] == db.SCHEMA_VERSION
+
+import os
+import sqlite3
+import tempfile
+import zlib
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    legacy_path = os.path.join(temp_dir, 'legacy.sqlite')
+    legacy_db = sqlite3.connect(legacy_path)
+    legacy_db.execute(db.Queries.create_article_table)
+    legacy_db.execute(db.Queries.create_links_table)
+    legacy_db.execute(db.Queries.create_tags_table)
+    legacy_db.execute('INSERT INTO TAGS VALUES (?, ?)', ('http://2.com', 'x'))
+    legacy_db.execute('INSERT INTO LINKS VALUES (?, ?)',
+        ('http://2.com', 'http://3.com'))
+    legacy_db.execute('INSERT INTO ARTICLES VALUES (?, ?, ?)',
+        ('http://2.com', zlib.compress(b'hello world'), '2.com'))
+    legacy_db.execute('INSERT INTO ARTICLES VALUES (?, ?, ?)',
+        ('2024', zlib.compress(b'a year'), ''))
+    legacy_db.commit()
+    legacy_db.close()
+
+    db.load_database(legacy_path)
+    version = db.DB.execute('PRAGMA user_version').fetchone()[0]
+    indexes = set(row[0] for row in
+        db.DB.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+    tagged = db.search('x')
+    linking = db.search('links:http://3.com')
+    text_matches = db.search('text:world')
+    db.create_article('http://3.com', 'linked', set(), set())
+    backlinks = db.get_article('http://3.com').backlinks
+    legacy_article = db.get_article('http://2.com')
+    numeric_article = db.get_article('2024')
+    db.update_article('http://2.com', 'goodbye', set(), set())
+    edited_matches = db.search('text:world OR text:goodbye')
+    db.DB.close()
+
+    assert version == db.SCHEMA_VERSION
+    assert {'LINKS_LINKED', 'TAGS_TAG', 'ARTICLES_DOMAIN'} <= indexes
+    assert tagged == {'http://2.com'}
+    assert linking == {'http://2.com'}
+    assert backlinks == {'http://2.com'}
+    assert text_matches == {'http://2.com'}
+    assert edited_matches == {'http://2.com'}
+    assert legacy_article.spans is None
+    assert (numeric_article.url, numeric_article.content) == ('2024', 'a year')
+    assert list(legacy_article.chunks()) == [utils.Text('hello world')]
+
+# Readers on other threads should be able to work while articles are written,
+# and should see everything that was committed before they looked
+import threading
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    db.load_database(os.path.join(temp_dir, 'threads.sqlite'))
+    errors = []
+
+    def reader():
+        try:
+            for i in range(50):
+                db.search('tag-threaded')
+                try:
+                    db.get_article('http://threads.com/0')
+                except KeyError:
+                    pass
+        except Exception as ex:
+            errors.append(ex)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+
+    for i in range(50):
+        db.create_article('http://threads.com/{}'.format(i), str(i), set(),
+            {'tag-threaded'})
+
+    for thread in readers:
+        thread.join()
+
+    assert not errors, errors
+    assert len(db.search('tag-threaded')) == 50
+    db.POOL.close()
+
+# The storage profile should be applied to every connection, and nothing that
+# isn't a plain name or number should make it into a PRAGMA
+from myweb.backend import config
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    db.load_database(os.path.join(temp_dir, 'profile.sqlite'),
+        config.STORAGE_DEFAULTS)
+    with db.POOL.read() as connection:
+        assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert connection.execute('PRAGMA cache_size').fetchone()[0] == -16000
+    db.POOL.close()
+
+    try:
+        db.load_database(os.path.join(temp_dir, 'profile.sqlite'),
+            {'cache_size': '1; DROP TABLE ARTICLES'})
+    except ValueError:
+        pass
+    else:
+        assert False
+
+# Bulk imports should insert everything in one go, or nothing at all
+db.load_database(':memory:')
+progress = []
+count = db.bulk_create_articles(
+    ((article.url, article.content, article.links, article.tags)
+        for article in ARTICLES),
+    defer_indexes=True, progress=progress.append)
+assert count == len(ARTICLES) and progress == [len(ARTICLES)]
+for article in ARTICLES:
+    assert db.get_article(article.url).tags == article.tags
+
+indexes = set(row[0] for row in
+    db.DB.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+assert set(db.DEFERRABLE_INDEXES) <= indexes
+
+try:
+    db.bulk_create_articles([('http://1.com/new', 'x', set(), {'tag-1'}),
+        (ARTICLES[0].url, 'x', set(), set())])
+except KeyError:
+    pass
+else:
+    assert False
+
+assert db.search('tag-1') == {ARTICLES[0].url}
+
+# Articles which come without links have them found in their content, in the
+# same search that finds their spans
+db.bulk_create_articles([('http://1.com/found', 'to [[http://1.com/a/]]',
+    None, set())])
+db.create_article('http://1.com/found-too', '[[http://1.com/b]]', None, set())
+assert db.get_article('http://1.com/found').links == {'http://1.com/a'}
+assert db.get_article('http://1.com/found-too').links == {'http://1.com/b'}
+db.delete_article('http://1.com/found')
+db.delete_article('http://1.com/found-too')
+
+# Walking through every article should give back each article in the order
+# they were created, with tags and links matched up to the right article
+db.create_article('http://0.com', 'last', set(), set())
+exported = list(db.iter_articles())
+expected = ([article._replace(backlinks=None) for article in ARTICLES] +
+    [db.Article('http://0.com', 'last', set(), None, set())])
+assert exported == expected, exported
+assert exported[-1].modified == db.get_article_version('http://0.com').modified
+
+# Fetching many articles at once should give the same thing as fetching them
+# one at a time, and should leave out URLs without articles
+urls = [article.url for article in ARTICLES] + ['http://1.com/missing/']
+batch = db.get_articles(urls)
+assert set(batch) == set(article.url for article in ARTICLES)
+for article in ARTICLES:
+    assert batch[article.url] == db.get_article(article.url)
+    assert batch[article.url].backlinks == {
+        other.url for other in ARTICLES if article.url in other.links}
+
+# A URL which looks like a number is still stored, and given back, as text
+db.create_article('2024', 'a year', set(), set())
+assert db.DB.execute(
+    "SELECT typeof(Url) FROM ARTICLES WHERE Url = '2024'").fetchone() == \
+    ('text',)
+assert db.get_article('2024').content == 'a year'
+assert set(db.get_articles(['2024'])) == {'2024'}
+db.delete_article('2024')
+
+# Articles compressed by different codecs should all read back the same, and
+# recompressing should only rewrite the articles which need it
+db.set_codec('none')
+db.create_article('http://3.com', 'stored as it is', set(), {'tag-3'})
+assert db.get_article('http://3.com').content == 'stored as it is'
+codecs = dict(db.DB.execute('SELECT Url, Codec FROM ARTICLES'))
+assert codecs['http://3.com'] == 1 and codecs['http://0.com'] == 0
+
+dictionary_id = db.train_dictionary('zlib-dict')
+assert db.LATEST_DICTIONARIES[2] == dictionary_id
+assert db.recompress_articles('zlib-dict', batch_size=2) == len(codecs)
+assert db.recompress_articles('zlib-dict') == 0
+assert set(db.DB.execute('SELECT Codec, Dictionary FROM ARTICLES')) == {
+    (2, dictionary_id)}
+
+# A dictionary trained by some other process is looked up when it's needed
+db.DICTIONARIES.clear()
+assert db.get_article('http://3.com').content == 'stored as it is'
+assert {article.url: article.content
+    for article in db.iter_articles()}['http://0.com'] == 'last'
+
+try:
+    db.train_dictionary('zlib')
+except ValueError:
+    pass
+else:
+    assert False
+
+db.set_codec('zlib')
+
+# The reports should find links to missing articles, articles which nothing
+# else links to (linking to yourself doesn't count) and how many articles
+# have each tag
+db.load_database(':memory:')
+db.create_article('http://r.com/a', '', {'http://r.com/b', 'http://r.com/x'},
+    {'tag-r'})
+db.create_article('http://r.com/b', '', {'http://r.com/b'}, {'tag-r', 'tag-s'})
+db.create_article('http://r.com/c', '', {'http://r.com/y'}, set())
+assert db.get_dangling_links() == {'http://r.com/a': {'http://r.com/x'},
+                                   'http://r.com/c': {'http://r.com/y'}}
+assert db.get_dangling_links(['http://r.com/a/', 'http://r.com/b']) == {
+    'http://r.com/a': {'http://r.com/x'}}
+assert db.get_orphans() == {'http://r.com/a', 'http://r.com/c'}
+assert db.get_tag_counts() == {'tag-r': 2, 'tag-s': 1}
+
+db.create_article('http://r.com/x', '', {'http://r.com/a'}, set())
+db.update_tags('http://r.com/b', {'tag-r'})
+assert db.get_dangling_links() == {'http://r.com/c': {'http://r.com/y'}}
+assert db.get_orphans() == {'http://r.com/c'}
+assert db.get_tag_counts() == {'tag-r': 2}
+
+# An article's version should go up whenever anything shown with it changes,
+# including its backlinks and which of its links are missing
+def version_of(url):
+    return db.get_article_version(url).version
+
+db.create_article('http://v.com/a', '[[http://v.com/b]]', {'http://v.com/b'},
+    set())
+a_version = version_of('http://v.com/a')
+assert db.get_article_version('http://v.com/a').modified is not None
+
+db.create_article('http://v.com/b', '', set(), set())
+assert version_of('http://v.com/a') > a_version
+a_version, b_version = version_of('http://v.com/a'), version_of('http://v.com/b')
+
+db.update_tags('http://v.com/b', {'tag-v'})
+db.update_article('http://v.com/a', '[[http://v.com/b]]', None, set())
+assert version_of('http://v.com/a') == a_version
+assert version_of('http://v.com/b') > b_version
+b_version = version_of('http://v.com/b')
+
+db.update_article('http://v.com/a', 'no links', None, set())
+assert version_of('http://v.com/a') > a_version
+assert version_of('http://v.com/b') > b_version
+
+db.bulk_create_articles([('http://v.com/c', '', {'http://v.com/b'}, set())])
+b_version = version_of('http://v.com/b')
+db.delete_article('http://v.com/c')
+assert version_of('http://v.com/b') > b_version
+
+try:
+    db.get_article_version('http://v.com/c')
+except KeyError:
+    pass
+else:
+    assert False
@@ -0,0 +1,132 @@
+"""
+Tests that the in-memory link graph agrees with the links in the database, as
+articles are created, changed and deleted.
+"""
+
+import os
+import sqlite3
+import tempfile
+
+import myweb.backend.db as db
+from myweb.backend.graph import LinkGraph
+
+# Backlinks, reachability and the reports on a graph built by hand
+GRAPH = LinkGraph()
+GRAPH.set_article(1, 'http://a.com', [(2, 'http://b.com'), (3, 'http://c.com')])
+GRAPH.set_article(2, 'http://b.com', [(1, 'http://a.com'), (4, 'http://d.com')])
+GRAPH.set_article(5, 'http://e.com', [])
+
+assert GRAPH.links('http://a.com') == {'http://b.com', 'http://c.com'}
+assert GRAPH.backlinks('http://a.com') == {'http://b.com'}
+assert GRAPH.backlinks('http://d.com') == {'http://b.com'}
+assert GRAPH.backlinks('http://missing.com') == set()
+
+# Only articles are reachable, and the cycle back to a.com counts
+assert GRAPH.reachable('http://a.com', 1) == {'http://b.com'}
+assert GRAPH.reachable('http://a.com', 2) == {'http://a.com', 'http://b.com'}
+assert GRAPH.reachable('http://missing.com', 2) == set()
+
+assert GRAPH.dangling_links() == {
+    'http://a.com': {'http://c.com'},
+    'http://b.com': {'http://d.com'},
+}
+assert GRAPH.orphans() == {'http://e.com'}
+
+# Replacing links updates the reverse edges of both the old and new targets
+GRAPH.set_article(2, 'http://b.com', [(5, 'http://e.com')])
+assert GRAPH.backlinks('http://a.com') == set()
+assert GRAPH.backlinks('http://e.com') == {'http://b.com'}
+assert GRAPH.orphans() == {'http://a.com'}
+
+GRAPH.remove_article(1)
+assert GRAPH.backlinks('http://b.com') == set()
+assert 'http://a.com' not in GRAPH.dangling_links()
+
+def links_from_database(urls):
+    """
+    Gets the links and backlinks of some articles, without the link graph.
+    """
+    link_graph = db.GRAPH
+    db.GRAPH = None
+    try:
+        articles = db.get_articles(urls)
+    finally:
+        db.GRAPH = link_graph
+
+    return {url: (article.links, article.backlinks)
+            for url, article in articles.items()}
+
+URLS = ['http://{}.com'.format(i) for i in range(6)]
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    path = os.path.join(temp_dir, 'graph.sqlite')
+    db.load_database(path)
+    db.create_article(URLS[0], '0', {URLS[1], URLS[2]}, set())
+    db.load_link_graph()
+
+    # Every kind of write should be reflected in the graph
+    db.create_article(URLS[1], '1', {URLS[0], URLS[3]}, set())
+    db.update_article(URLS[0], '0 changed', {URLS[3]}, set())
+    db.bulk_create_articles([(URLS[2], '2', {URLS[1]}, set()),
+                             (URLS[3], '3', {URLS[0]}, set())])
+    db.delete_article(URLS[1])
+
+    # A write which is rolled back should leave the graph alone
+    try:
+        db.create_article(URLS[3], 'duplicate', {URLS[4]}, set())
+    except KeyError:
+        pass
+
+    with_graph = {url: (article.links, article.backlinks)
+        for url, article in db.get_articles(URLS).items()}
+    assert with_graph == links_from_database(URLS)
+    assert with_graph[URLS[0]] == ({URLS[3]}, {URLS[3]})
+    assert db.GRAPH.backlinks(URLS[4]) == set()
+
+    link_graph = db.GRAPH
+    db.GRAPH = None
+    from_database = (db.get_dangling_links(), db.get_orphans(),
+        db.get_dangling_links([URLS[2]]))
+    db.GRAPH = link_graph
+    assert from_database == (db.get_dangling_links(), db.get_orphans(),
+        db.get_dangling_links([URLS[2]]))
+    assert from_database[2] == {URLS[2]: {URLS[1]}}
+
+    # reach: is answered by the graph, rather than by following LINKS in SQL,
+    # under each of the compilers - and the queries compiled with the graph
+    # still work once it is gone
+    reach_query = 'reach:{} depth:3'.format(URLS[3])
+    with_graph = {compiler: db.search(reach_query, compiler)
+        for compiler in db.COMPILERS}
+    graph_prepared = {compiler: db.prepare_search(reach_query, compiler)
+        for compiler in db.COMPILERS}
+    assert not any('RECURSIVE' in sql for sql, _ in graph_prepared.values())
+
+    link_graph = db.GRAPH
+    db.GRAPH = None
+    db.invalidate_results()
+    for compiler, (sql, variables) in graph_prepared.items():
+        assert db.execute_prepared_query(sql, variables) == with_graph[compiler]
+
+    for compiler in db.COMPILERS:
+        sql, variables = db.prepare_search(reach_query, compiler)
+        assert 'RECURSIVE' in sql
+        assert db.search(reach_query, compiler) == with_graph[compiler]
+
+    db.GRAPH = link_graph
+    assert with_graph['set'] == {URLS[0], URLS[3]}
+    assert db.search_page(reach_query).urls == sorted(with_graph['set'])
+    assert with_graph['exists'] == with_graph['set']
+
+    # Another process changing the links should cause the graph to be loaded
+    # again the next time it's used
+    other = sqlite3.connect(path)
+    other.execute('''
+INSERT INTO LINKS(UrlId, LinkedId)
+SELECT Source.Id, Target.Id FROM URLS AS Source, URLS AS Target
+WHERE Source.Url = ? AND Target.Url = ?''', (URLS[2], URLS[0]))
+    other.commit()
+    other.close()
+
+    assert db.get_article(URLS[0]).backlinks == {URLS[2], URLS[3]}
+    db.POOL.close()
@@ -0,0 +1,61 @@
+"""
+Tests how the optimizer rewrites query trees.
+"""
+
+from myweb.backend.optimize import node_key, optimize
+from myweb.backend.query import *
+
+QUERIES = [
+    # Double negation, and De Morgan's laws
+    ('NOT NOT a', Tag('a')),
+    ('NOT (a AND b)', Not(And(Tag('b'), Tag('a')))),
+    ('NOT (a OR b)', Not(Or(Tag('b'), Tag('a')))),
+    ('NOT a AND NOT b', Not(Or(Tag('b'), Tag('a')))),
+    ('a OR NOT b OR NOT c', Or(Tag('a'), Not(And(Tag('c'), Tag('b'))))),
+
+    # Flattening, and removing duplicates
+    ('a AND b AND a', And(Tag('a'), Tag('b'))),
+    ('a OR (a OR (b OR a))', Or(Tag('a'), Tag('b'))),
+    ('(a AND b) OR (b AND a) OR (a AND b)', And(Tag('b'), Tag('a'))),
+    ('(a OR NOT b) AND (NOT b OR a)', Or(Tag('a'), Not(Tag('b')))),
+
+    # Leaves of different types with the same value aren't duplicates, and
+    # don't contradict each other
+    ('news OR domain:news', Or(Domain('news'), Tag('news'))),
+    ('news AND domain:news AND news', And(Tag('news'), Domain('news'))),
+    ('news AND NOT domain:news', And(Tag('news'), Not(Domain('news')))),
+    ('news OR NOT domain:news', Or(Tag('news'), Not(Domain('news')))),
+    ('links:u OR linked:u', Or(LinkedBy('u'), Links('u'))),
+    ('links:u AND NOT linked:u', And(Links('u'), Not(LinkedBy('u')))),
+
+    # Contradictions and tautologies
+    ('a AND NOT a', Nothing()),
+    ('b AND (a AND NOT a)', Nothing()),
+    ('a OR NOT a', Everything()),
+    ('b AND (a OR NOT a)', Tag('b')),
+    ('b OR (a AND NOT a)', Tag('b')),
+    ('NOT (a OR NOT a)', Nothing()),
+
+    # Negations are subtracted from the positive terms
+    ('NOT a AND b AND NOT c', And(And(Tag('b'), Not(Tag('c'))), Not(Tag('a')))),
+]
+
+for query, expected in QUERIES:
+    optimized = optimize(parse_query(query))
+    # The nodes compare equal whenever their fields do, whatever their types
+    if node_key(optimized) != node_key(expected):
+        print('***** Optimizing Query Failed *****')
+        print('Query:', query)
+        print('Optimized:', node_to_string(optimized))
+        print('Expected:', node_to_string(expected))
+        assert False
+
+# Ordering by selectivity puts the smallest sets first under AND, and the
+# largest sets first under OR
+SIZES = {Tag('a'): 100, Tag('b'): 5, Tag('c'): 50, Everything(): 1000}
+estimate = SIZES.__getitem__
+
+assert (optimize(parse_query('a AND b AND c'), estimate) ==
+    And(And(Tag('b'), Tag('c')), Tag('a')))
+assert (optimize(parse_query('a OR b OR c'), estimate) ==
+    Or(Or(Tag('a'), Tag('c')), Tag('b')))
@@ -0,0 +1,42 @@
+"""
+Tests that the connection pool gives each thread its own reading connection,
+and closes it once the thread is gone.
+"""
+
+import gc
+import os
+import tempfile
+import threading
+
+from myweb.backend.pool import ConnectionPool
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    POOL = ConnectionPool(os.path.join(temp_dir, 'pool.sqlite'))
+    with POOL.write() as cursor:
+        cursor.execute('CREATE TABLE T(X INTEGER)')
+        cursor.execute('INSERT INTO T VALUES (1)')
+
+    # The main thread keeps its connection for as long as it's running
+    with POOL.read() as connection:
+        assert connection is not POOL.writer
+        main_reader = connection
+    with POOL.read() as connection:
+        assert connection is main_reader
+
+    # Short-lived threads each get a connection, but don't leave it behind
+    def read():
+        with POOL.read() as connection:
+            assert connection is not main_reader
+            assert connection.execute('SELECT X FROM T').fetchone() == (1,)
+
+    for _ in range(50):
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+
+    gc.collect()
+    assert len(POOL.connections) == 2
+    assert set(POOL.connections) == {POOL.writer, main_reader}
+
+    POOL.close()
+    assert POOL.connections == []
@@ -13,7 +13,12 @@ QUERIES = [
     ('tag:a', Tag('a')),
     ('domain:a', Domain('a')),
     ('links:a', Links('a')),
-    ('linked:a', LinkedBy('a'))
+    ('linked:a', LinkedBy('a')),
+    ('text:a', Content('a')),
+    ('reach:a', Reach('a', REACH_DEPTH)),
+    ('reach:a depth:3', Reach('a', 3)),
+    ('reach:a depth:3 OR b', Or(Tag('b'), Reach('a', 3))),
+    ('(reach:a depth:1)', Reach('a', 1)),
 ]
 
 for query, expected in QUERIES:
@@ -24,3 +29,15 @@ for query, expected in QUERIES:
         print('Parsed:', parsed)
         print('Expected:', expected)
         assert False
+
+# A depth has to belong to a reach: term, and has to be a positive number
+for query in ['depth:3', 'a depth:3', 'reach:a depth:3 depth:4',
+              'reach:a depth:x', 'reach:a depth:0', 'reach:a depth:11']:
+    try:
+        parse_query(query)
+    except SyntaxError:
+        pass
+    else:
+        print('***** Parsing Query Should Have Failed *****')
+        print('Query:', query)
+        assert False
@@ -0,0 +1,55 @@
+"""
+Tests that rendered HTML is reused until an article or its backlinks change,
+both in memory and on disk.
+"""
+
+import os
+import tempfile
+
+from myweb.frontend.web.render_cache import RenderCache
+
+RENDERS = []
+
+def to_html(content, backlinks, spans=None):
+    RENDERS.append(content)
+    return '{} <- {}'.format(content, ' '.join(sorted(backlinks)))
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    path = os.path.join(temp_dir, 'rendered.sqlite')
+    CACHE = RenderCache(to_html, 'test', path=path)
+
+    assert CACHE.render('http://a.com', 'a', {'http://b.com'}) == \
+        'a <- http://b.com'
+    assert CACHE.render('http://a.com', 'a', {'http://b.com'}) == \
+        'a <- http://b.com'
+    assert RENDERS == ['a']
+
+    # Changing either the content or the backlinks renders the article again
+    CACHE.render('http://a.com', 'a2', {'http://b.com'})
+    CACHE.render('http://a.com', 'a2', {'http://b.com', 'http://c.com'})
+    assert RENDERS == ['a', 'a2', 'a2']
+
+    # A new cache on the same file picks up where the last one left off
+    CACHE.close()
+    CACHE = RenderCache(to_html, 'test', path=path)
+    assert CACHE.render('http://a.com', 'a2',
+        {'http://b.com', 'http://c.com'}) == 'a2 <- http://b.com http://c.com'
+    assert len(RENDERS) == 3
+
+    # Other formatters don't share the HTML
+    OTHER = RenderCache(to_html, 'other', path=path)
+    OTHER.render('http://a.com', 'a2', {'http://b.com', 'http://c.com'})
+    assert len(RENDERS) == 4
+    OTHER.close()
+
+    CACHE.discard('http://a.com')
+    CACHE.render('http://a.com', 'a2', {'http://b.com', 'http://c.com'})
+    assert len(RENDERS) == 5
+    CACHE.close()
+
+# Without a path, the HTML is only kept in memory, within its size limit
+SMALL = RenderCache(to_html, 'test', size=100)
+SMALL.render('http://a.com', 'x' * 50, set())
+SMALL.render('http://b.com', 'y' * 50, set())
+SMALL.render('http://a.com', 'x' * 50, set())
+assert len(RENDERS) == 8
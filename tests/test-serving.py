@@ -0,0 +1,131 @@
+"""
+Tests that the threaded and asyncio servers handle requests concurrently,
+turn requests away once their queue is full, and send streamed responses as
+they are produced.
+"""
+
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from myweb.frontend.web import serving
+
+RELEASE = threading.Event()
+SLOW_STARTED = threading.Semaphore(0)
+STREAMED = threading.Event()
+
+def stream():
+    yield b'first\n'
+    STREAMED.wait(5)
+    yield b'second\n' if STREAMED.is_set() else b'too late\n'
+
+def application(environ, start_response):
+    if environ['PATH_INFO'] == '/slow':
+        SLOW_STARTED.release()
+        RELEASE.wait(5)
+    elif environ['PATH_INFO'] == '/stream':
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return stream()
+
+    body = '{} {} {}'.format(environ['REQUEST_METHOD'], environ['PATH_INFO'],
+        environ['QUERY_STRING'])
+    if environ['REQUEST_METHOD'] == 'POST':
+        length = int(environ['CONTENT_LENGTH'])
+        body += ' ' + environ['wsgi.input'].read(length).decode('utf-8')
+
+    body = body.encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+def fetch(base, path, data=None):
+    """
+    Gets the status and body of a response, even if it isn't a 200.
+    """
+    try:
+        with urllib.request.urlopen(base + path, data, timeout=5) as response:
+            return response.status, response.read().decode('utf-8')
+    except urllib.error.HTTPError as err:
+        return err.code, err.read().decode('utf-8')
+
+def fetch_admitted(base, path):
+    """
+    Fetches a path, trying again if it's turned away - a worker can still be
+    finishing off the last request for a moment after its client is done.
+    """
+    deadline = time.monotonic() + 5
+    while True:
+        status, body = fetch(base, path)
+        if status != 503 or time.monotonic() > deadline:
+            return status, body
+        time.sleep(0.01)
+
+for mode in ('threaded', 'asyncio'):
+    RELEASE.clear()
+    server = serving.make_server(mode, '127.0.0.1', 0, application,
+        workers=2, queue_depth=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    assert fetch(base, '/a%20b?x=1') == (200, 'GET /a b x=1'), mode
+    assert fetch(base, '/post', b'body') == (200, 'POST /post  body'), mode
+
+    # A slow request doesn't hold up the others...
+    slow = []
+    slow_thread = threading.Thread(
+        target=lambda: slow.append(fetch_admitted(base, '/slow')))
+    slow_thread.start()
+    assert SLOW_STARTED.acquire(timeout=5), mode
+    assert fetch_admitted(base, '/fast') == (200, 'GET /fast '), mode
+
+    # ...but once every worker is busy, and there's no room in the queue,
+    # requests are turned away
+    second = threading.Thread(
+        target=lambda: slow.append(fetch_admitted(base, '/slow')))
+    second.start()
+    assert SLOW_STARTED.acquire(timeout=5), mode
+    assert fetch(base, '/fast')[0] == 503, mode
+
+    RELEASE.set()
+    slow_thread.join()
+    second.join()
+    assert slow == [(200, 'GET /slow ')] * 2, mode
+
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+# The first piece of a streamed response arrives before the application has
+# produced the rest of it
+for mode in ('threaded', 'asyncio'):
+    server = serving.make_server(mode, '127.0.0.1', 0, application)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    STREAMED.clear()
+    with socket.create_connection(server.server_address[:2], 5) as client:
+        client.sendall(b'GET /stream HTTP/1.0\r\n\r\n')
+        received = b''
+        while b'first' not in received:
+            data = client.recv(4096)
+            assert data, (mode, received)
+            received += data
+
+        STREAMED.set()
+        while data:
+            data = client.recv(4096)
+            received += data
+    assert received.endswith(b'\r\n\r\nfirst\nsecond\n'), (mode, received)
+
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+try:
+    serving.make_server('forking', '127.0.0.1', 0, application)
+    assert False, 'Unknown modes should be rejected'
+except ValueError:
+    pass
@@ -17,3 +17,23 @@ assert CHUNKS == [
     utils.Link('b'),
     utils.Text(' but not [[]]')
 ]
+
+# Links at the very start and end, and links right next to each other
+EDGE_TEXT = '[[a/]][[b]] text [[c]]'
+EDGE_CHUNKS = utils.get_link_chunks(EDGE_TEXT)
+assert EDGE_CHUNKS == [
+    utils.Text(''),
+    utils.Link('a'),
+    utils.Text(''),
+    utils.Link('b'),
+    utils.Text(' text '),
+    utils.Link('c'),
+]
+assert list(utils.iter_link_chunks(EDGE_TEXT)) == EDGE_CHUNKS
+assert utils.get_link_chunks('') == []
+
+# The spans of the links are enough to get the chunks and links back
+SPANS = utils.get_link_spans(EDGE_TEXT)
+assert SPANS == [(0, 6), (6, 11), (17, 22)]
+assert utils.get_link_chunks(EDGE_TEXT, SPANS) == EDGE_CHUNKS
+assert utils.get_links(EDGE_TEXT, SPANS) == {'a', 'b', 'c'}
@@ -0,0 +1,232 @@
+"""
+Tests that the web server compresses responses for clients which accept it,
+serves the static pages precompressed with ETags of their own, answers
+conditional requests for articles with a 304 until they change, and pages
+and streams query results.
+"""
+
+import gzip
+import io
+import json
+import os
+import tempfile
+import zlib
+
+from myweb.backend import db
+from myweb.frontend.web import render_cache, server
+from myweb.frontend.web.formatters import none
+
+def call(app, environ):
+    """
+    Runs a WSGI application, returning the status, headers and body.
+    """
+    response = {}
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+
+    body = b''.join(app(environ, start_response))
+    return response['status'], response['headers'], body
+
+assert server.choose_encoding({}) is None
+assert server.choose_encoding({'HTTP_ACCEPT_ENCODING': 'gzip, deflate'}) == 'gzip'
+assert server.choose_encoding({'HTTP_ACCEPT_ENCODING': 'deflate'}) == 'deflate'
+assert server.choose_encoding(
+    {'HTTP_ACCEPT_ENCODING': 'gzip;q=0.5, deflate;q=0.8'}) == 'deflate'
+assert server.choose_encoding({'HTTP_ACCEPT_ENCODING': 'gzip;q=0, br'}) is None
+assert server.choose_encoding({'HTTP_ACCEPT_ENCODING': '*'}) == 'gzip'
+assert server.choose_encoding(
+    {'HTTP_ACCEPT_ENCODING': '*, gzip;q=0'}) == 'deflate'
+
+# The static pages are the same once they're decompressed, but each version
+# has its own ETag
+status, plain_headers, plain = call(server.generate_search_page, {})
+assert status == '200 OK' and 'Content-Encoding' not in plain_headers
+assert plain_headers['Vary'] == 'Accept-Encoding'
+assert 'max-age' in plain_headers['Cache-Control']
+
+status, gzip_headers, gzipped = call(server.generate_search_page,
+    {'HTTP_ACCEPT_ENCODING': 'gzip'})
+assert gzip_headers['Content-Encoding'] == 'gzip'
+assert int(gzip_headers['Content-Length']) == len(gzipped) < len(plain)
+assert gzip.decompress(gzipped) == plain
+assert gzip_headers['ETag'] != plain_headers['ETag']
+
+status, _, deflated = call(server.generate_search_page,
+    {'HTTP_ACCEPT_ENCODING': 'deflate'})
+assert zlib.decompress(deflated) == plain
+
+status, _, body = call(server.generate_search_page,
+    {'HTTP_ACCEPT_ENCODING': 'gzip', 'HTTP_IF_NONE_MATCH': gzip_headers['ETag']})
+assert status == '304 NOT MODIFIED' and body == b''
+
+# The ETag for the gzipped page doesn't match the uncompressed page
+status, _, _ = call(server.generate_search_page,
+    {'HTTP_IF_NONE_MATCH': gzip_headers['ETag']})
+assert status == '200 OK'
+
+# Only bodies over the threshold are compressed on the fly, and their ETags
+# become weak
+headers, body = server.encode_response({'HTTP_ACCEPT_ENCODING': 'gzip'},
+    {'ETag': '"x"'}, b'small')
+assert body == b'small' and headers['ETag'] == '"x"'
+assert headers['Vary'] == 'Accept-Encoding'
+
+big = b'x' * server.COMPRESS_THRESHOLD
+headers, body = server.encode_response({'HTTP_ACCEPT_ENCODING': 'gzip'},
+    {'ETag': '"x"'}, big)
+assert gzip.decompress(body) == big and headers['ETag'] == 'W/"x"'
+assert headers['Content-Length'] == len(body)
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    db.load_database(os.path.join(temp_dir, 'test.sqlite'))
+    server.FORMAT_TO_HTML = none.to_html
+    server.RENDER_CACHE = render_cache.RenderCache(none.to_html, 'none')
+    db.create_article('http://a.com', 'lorem ipsum ' * 1000, set(), {'x'})
+
+    def get_article(**environ):
+        environ = dict(environ, REQUEST_METHOD='GET',
+            PATH_INFO='/ajax/get-article', QUERY_STRING='uri=http://a.com')
+        return call(server.application, environ)
+
+    status, headers, body = get_article(HTTP_ACCEPT_ENCODING='gzip')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(body).decode('utf-8'))['tags'] == ['x']
+
+    # The weakened ETag still matches when the article is fetched again
+    status, _, _ = get_article(HTTP_ACCEPT_ENCODING='gzip',
+        HTTP_IF_NONE_MATCH=headers['ETag'])
+    assert status == '304 NOT MODIFIED'
+
+    status, headers, body = get_article()
+    assert 'Content-Encoding' not in headers
+    assert json.loads(body.decode('utf-8'))['tags'] == ['x']
+
+    status, headers, body = call(server.application, {'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/raw/http://a.com', 'HTTP_ACCEPT_ENCODING': 'deflate'})
+    assert zlib.decompress(body).decode('utf-8') == 'lorem ipsum ' * 1000
+
+    # A path which isn't UTF-8 (as a server gives out /raw/%FF) names nothing
+    status, _, _ = call(server.application, {'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/raw/\xff'})
+    assert status.startswith('404')
+
+    # An article which hasn't changed since the client last fetched it is
+    # answered with a 304, going by either its ETag or its modification time
+    status, headers, _ = get_article()
+    etag, last_modified = headers['ETag'], headers['Last-Modified']
+    assert status == '200 OK'
+
+    status, _, body = get_article(HTTP_IF_NONE_MATCH=etag)
+    assert status == '304 NOT MODIFIED' and body == b''
+    status, _, body = get_article(HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert status == '304 NOT MODIFIED' and body == b''
+    status, _, _ = get_article(
+        HTTP_IF_MODIFIED_SINCE='Thu, 01 Jan 1970 00:00:00 GMT')
+    assert status == '200 OK'
+
+    _, raw_headers, _ = call(server.application, {'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/raw/http://a.com'})
+    status, _, _ = call(server.application, {'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/raw/http://a.com',
+        'HTTP_IF_NONE_MATCH': raw_headers['ETag']})
+    assert status == '304 NOT MODIFIED'
+
+    def post(path, request):
+        request_body = bytes(json.dumps(request), 'utf-8')
+        environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': path,
+            'CONTENT_LENGTH': str(len(request_body)),
+            'wsgi.input': io.BytesIO(request_body)}
+        return call(server.application, environ)
+
+    # Editing the article gives it a new ETag, which wins out over a
+    # Last-Modified that may not have moved on within the same second
+    post('/ajax/submit-edit',
+        {'uri': 'http://a.com', 'content': 'edited', 'tags': ['x']})
+    status, headers, body = get_article(HTTP_IF_NONE_MATCH=etag,
+        HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert status == '200 OK' and headers['ETag'] != etag
+    assert json.loads(body.decode('utf-8'))['raw-content'] == 'edited'
+    etag = headers['ETag']
+
+    status, headers, _ = call(server.application, {'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/raw/http://a.com',
+        'HTTP_IF_NONE_MATCH': raw_headers['ETag']})
+    assert status == '200 OK' and headers['ETag'] != raw_headers['ETag']
+
+    # So does a new backlink, even though the article itself wasn't touched
+    post('/ajax/submit-new',
+        {'uri': 'http://d.com', 'content': '[[http://a.com]]', 'tags': []})
+    status, headers, _ = get_article(HTTP_IF_NONE_MATCH=etag)
+    assert status == '200 OK' and headers['ETag'] != etag
+    db.delete_article('http://d.com')
+
+    # The view page marks the links to URLs which have no article, and
+    # learns that they have one once it is written
+    db.create_article('http://b.com', 'see [[http://c.com]]',
+        {'http://c.com'}, set())
+    def get_missing_links():
+        _, _, body = call(server.application, {'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/ajax/get-article',
+            'QUERY_STRING': 'uri=http://b.com'})
+        return json.loads(body.decode('utf-8'))['missing-links']
+
+    assert b'mark_missing_links' in server.VIEW_PAGE
+    assert get_missing_links() == ['http://c.com']
+    db.create_article('http://c.com', '', set(), set())
+    assert get_missing_links() == []
+    db.delete_article('http://b.com')
+    db.delete_article('http://c.com')
+
+    # Queries can be paged through, or streamed a batch per line
+    for i in range(5):
+        db.create_article('http://{}.com'.format(i), '', set(), {'paged'})
+    expected = ['http://{}.com'.format(i) for i in range(5)]
+
+    def query(request, **environ):
+        request_body = bytes(json.dumps(request), 'utf-8')
+        environ = dict(environ, REQUEST_METHOD='POST',
+            PATH_INFO='/ajax/query', CONTENT_LENGTH=str(len(request_body)))
+        environ['wsgi.input'] = io.BytesIO(request_body)
+        return call(server.application, environ)
+
+    urls = []
+    token = None
+    while True:
+        _, _, body = query({'query': 'paged', 'limit': 2, 'continue': token})
+        result = json.loads(body.decode('utf-8'))
+        assert not result['was-error'] and len(result['articles']) <= 2
+        urls.extend(result['articles'])
+        token = result['continue']
+        if token is None:
+            break
+    assert urls == expected
+
+    _, _, body = query({'query': 'paged', 'limit': 2, 'continue': '!'})
+    assert json.loads(body.decode('utf-8'))['was-error']
+
+    _, headers, body = query({'query': 'paged', 'stream': True, 'limit': 2})
+    assert headers['Content-Type'] == 'application/x-ndjson'
+    lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+    assert [len(line['articles']) for line in lines] == [2, 2, 1]
+    assert sum((line['articles'] for line in lines), []) == expected
+
+    _, headers, body = query({'query': 'paged', 'stream': True},
+        HTTP_ACCEPT_ENCODING='gzip')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(body).decode('utf-8'))['articles'] == \
+        expected
+
+    _, _, body = query({'query': '(paged', 'stream': True})
+    assert json.loads(body.decode('utf-8')) == \
+        {'was-error': True, 'articles': []}
+
+    # The caches' hit rates can be seen from the server
+    _, headers, body = call(server.application,
+        {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/stats'})
+    stats = json.loads(body.decode('utf-8'))
+    assert set(stats) == {'queries', 'results', 'rendered'}
+    assert stats['queries']['hits'] + stats['queries']['misses'] > 0
+    assert 0 <= stats['rendered']['hit-rate'] <= 1
+
+    db.POOL.close()